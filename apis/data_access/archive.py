@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016-2023 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+"""Columnar archives of scenario instances results.
+
+This module provide the `write_archive` function that stores a
+`Scenario` instance as a directory of Parquet files, statistics
+and logs being partitioned by job name, agent name (and suffix)
+with the other OpenBACH tags as columns; and the `ScenarioArchive`
+class that reads them back, lazily, as `Scenario`, `Job`,
+`Statistic` instances or pandas DataFrames.
+
+Both require the optional `pyarrow` package.
+"""
+
+__author__ = 'Mathias ETTINGER <mettinger@toulouse.viveris.com>'
+__all__ = ['ScenarioArchive', 'write_archive', 'read_archive']
+
+
+import os
+import json
+from urllib.parse import quote, unquote
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+from .result_data import Job, Log, Statistic, extract_jobs, get_or_create_scenario
+
+
+SCENARIOS_FILENAME = 'scenarios.parquet'
+JOBS_FILENAME = 'jobs.parquet'
+STATISTICS_DIRECTORY = 'statistics'
+LOGS_DIRECTORY = 'logs'
+STATISTICS_PARTITIONS = ('@job_name', '@agent_name', '@suffix')
+LOGS_PARTITIONS = ('@job_name', '@agent_name')
+TAGS = ('@scenario_instance_id', '@owner_scenario_instance_id', '@job_instance_id')
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+JSON_FIELDS_KEY = b'openbach.json_fields'
+INTEGER_FIELDS_KEY = b'openbach.integer_fields'
+INTEGERS_COLUMN = '@integers:{}'
+LOG_FIELDS = (
+        '_id', '_index', '_type', '_timestamp', '_version',
+        'facility', 'facility_label', 'host', 'message', 'pid',
+        'priority', 'severity', 'severity_label', 'source',
+)
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError('the pyarrow package is required to use scenario archives')
+
+
+def _partition_path(directory, partitions, values):
+    path = [directory]
+    for partition, value in zip(partitions, values):
+        value = NULL_PARTITION if value is None else quote(str(value), safe='')
+        path.append('{}={}'.format(partition, value))
+    return os.path.join(*path)
+
+
+def _parse_partition(name):
+    partition, _, value = name.partition('=')
+    return partition, None if value == NULL_PARTITION else unquote(value)
+
+
+def _statistic_table(statistic, tags):
+    """Convert the content of a `Statistic` into an Arrow table;
+    values that Arrow can not represent faithfully (mixed types,
+    huge integers…) are stored JSON-encoded and integers mixed
+    with floats are flagged in a parallel boolean column.
+    """
+    size = len(statistic)
+    timestamps = statistic.timestamps
+    columns = {'time': pa.array(timestamps if timestamps.dtype != object else timestamps.tolist())}
+    columns.update((tag, pa.array(np.full(size, value, dtype=np.int64))) for tag, value in zip(TAGS, tags))
+    json_fields = []
+    integers = {}
+    for name in statistic.fields:
+        values = statistic.numpy(name)
+        mask = np.ma.getmask(values)
+        mask = None if mask is np.ma.nomask else mask
+        values = np.ma.getdata(values)
+        if values.dtype != object:
+            columns[name] = pa.array(values, mask=mask)
+            flags = statistic.integers(name)
+            if flags is not None:
+                integers[name] = pa.array(flags)
+            continue
+        values = values.tolist()
+        if mask is not None:
+            values = [None if missing else value for value, missing in zip(values, mask.tolist())]
+        if all(isinstance(value, str) for value in values if value is not None):
+            columns[name] = pa.array(values, type=pa.string())
+        else:
+            columns[name] = pa.array([None if value is None else json.dumps(value) for value in values], type=pa.string())
+            json_fields.append(name)
+    columns.update((INTEGERS_COLUMN.format(name), flags) for name, flags in integers.items())
+    return pa.table(columns, metadata={
+            JSON_FIELDS_KEY: json.dumps(json_fields),
+            INTEGER_FIELDS_KEY: json.dumps(list(integers)),
+    })
+
+
+def _logs_table(logs, tags):
+    entries = [log.json for log in logs.numbered_data.values()]
+    columns = {tag: pa.array(np.full(len(entries), value, dtype=np.int64)) for tag, value in zip(TAGS, tags)}
+    columns.update((field, pa.array([entry[field] for entry in entries])) for field in LOG_FIELDS)
+    return pa.table(columns)
+
+
+def write_archive(scenario, directory, compression='zstd'):
+    """Store a `Scenario` instance, its sub-scenarios and their
+    jobs into a new `directory` of Parquet files.
+    """
+    _require_pyarrow()
+    os.makedirs(directory)
+
+    scenarios = [(sub.instance_id, sub.owner_instance_id) for sub in scenario.scenarios]
+    pq.write_table(pa.table({
+            '@scenario_instance_id': pa.array([id for id, _ in scenarios], type=pa.int64()),
+            '@owner_scenario_instance_id': pa.array([owner for _, owner in scenarios], type=pa.int64()),
+    }), os.path.join(directory, SCENARIOS_FILENAME), compression=compression)
+
+    jobs = list(extract_jobs(scenario))
+    pq.write_table(pa.table({
+            '@scenario_instance_id': pa.array([id for id, _, _ in jobs], type=pa.int64()),
+            '@owner_scenario_instance_id': pa.array([owner for _, owner, _ in jobs], type=pa.int64()),
+            '@job_instance_id': pa.array([job.instance_id for _, _, job in jobs], type=pa.int64()),
+            '@job_name': pa.array([job.name for _, _, job in jobs], type=pa.string()),
+            '@agent_name': pa.array([job.agent for _, _, job in jobs], type=pa.string()),
+    }), os.path.join(directory, JOBS_FILENAME), compression=compression)
+
+    for scenario_id, owner_id, job in jobs:
+        tags = (scenario_id, owner_id, job.instance_id)
+        filename = 'part-{}-{}.parquet'.format(scenario_id, job.instance_id)
+        for (suffix,), statistic in job.statistics_data.items():
+            path = _partition_path(
+                    os.path.join(directory, STATISTICS_DIRECTORY),
+                    STATISTICS_PARTITIONS, (job.name, job.agent, suffix))
+            os.makedirs(path, exist_ok=True)
+            pq.write_table(_statistic_table(statistic, tags), os.path.join(path, filename), compression=compression)
+        if job.logs_data.numbered_data:
+            path = _partition_path(os.path.join(directory, LOGS_DIRECTORY), LOGS_PARTITIONS, (job.name, job.agent))
+            os.makedirs(path, exist_ok=True)
+            pq.write_table(_logs_table(job.logs_data, tags), os.path.join(path, filename), compression=compression)
+
+
+def _column_to_numpy(column, decode_json=False):
+    """Convert an Arrow column into an array and a mask
+    of missing values (or None if no value is missing).
+    """
+    column = column.combine_chunks() if isinstance(column, pa.ChunkedArray) else column
+    mask = column.is_null().to_numpy(zero_copy_only=False) if column.null_count else None
+    if pa.types.is_integer(column.type) or pa.types.is_floating(column.type):
+        values = column.fill_null(0).to_numpy(zero_copy_only=False)
+    elif pa.types.is_boolean(column.type):
+        values = column.fill_null(False).to_numpy(zero_copy_only=False)
+    else:
+        values = column.to_pylist()
+        if decode_json:
+            values = [None if value is None else json.loads(value) for value in values]
+        array = np.empty(len(values), dtype=object)
+        array[:] = values
+        values = array
+    return values, mask
+
+
+class ScenarioArchive:
+    """Read a directory created by `write_archive`.
+
+    Only the list of scenarios and jobs is read upfront; statistics
+    and logs files are read on demand and can be filtered on their
+    partitions without reading the others.
+    """
+
+    def __init__(self, directory):
+        _require_pyarrow()
+        self.directory = directory
+        self.scenarios = pq.read_table(os.path.join(directory, SCENARIOS_FILENAME)).to_pylist()
+        self.jobs = pq.read_table(os.path.join(directory, JOBS_FILENAME)).to_pylist()
+
+    def _files(self, kind, partitions, filters):
+        """Generate the partition values and path of each Parquet
+        file of the `kind` directory matching the `filters`.
+        """
+        def walk(path, level, values):
+            if level == len(partitions):
+                for entry in sorted(os.scandir(path), key=lambda entry: entry.name):
+                    if entry.is_file() and entry.name.endswith('.parquet'):
+                        yield values, entry.path
+                return
+            for entry in sorted(os.scandir(path), key=lambda entry: entry.name):
+                partition, value = _parse_partition(entry.name)
+                expected = filters.get(partition, ...)
+                if partition == partitions[level] and (expected is ... or expected == value):
+                    yield from walk(entry.path, level + 1, {**values, partition: value})
+
+        root = os.path.join(self.directory, kind)
+        if os.path.isdir(root):
+            yield from walk(root, 0, {})
+
+    def _read(self, path, job_instance_id=None, columns=None):
+        if columns is not None:
+            names = pq.read_schema(path).names
+            columns = [
+                    column for column in ['time', *TAGS] + [
+                        name
+                        for column in columns
+                        for name in (column, INTEGERS_COLUMN.format(column))]
+                    if column in names]
+        filters = None if job_instance_id is None else [('@job_instance_id', '=', job_instance_id)]
+        return pq.read_table(path, columns=columns, filters=filters)
+
+    def statistics_tables(self, job_name=..., agent_name=..., suffix=..., job_instance_id=None, columns=None):
+        """Generate pairs of partition values and Arrow tables of
+        statistics matching the given partitions (use `...` to
+        not filter on a partition) and job instance.
+        """
+        filters = {'@job_name': job_name, '@agent_name': agent_name, '@suffix': suffix}
+        for partitions, path in self._files(STATISTICS_DIRECTORY, STATISTICS_PARTITIONS, filters):
+            table = self._read(path, job_instance_id, columns)
+            if table.num_rows:
+                yield partitions, table
+
+    def dataframe(self, job_name=..., agent_name=..., suffix=..., job_instance_id=None, columns=None):
+        """Build a single pandas DataFrame out of the statistics
+        matching the given filters, tags being stored as columns
+        alongside the timestamps and the statistics.
+        """
+        import pandas as pd  # Only needed here, avoid importing it for the whole module
+
+        frames = []
+        for partitions, table in self.statistics_tables(job_name, agent_name, suffix, job_instance_id, columns):
+            integer_fields = _metadata(table, INTEGER_FIELDS_KEY)
+            df = table.drop([INTEGERS_COLUMN.format(name) for name in integer_fields]).to_pandas()
+            for name in _metadata(table, JSON_FIELDS_KEY):
+                if name in df:
+                    df[name] = df[name].map(json.loads, na_action='ignore')
+            for partition, value in partitions.items():
+                df[partition] = value
+            frames.append(df)
+        if not frames:
+            return pd.DataFrame(columns=['time', *TAGS, *STATISTICS_PARTITIONS])
+        return pd.concat(frames, ignore_index=True)
+
+    def statistic(self, job_name, job_instance_id, agent_name, suffix=None):
+        """Rebuild the `Statistic` of a job instance under a given suffix"""
+        for _, table in self.statistics_tables(job_name, agent_name, suffix, job_instance_id):
+            return Statistic.from_columns(_column_to_numpy(table['time'])[0], _table_columns(table))
+        raise KeyError((job_name, job_instance_id, agent_name, suffix))
+
+    def logs(self, job_name, job_instance_id, agent_name):
+        """Rebuild the `Log` of a job instance"""
+        logs = Log()
+        filters = {'@job_name': job_name, '@agent_name': agent_name}
+        for _, path in self._files(LOGS_DIRECTORY, LOGS_PARTITIONS, filters):
+            table = self._read(path, job_instance_id).select(list(LOG_FIELDS))
+            for entry in table.to_pylist():
+                logs.add_log(**entry)
+        return logs
+
+    def iter_jobs(self):
+        """Generate triplets of scenario instance ID, owner scenario
+        instance ID and `Job` instance, alike to `extract_jobs`;
+        data of each job being read only when it is generated.
+        """
+        statistics = {}
+        for partitions, path in self._files(STATISTICS_DIRECTORY, STATISTICS_PARTITIONS, {}):
+            key = partitions['@job_name'], partitions['@agent_name']
+            statistics.setdefault(key, []).append((partitions['@suffix'], path))
+
+        for description in self.jobs:
+            scenario_id = description['@scenario_instance_id']
+            owner_id = description['@owner_scenario_instance_id']
+            job_instance_id = description['@job_instance_id']
+            name, agent = description['@job_name'], description['@agent_name']
+            job = Job(name, job_instance_id, agent)
+            filename = 'part-{}-{}.parquet'.format(scenario_id, job_instance_id)
+            for suffix, path in statistics.get((name, agent), ()):
+                if os.path.basename(path) == filename:
+                    table = pq.read_table(path)
+                    job.statistics_data[(suffix,)] = Statistic.from_columns(
+                            _column_to_numpy(table['time'])[0], _table_columns(table))
+            job.logs_data = self.logs(name, job_instance_id, agent)
+            yield scenario_id, owner_id, job
+
+    @property
+    def scenario(self):
+        """Rebuild the archived `Scenario` instance"""
+        scenarios = {}
+        for description in self.scenarios:
+            scenario = get_or_create_scenario(description['@scenario_instance_id'], scenarios)
+            owner = get_or_create_scenario(description['@owner_scenario_instance_id'], scenarios)
+            if owner is not scenario:
+                scenario.owner = owner
+                owner.sub_scenarios[(scenario.instance_id,)] = scenario
+        for scenario_id, _, job in self.iter_jobs():
+            scenario = get_or_create_scenario(scenario_id, scenarios)
+            scenario.job_instances[(job.name, job.instance_id, job.agent)] = job
+        root, = (scenario for scenario in scenarios.values() if scenario.owner is None)
+        return root
+
+
+def _metadata(table, key):
+    """Names of the fields listed under `key` in the table metadata
+    and still present in the table.
+    """
+    metadata = table.schema.metadata or {}
+    return [name for name in json.loads(metadata.get(key, b'[]')) if name in table.column_names]
+
+
+def _table_columns(table):
+    """Extract the statistics out of an Arrow table as triplets
+    of values, mask of missing values and flags of integers
+    stored as floats (or None), keyed by name.
+    """
+    json_fields = _metadata(table, JSON_FIELDS_KEY)
+    integer_fields = _metadata(table, INTEGER_FIELDS_KEY)
+    flags = {INTEGERS_COLUMN.format(name) for name in integer_fields}
+    columns = {}
+    for name in table.column_names:
+        if name != 'time' and name not in TAGS and name not in flags:
+            values, mask = _column_to_numpy(table[name], name in json_fields)
+            integers = None
+            if name in integer_fields:
+                integers = _column_to_numpy(table[INTEGERS_COLUMN.format(name)])[0]
+            columns[name] = values, mask, integers
+    return columns
+
+
+def read_archive(directory):
+    """Rebuild the `Scenario` instance stored in `directory`"""
+    return ScenarioArchive(directory).scenario
@@ -33,7 +33,10 @@ __all__ = ['AsyncCollectorConnection']
 import asyncio
 from functools import partial, wraps
 
-from .collector import CollectorConnection
+from .collector import CollectorConnection, merge_bounds, _timed_out
+from .async_tools import (
+        aiohttp, build_async_session,
+        AsyncInfluxDBConnection, AsyncElasticSearchConnection)
 
 
 def _make_coroutine(function):
@@ -46,16 +49,27 @@ def _make_coroutine(function):
     return wrapper
 
 
+def _native(coroutine):
+    """Use the given coroutine if aiohttp is available or fall back
+    to running the blocking base method in an executor otherwise.
+    """
+    if aiohttp is None:
+        return _make_coroutine(getattr(CollectorConnection, coroutine.__name__))
+    return coroutine
+
+
 class MakeAsync(type):
     """Helper metaclass used to wrap public methods of base classes
     into coroutines.
+
+    Methods already defined in the class body are left untouched.
     """
 
     def __new__(mcls, name, bases, dct):
         for base in bases:
-            for name, function in vars(base).items():
-                if not name.startswith('_') and callable(function):
-                    dct[name] = _make_coroutine(function)
+            for method_name, function in vars(base).items():
+                if not method_name.startswith('_') and callable(function) and method_name not in dct:
+                    dct[method_name] = _make_coroutine(function)
 
         return type.__new__(mcls, name, bases, dct)
 
@@ -63,20 +77,169 @@ class MakeAsync(type):
 class AsyncCollectorConnection(CollectorConnection, metaclass=MakeAsync):
     """Asynchronous wrapper over CollectorConnection.
 
-    Each public method of the base class is wrapped into a
-    coroutine and scheduled in an event loop using its
-    run_in_executor method. The default executor is used so
-    it is up to the user of this class to configure the
-    proper executor as the default one for the loop.
+    Lookup methods (`agent_names`, `job_names`, `job_instance_ids`,
+    `scenario_instance_ids`, `timestamps` and `suffixes`) are native
+    coroutines querying both databases concurrently through a pooled
+    `aiohttp.ClientSession`, so fanning out many of them does not tie
+    up threads. The native connections are also available as the
+    `async_influxdb` and `async_elasticsearch` attributes.
+
+    Each other public method of the base class (or every one of them
+    if aiohttp is not installed) is wrapped into a coroutine and
+    scheduled in an event loop using its run_in_executor method. The
+    default executor is used so it is up to the user of this class
+    to configure the proper executor as the default one for the loop.
 
     The event loop used by this class is asyncio's current
-    loop, retrieved when building an instance.
+    loop, retrieved when building an instance. Use the instance
+    as an asynchronous context manager, or call its `close`
+    coroutine, to release the connections when done.
     """
 
     def __init__(self, collector_ip,
                  elasticsearch_port=9200,
                  influxdb_port=8086,
                  database_name='openbach',
-                 epoch='ms'):
-        super().__init__(collector_ip, elasticsearch_port, influxdb_port, database_name, epoch)
+                 epoch='ms', *,
+                 session=None,
+                 compress=False,
+                 cache=None,
+                 timeout=None,
+                 async_session=None):
+        super().__init__(
+                collector_ip, elasticsearch_port, influxdb_port,
+                database_name, epoch, session=session,
+                compress=compress, cache=cache, timeout=timeout)
         self.loop = asyncio.get_event_loop()
+        self.async_session = async_session
+        self._owns_async_session = async_session is None
+        if aiohttp is None:
+            self.async_influxdb = self.async_elasticsearch = None
+        else:
+            self.async_influxdb = AsyncInfluxDBConnection(
+                    collector_ip, influxdb_port, database_name, epoch,
+                    session=async_session, compress=compress)
+            self.async_elasticsearch = AsyncElasticSearchConnection(
+                    collector_ip, elasticsearch_port,
+                    session=async_session, compress=compress)
+
+    def _connections(self):
+        """Share a single pooled session between both native connections"""
+        if self.async_session is None:
+            self.async_session = build_async_session()
+            for connection in (self.async_influxdb, self.async_elasticsearch):
+                connection._session = self.async_session
+                connection._owns_session = False
+        return self.async_influxdb, self.async_elasticsearch
+
+    async def close(self):
+        """Close the native connections session if it was created by this instance"""
+        if self._owns_async_session and self.async_session is not None:
+            await self.async_session.close()
+            self.async_session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, exc_traceback):
+        await self.close()
+
+    async def _gather_both(self, influxdb_query, elasticsearch_query, default=None):
+        """Await both coroutines concurrently and return the pair of
+        their results; using `default` for a query that timed out.
+        """
+        tasks = {
+                asyncio.ensure_future(influxdb_query): 'InfluxDB',
+                asyncio.ensure_future(elasticsearch_query): 'ElasticSearch',
+        }
+        done, pending = await asyncio.wait(tasks, timeout=self.timeout)
+        for task in pending:
+            task.cancel()
+            _timed_out(tasks[task], self.timeout)
+        results = {tasks[task]: task.result() for task in done}
+        return results.get('InfluxDB', default), results.get('ElasticSearch', default)
+
+    @_native
+    async def agent_names(
+            self, job_name=None, scenario_instance_id=None,
+            job_instance_id=None, suffix=None, timestamps=None):
+        """List all the avaible agent names in InfluxDB and ElasticSearch"""
+        influxdb, elasticsearch = self._connections()
+        influx_names, elastic_names = await self._gather_both(
+                influxdb.agent_names(job_name, scenario_instance_id, job_instance_id, suffix),
+                elasticsearch.agent_names(job_name, scenario_instance_id, job_instance_id, timestamps),
+                set())
+        return influx_names | elastic_names
+
+    @_native
+    async def job_names(
+            self, scenario_instance_id=None, agent_name=None,
+            job_instance_id=None, suffix=None, timestamps=None):
+        """List all the avaible job names in InfluxDB and ElasticSearch"""
+        influxdb, elasticsearch = self._connections()
+        influx_names, elastic_names = await self._gather_both(
+                influxdb.job_names(scenario_instance_id, agent_name, job_instance_id, suffix),
+                elasticsearch.job_names(scenario_instance_id, agent_name, job_instance_id, timestamps),
+                set())
+        return influx_names | elastic_names
+
+    @_native
+    async def job_instance_ids(
+            self, job_name=None, scenario_instance_id=None,
+            agent_name=None, suffix=None, timestamps=None):
+        """List all the avaible job instance IDs in InfluxDB and ElasticSearch"""
+        influxdb, elasticsearch = self._connections()
+        influx_ids, elastic_ids = await self._gather_both(
+                influxdb.job_instance_ids(job_name, scenario_instance_id, agent_name, suffix),
+                elasticsearch.job_instance_ids(job_name, scenario_instance_id, agent_name, timestamps),
+                set())
+        return influx_ids | elastic_ids
+
+    @_native
+    async def scenario_instance_ids(
+            self, job_name=None, agent_name=None,
+            job_instance_id=None, suffix=None, timestamps=None):
+        """List all the avaible scenario instance IDs in InfluxDB and ElasticSearch"""
+        influxdb, elasticsearch = self._connections()
+        influx_ids, elastic_ids = await self._gather_both(
+                influxdb.scenario_instance_ids(job_name, agent_name, job_instance_id, suffix),
+                elasticsearch.scenario_instance_ids(job_name, agent_name, job_instance_id, timestamps),
+                set())
+        return influx_ids | elastic_ids
+
+    @_native
+    async def timestamps(
+            self, job_name=None, scenario_instance_id=None,
+            agent_name=None, job_instance_id=None, suffix=None,
+            condition=None, only_bounds=True):
+        """List all the avaible timestamps in InfluxDB and ElasticSearch
+        that correspond to the given constraints.
+
+        Sort them before returning the list. Optionally return only
+        a couple containing the minimum and maximum values, computed
+        by the databases themselves.
+        """
+        influxdb, elasticsearch = self._connections()
+        if only_bounds:
+            bounds = await self._gather_both(
+                    influxdb.bounds(job_name, scenario_instance_id, agent_name, job_instance_id, suffix, condition),
+                    elasticsearch.timestamp_bounds(job_name, scenario_instance_id, agent_name, job_instance_id))
+            return merge_bounds(*bounds)
+
+        influx_timestamps, elastic_timestamps = await self._gather_both(
+                influxdb.timestamps(job_name, scenario_instance_id, agent_name, job_instance_id, suffix, condition),
+                elasticsearch.timestamps(job_name, scenario_instance_id, agent_name, job_instance_id),
+                set())
+        timestamps = (influx_timestamps | elastic_timestamps) - {None}
+
+        if not timestamps:
+            return None
+        return sorted(timestamps)
+
+    @_native
+    async def suffixes(
+            self, job_name=None, scenario_instance_id=None,
+            agent_name=None, job_instance_id=None):
+        """List the available suffixes in InfluxDB"""
+        influxdb, _ = self._connections()
+        return await influxdb.suffixes(job_name, scenario_instance_id, agent_name, job_instance_id)
@@ -0,0 +1,498 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them.
+# It is composed of an Auditorium (HMIs), a Controller, a Collector
+# and multiple Agents (one for each network entity that wants to be
+# tested).
+#
+#
+# Copyright © 2016-2023 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY, without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see http://www.gnu.org/licenses/.
+
+"""Collection of tools to fetch information from the databases of
+a collector without blocking an asyncio event loop.
+
+This module provide:
+    * `AsyncInfluxDBConnection`: a class to fetch and send data
+    to/from an InfluxDB server using coroutines.
+    * `AsyncElasticSearchConnection`: a class to fetch and send data
+    to/from an ElasticSearch server using coroutines.
+
+Both classes require the optional `aiohttp` package and share the
+query building and parsing tools of their synchronous counterparts.
+"""
+
+__author__ = 'Mathias ETTINGER <mettinger@toulouse.viveris.com>'
+__all__ = ['AsyncInfluxDBConnection', 'AsyncElasticSearchConnection', 'build_async_session']
+
+
+import json
+import asyncio
+from contextlib import suppress
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from .sessions import POOL_SIZE, compress_body
+from .influxdb_tools import (
+        DEFAULT_CHUNK_SIZE, tags_to_condition, select_query,
+        measurement_query, tag_query, bounds_queries, parse_bounds,
+        parse_influx, parse_statistics)
+from .elasticsearch_tools import (
+        SCROLL_DURATION, SEARCH_FILTER_PATH, LOG_SOURCE_FIELDS, AGGREGATION_PAGE_SIZE, TIMESTAMP_FIELDS,
+        tags_to_query, extract_field_or_None, convert_or_None, extract_log_timestamp_or_None, parse_logs, bounds_query, parse_aggregated_bounds,
+        _tag_fields, _keyword_candidate)
+
+
+def build_async_session(pool_size=POOL_SIZE):
+    """Create an `aiohttp.ClientSession` whose connections are
+    kept alive and pooled (up to `pool_size` at once).
+
+    Must be called from a coroutine.
+    """
+    if aiohttp is None:
+        raise ImportError('the aiohttp package is required to use asynchronous connections')
+    connector = aiohttp.TCPConnector(limit=pool_size)
+    return aiohttp.ClientSession(connector=connector)
+
+
+class _AsyncCommunicator:
+    """Manage the `aiohttp.ClientSession` used to send requests"""
+
+    # Requests (connection, data) timeouts in second
+    TIMEOUT = aiohttp and aiohttp.ClientTimeout(total=None, sock_connect=2, sock_read=3600)
+
+    def __init__(self, session=None, compress=False):
+        if aiohttp is None:
+            raise ImportError('the aiohttp package is required to use asynchronous connections')
+        self._session = session
+        self._owns_session = session is None
+        self.compress = compress
+
+    @property
+    def session(self):
+        """The session requests are sent through, created on
+        first use as it must be built from within a coroutine.
+        """
+        if self._session is None:
+            self._session = build_async_session()
+        return self._session
+
+    async def close(self):
+        """Close the session if it was created by this instance"""
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, exc_traceback):
+        await self.close()
+
+    def _body(self, data, headers=None):
+        if self.compress:
+            return compress_body(data, headers)
+        return data.encode(), headers
+
+
+###############################
+# Fetching and receiving data #
+###############################
+
+class AsyncInfluxDBCommunicator(_AsyncCommunicator):
+    """Manage asynchronous network access to an InfluxDB server"""
+
+    def __init__(self, ip, port=8086, db_name='openbach', precision='ms', *, session=None, compress=False):
+        """Configure the routes to send/get data to/from InfluxDB.
+
+        Requests are sent through the given `aiohttp.ClientSession`,
+        or through a new pooled session if none is provided. Bodies
+        of write requests are gzipped if `compress` is True.
+        """
+        super().__init__(session, compress)
+        base_url = 'http://{}:{}/'.format(ip, port)
+        self.writing_URL = base_url + 'write'
+        self.querying_URL = base_url + 'query'
+        self.writing_params = {'db': db_name, 'precision': precision}
+        self.querying_params = {'db': db_name, 'epoch': precision}
+        self.precision = precision
+
+    async def sql_query(self, query):
+        """Send a query to InfluxDB and gather the results"""
+        params = dict(self.querying_params, q=query)
+        async with self.session.get(self.querying_URL, params=params, timeout=self.TIMEOUT) as response:
+            return await response.json(content_type=None)
+
+    async def chunked_query(self, query, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Send a query to InfluxDB and asynchronously generate the
+        results as they arrive, in chunks of at most `chunk_size` points.
+        """
+        params = dict(self.querying_params, q=query, chunked='true', chunk_size=str(chunk_size))
+        async with self.session.get(self.querying_URL, params=params, timeout=self.TIMEOUT) as response:
+            async for line in response.content:
+                if line.strip():
+                    yield json.loads(line)
+
+    async def _query(self, query, chunk_size=None):
+        """Gather the whole response of the query, through either
+        `sql_query` or `chunked_query` depending on `chunk_size`.
+        """
+        if chunk_size is None:
+            return await self.sql_query(query)
+        return [chunk async for chunk in self.chunked_query(query, chunk_size)]
+
+    async def data_write(self, data):
+        """Send data to InfluxDB so they are stored"""
+        body, headers = self._body(data)
+        async with self.session.post(
+                self.writing_URL, params=self.writing_params,
+                data=body, headers=headers, timeout=self.TIMEOUT) as response:
+            await response.read()
+            return response
+
+
+class AsyncInfluxDBConnection(AsyncInfluxDBCommunicator):
+    async def agent_names(self, job=None, scenario=None, job_instance=None, suffix=None):
+        """List the available agent names in InfluxDB
+        that correspond to the given constraints.
+        """
+        condition = tags_to_condition(scenario, None, job_instance, suffix)
+        response = await self.sql_query(tag_query('@agent_name', job, condition))
+        return {tag['value'] for _, tag in parse_influx(response)}
+
+    async def job_names(self, scenario=None, agent=None, job_instance=None, suffix=None):
+        """List the available job names in InfluxDB
+        that correspond to the given constraints.
+        """
+        condition = tags_to_condition(scenario, agent, job_instance, suffix)
+        response = await self.sql_query(measurement_query(condition=condition))
+        return {tag['name'] for _, tag in parse_influx(response)}
+
+    async def job_instance_ids(self, job=None, scenario=None, agent=None, suffix=None):
+        """List the available job instance IDs in InfluxDB
+        that correspond to the given constraints.
+        """
+        condition = tags_to_condition(scenario, agent, None, suffix)
+        response = await self.sql_query(tag_query('@job_instance_id', job, condition))
+        return {int(tag['value']) for _, tag in parse_influx(response)}
+
+    async def scenario_instance_ids(self, job=None, agent=None, job_instance=None, suffix=None):
+        """List the available scenario instance IDs in InfluxDB
+        that correspond to the given constraints.
+        """
+        condition = tags_to_condition(None, agent, job_instance, suffix)
+        response = await self.sql_query(tag_query('@scenario_instance_id', job, condition))
+        return {int(tag['value']) for _, tag in parse_influx(response)}
+
+    async def suffixes(self, job=None, scenario=None, agent=None, job_instance=None):
+        """List the available suffixes in InfluxDB
+        that correspond to the given constraints.
+        """
+        condition = tags_to_condition(scenario, agent, job_instance, None)
+        response = await self.sql_query(tag_query('@suffix', job, condition))
+        return {tag['value'] for _, tag in parse_influx(response)}
+
+    async def timestamps(
+            self, job=None, scenario=None, agent=None,
+            job_instance=None, suffix=None, condition=None):
+        """List the available timestamps in InfluxDB
+        that correspond to the given constraints.
+        """
+        condition = tags_to_condition(scenario, agent, job_instance, suffix, condition)
+        response = await self.sql_query(select_query(job, condition=condition))
+        return {stat['time'] for _, stat in parse_influx(response)}
+
+    async def origin(self, job=None, scenario=None, agent=None,
+                     job_instance=None, suffix=None, condition=None):
+        """Retrieve the first timestamp in InfluxDB
+        that correspond to the given constraints.
+        """
+        condition = tags_to_condition(scenario, agent, job_instance, suffix)
+        query = '{} LIMIT 1'.format(select_query(job, condition=condition))
+        response = await self.sql_query(query)
+        with suppress(ValueError, KeyError):
+            (_, origin_stat), = parse_influx(response)
+            return origin_stat['time']
+
+    async def bounds(self, job=None, scenario=None, agent=None,
+                     job_instance=None, suffix=None, condition=None):
+        """Retrieve the first and last timestamps in InfluxDB
+        that correspond to the given constraints.
+        """
+        condition = tags_to_condition(scenario, agent, job_instance, suffix, condition)
+        first, last = bounds_queries(job, condition)
+        first, last = await asyncio.gather(self.sql_query(first), self.sql_query(last))
+        return parse_bounds(first, last)
+
+    async def raw_statistics(
+            self, job=None, scenario=None, agent=None, job_instance=None,
+            suffix=None, fields=None, condition=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Fetch data from InfluxDB that correspond to the given constraints
+        and asynchronously generate values in series as each chunk of at
+        most `chunk_size` points arrives.
+        """
+        _condition = tags_to_condition(scenario, agent, job_instance, suffix, condition)
+        async for chunk in self.chunked_query(select_query(job, fields, _condition), chunk_size):
+            for serie in parse_influx(chunk):
+                yield serie
+
+    async def statistics(
+            self, job=None, scenario=None, agent=None, job_instance=None,
+            suffix=None, fields=None, condition=None, chunk_size=None):
+        """Fetch data from InfluxDB that correspond to the given constraints
+        and return the list of according `Scenario`s instances.
+        """
+        _condition = tags_to_condition(scenario, agent, job_instance, suffix, condition, subscenarios=True)
+        response = await self._query(select_query(job, fields, _condition), chunk_size)
+
+        if scenario is not None:
+            for scenario_instance in parse_statistics(response):
+                if scenario_instance.instance_id == scenario:
+                    owner = scenario_instance.owner_instance_id
+                    _condition = tags_to_condition(owner, agent, job_instance, suffix, condition, subscenarios=True)
+                    response = await self._query(select_query(job, fields, _condition), chunk_size)
+                    break
+        return list(parse_statistics(response))
+
+
+class AsyncElasticSearchCommunicator(_AsyncCommunicator):
+    """Manage asynchronous network access to an ElasticSearch server"""
+
+    def __init__(self, ip, port=9200, credentials=None, *, session=None, compress=False):
+        """Configure the routes to send/get data to/from ElasticSearch.
+
+        Requests are sent through the given `aiohttp.ClientSession`,
+        or through a new pooled session if none is provided. Bodies
+        of write requests are gzipped if `compress` is True.
+        """
+        super().__init__(session, compress)
+        base_url = 'http://{}:{}'.format(ip, port)
+        self.settings_URL = base_url + '/logstash-*/_settings/'
+        self.querying_URL = base_url + '/logstash-*/_search'
+        self.writing_URL = base_url + '/_bulk'
+        self.scrolling_URL = base_url + '/_search/scroll'
+        self.deleting_URL = base_url + '/logstash-*/_delete_by_query'
+        self.mapping_URL = base_url + '/logstash-*/_mapping/field/'
+        if credentials is None:
+            self.auth_header = None
+        else:
+            self.auth_header = {'Authorization': 'Basic {}'.format(credentials)}
+        self._keyword_fields = {}
+
+    async def _post(self, url, **kwargs):
+        async with self.session.post(url, headers=self.auth_header, timeout=self.TIMEOUT, **kwargs) as response:
+            return await response.json(content_type=None)
+
+    async def settings_query(self, *settings):
+        filters = ','.join(settings)
+        async with self.session.get(self.settings_URL + filters, headers=self.auth_header, timeout=self.TIMEOUT) as response:
+            return await response.json(content_type=None)
+
+    async def search_pages(self, body=None, **query):
+        """Send a query to ElasticSearch and asynchronously
+        generate each page of hits as it is scrolled through.
+        """
+        query['scroll'] = SCROLL_DURATION
+        filter_path = query.setdefault('filter_path', SEARCH_FILTER_PATH)
+        scroll_params = {'filter_path': filter_path} if filter_path else None
+        scroll_id = None
+        try:
+            response = await self._post(self.querying_URL, params=query, json=body)
+            while True:
+                scroll_id = response.get('_scroll_id', scroll_id)
+                hits = response.get('hits', {}).get('hits', [])
+                if not hits:
+                    break
+                yield hits
+                if scroll_id is None:
+                    break
+                body = {'scroll': SCROLL_DURATION, 'scroll_id': scroll_id}
+                response = await self._post(self.scrolling_URL, params=scroll_params, json=body)
+        finally:
+            if scroll_id is not None:
+                await self.clear_scroll(scroll_id)
+
+    async def clear_scroll(self, *scroll_ids):
+        """Release the server-side contexts of the given scroll cursors"""
+        with suppress(aiohttp.ClientError):
+            body = {'scroll_id': list(scroll_ids)}
+            async with self.session.delete(self.scrolling_URL, json=body, headers=self.auth_header, timeout=self.TIMEOUT):
+                pass
+
+    async def search_query(self, body=None, **query):
+        """Send a query to ElasticSearch and asynchronously generate the results"""
+        async for hits in self.search_pages(body, **query):
+            for hit in hits:
+                yield hit
+
+    async def keyword_field(self, field_name):
+        """Retrieve the name of the field that can be used to filter
+        on the exact values of `field_name`: either the field itself
+        or its `.keyword` sub-field; or None if neither are mapped
+        with an aggregatable type.
+        """
+        with suppress(KeyError):
+            return self._keyword_fields[field_name]
+
+        candidates = (field_name, field_name + '.keyword')
+        url = self.mapping_URL + ','.join(candidates)
+        async with self.session.get(url, headers=self.auth_header, timeout=self.TIMEOUT) as response:
+            try:
+                mapping = await response.json(content_type=None)
+            except ValueError:
+                # Not cached: the server may answer properly next time
+                return None
+        if not isinstance(mapping, dict) or 'error' in mapping:
+            return None
+
+        keyword = _keyword_candidate(mapping, candidates)
+        if mapping:
+            # Not cached without indices: fields are mapped once logs are written
+            self._keyword_fields[field_name] = keyword
+        return keyword
+
+    async def distinct_query(self, field_name, body=None, page_size=AGGREGATION_PAGE_SIZE):
+        """Asynchronously generate the distinct values of `field_name`
+        amongst the documents matching the query, using a composite
+        aggregation paginated with its `after_key`. Documents without
+        this field are reported using a None value.
+
+        Raise `LookupError` if the field can not be aggregated.
+        """
+        keyword = await self.keyword_field(field_name)
+        if keyword is None:
+            raise LookupError('field {} is not mapped as a keyword'.format(field_name))
+
+        composite = {
+                'size': page_size,
+                'sources': [{field_name: {'terms': {'field': keyword, 'missing_bucket': True}}}],
+        }
+        body = dict(body or {}, size=0, aggs={'distinct': {'composite': composite}})
+        while True:
+            response = await self._post(self.querying_URL, json=body)
+            if 'error' in response:
+                raise LookupError(response['error'])
+            aggregation = response.get('aggregations', {}).get('distinct', {})
+            buckets = aggregation.get('buckets', [])
+            for bucket in buckets:
+                yield bucket['key'][field_name]
+            after_key = aggregation.get('after_key')
+            if not buckets or after_key is None:
+                break
+            composite['after'] = after_key
+
+    async def delete_query(self, query):
+        """Send query to ElasticSearch so that matching logs are removed"""
+        return await self._post(self.deleting_URL, json=query)
+
+    async def data_write(self, body):
+        """Send data to ElasticSearch so they are stored"""
+        data, headers = self._body(body, self.auth_header)
+        async with self.session.post(self.writing_URL, data=data, headers=headers, timeout=self.TIMEOUT) as response:
+            await response.read()
+            return response
+
+
+class AsyncElasticSearchConnection(AsyncElasticSearchCommunicator):
+    async def tags_query(self, scenario, job, agent, job_instance, timestamps, source_fields=None):
+        """Build an ElasticSearch query out of the given parameters
+        using `tags_to_query`, filtering on the exact value of tags
+        as mapped by the server.
+        """
+        exact_fields = {
+                field_name: await self.keyword_field(field_name)
+                for field_name in _tag_fields(scenario, job, agent, job_instance)
+        }
+        return tags_to_query(scenario, job, agent, job_instance, timestamps, source_fields, exact_fields)
+
+    async def _field_values(self, field_name, query, converter=str):
+        """Gather the distinct values of a field through an aggregation,
+        falling back to scrolling through each matching document if the
+        server does not map this field as a keyword.
+        """
+        try:
+            values = [value async for value in self.distinct_query(field_name, query)]
+        except LookupError:
+            response = self.search_query(query, fields=field_name)
+            return {extract_field_or_None(record, field_name, converter) async for record in response}
+        else:
+            return {convert_or_None(value, converter) for value in values}
+
+    async def agent_names(self, job=None, scenario=None, job_instance=None, timestamps=None):
+        """List the available agent names in ElasticSearch
+        that correspond to the given constraints.
+        """
+        query = await self.tags_query(scenario, job, None, job_instance, timestamps)
+        return await self._field_values('agent_name', query)
+
+    async def job_names(self, scenario=None, agent=None, job_instance=None, timestamps=None):
+        """List the available job names in ElasticSearch
+        that correspond to the given constraints.
+        """
+        query = await self.tags_query(scenario, None, agent, job_instance, timestamps)
+        return await self._field_values('program', query)
+
+    async def job_instance_ids(self, job=None, scenario=None, agent=None, timestamps=None):
+        """List the available job instance IDs in ElasticSearch
+        that correspond to the given constraints.
+        """
+        query = await self.tags_query(scenario, job, agent, None, timestamps)
+        return await self._field_values('job_instance_id', query, int)
+
+    async def scenario_instance_ids(self, job=None, agent=None, job_instance=None, timestamps=None):
+        """List the available scenario instance IDs in ElasticSearch
+        that correspond to the given constraints.
+        """
+        query = await self.tags_query(None, job, agent, job_instance, timestamps)
+        return await self._field_values('scenario_instance_id', query, int)
+
+    async def timestamps(self, job=None, scenario=None, agent=None, job_instance=None):
+        """List the available timestamps in ElasticSearch
+        that correspond to the given constraints.
+        """
+        query = await self.tags_query(scenario, job, agent, job_instance, None)
+        response = self.search_query(query, fields=TIMESTAMP_FIELDS)
+        return {extract_log_timestamp_or_None(record) async for record in response}
+
+    async def timestamp_bounds(self, job=None, scenario=None, agent=None, job_instance=None):
+        """Retrieve the first and last timestamps in ElasticSearch
+        that correspond to the given constraints, using min and max
+        aggregations on the `@timestamp` field; falling back to going
+        through each timestamp if they can not be computed.
+        """
+        query = await self.tags_query(scenario, job, agent, job_instance, None)
+        try:
+            return parse_aggregated_bounds(await self._post(self.querying_URL, json=bounds_query(query)))
+        except LookupError:
+            timestamps = await self.timestamps(job, scenario, agent, job_instance) - {None}
+            if timestamps:
+                return min(timestamps), max(timestamps)
+
+    async def logs(self, job=None, scenario=None, agent=None, job_instance=None, timestamps=None):
+        """Fetch data from ElasticSearch that correspond to the given
+        constraints and return the list of according `Scenario`s instances.
+        """
+        query = await self.tags_query(scenario, job, agent, job_instance, timestamps, LOG_SOURCE_FIELDS)
+        hits = [hit async for hit in self.search_query(query)]
+        return list(parse_logs(hits))
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016-2023 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+
+"""On-disk cache of `Scenario` instances retrieved from a collector.
+
+This module provide the `ScenarioCache` class that the
+`CollectorConnection` class can use to avoid querying both
+databases again for scenario instances it already retrieved.
+"""
+
+__author__ = 'Mathias ETTINGER <mettinger@toulouse.viveris.com>'
+__all__ = ['ScenarioCache', 'IncompleteScenario', 'merge_scenarios']
+
+
+import os
+import json
+import time
+import pickle
+import threading
+from collections import OrderedDict
+from contextlib import suppress
+
+from .result_data import extract_jobs, get_or_create_scenario
+
+
+CACHE_MAX_BYTES = 1024 * 1024 * 1024
+SETTLE_TIME = 300  # Seconds without new data before an instance is considered finished
+INDEX_FILENAME = 'index.json'
+
+
+def high_water_mark(scenario):
+    """Most recent timestamp of the data held by a `Scenario`
+    instance and its sub-scenarios, or None if it is empty.
+    """
+    timestamps = []
+    for job in scenario.jobs:
+        timestamps.extend(
+                statistics.timestamps.max()
+                for statistics in job.statistics_data.values()
+                if len(statistics))
+        timestamps.extend(log._timestamp for log in job.logs_data.numbered_data.values())
+    return int(max(timestamps)) if timestamps else None
+
+
+def merge_scenarios(scenario, newer):
+    """Add the statistics and logs of the `newer` instance of
+    a scenario into `scenario`, overwriting the data found
+    at the same timestamps (or under the same ID for logs).
+    """
+    scenarios = {(subscenario.instance_id,): subscenario for subscenario in scenario.scenarios}
+    for scenario_id, owner_id, job in extract_jobs(newer):
+        subscenario = get_or_create_scenario(scenario_id, scenarios)
+        owner = get_or_create_scenario(owner_id, scenarios)
+        if owner is not subscenario and subscenario.owner is None:
+            subscenario.owner = owner
+            owner.sub_scenarios[(subscenario.instance_id,)] = subscenario
+        existing_job = subscenario.get_or_create_job(job.name, job.instance_id, job.agent)
+        for (suffix,), statistics in job.statistics_data.items():
+            existing_statistics = existing_job.get_or_create_statistics(suffix)
+            existing_statistics.extend(statistics.rows())
+        existing_job.logs_data.numbered_data.update(job.logs_data.numbered_data)
+    return scenario
+
+
+class IncompleteScenario(Exception):
+    """Raised by the `retrieve` callable of `ScenarioCache.fetch`
+    when some data could not be retrieved; `scenario` holds what
+    could be.
+    """
+
+    def __init__(self, scenario):
+        super().__init__(scenario)
+        self.scenario = scenario
+
+
+class ScenarioCache:
+    """Least recently used cache of `Scenario` instances keyed
+    by scenario instance ID and pickled into `directory`.
+
+    Entries are evicted, least recently used first, as soon as
+    the stored files weigh more than `max_bytes` altogether.
+
+    Instances whose most recent data (their high-water mark) are
+    less than `settle_time` seconds old when stored are considered
+    still running: only data newer than their high-water mark are
+    queried when they are requested again. Use `mark_finished`,
+    `invalidate` and `clear` to manage entries explicitly.
+
+    Files are unpickled when read: only point this cache
+    to a directory that other users can not write to.
+    """
+
+    def __init__(self, directory, max_bytes=CACHE_MAX_BYTES, settle_time=SETTLE_TIME):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.settle_time = settle_time
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.evictions = 0
+        self._lock = threading.RLock()
+        self._entries = self._read_index()
+
+    @property
+    def statistics(self):
+        """Hit/miss counters and current usage of this cache"""
+        with self._lock:
+            return {
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'refreshes': self.refreshes,
+                    'evictions': self.evictions,
+                    'entries': len(self._entries),
+                    'bytes': sum(entry['size'] for entry in self._entries.values()),
+            }
+
+    def __contains__(self, scenario_instance_id):
+        with self._lock:
+            return scenario_instance_id in self._entries
+
+    def fetch(self, scenario_instance_id, retrieve):
+        """Return the `Scenario` instance of the given ID, or None.
+
+        `retrieve` is called with None, on a cache miss, or with the
+        bounds of the timestamps of the new data of a running instance
+        and should return the matching `Scenario` instance or None.
+        It can also raise `IncompleteScenario` if some data could not
+        be retrieved: its scenario is then returned but not stored, and
+        the high-water mark is kept so missing data are queried again.
+        """
+        with self._lock:
+            entry = self._entries.get(scenario_instance_id)
+            scenario = None if entry is None else self._read(scenario_instance_id)
+            if scenario is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(scenario_instance_id)
+
+        if scenario is None:
+            try:
+                scenario = retrieve(None)
+            except IncompleteScenario as incomplete:
+                return incomplete.scenario
+            if scenario is not None:
+                self.store(scenario_instance_id, scenario)
+            return scenario
+
+        if entry['finished']:
+            self._write_index()
+            return scenario
+
+        now = int(time.time() * 1000)
+        try:
+            newer = retrieve((entry['high_water_mark'], now + 1000 * self.settle_time))
+        except IncompleteScenario as incomplete:
+            if incomplete.scenario is not None:
+                merge_scenarios(scenario, incomplete.scenario)
+            return scenario
+        if newer is not None:
+            merge_scenarios(scenario, newer)
+        with self._lock:
+            self.refreshes += 1
+        self.store(scenario_instance_id, scenario)
+        return scenario
+
+    def store(self, scenario_instance_id, scenario):
+        """Save a `Scenario` instance under the given ID"""
+        mark = high_water_mark(scenario)
+        finished = mark is not None and time.time() - mark / 1000 > self.settle_time
+        path = self._path(scenario_instance_id)
+        with self._lock:
+            with open(path + '.tmp', 'wb') as f:
+                pickle.dump(scenario, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(path + '.tmp', path)
+            previous = self._entries.pop(scenario_instance_id, {})
+            self._entries[scenario_instance_id] = {
+                    'size': os.path.getsize(path),
+                    'high_water_mark': mark if mark is not None else previous.get('high_water_mark', 0),
+                    'finished': finished or previous.get('finished', False),
+            }
+            self._evict()
+            self._write_index()
+
+    def mark_finished(self, scenario_instance_id):
+        """Stop querying new data for the given instance"""
+        with self._lock:
+            with suppress(KeyError):
+                self._entries[scenario_instance_id]['finished'] = True
+                self._write_index()
+
+    def invalidate(self, *scenario_instance_ids):
+        """Remove the given instances from the cache"""
+        with self._lock:
+            for scenario_instance_id in scenario_instance_ids:
+                if self._entries.pop(scenario_instance_id, None) is not None:
+                    self._remove(scenario_instance_id)
+            self._write_index()
+
+    def clear(self):
+        """Remove every instance from the cache"""
+        with self._lock:
+            self.invalidate(*self._entries)
+
+    def _path(self, scenario_instance_id):
+        return os.path.join(self.directory, '{}.pickle'.format(scenario_instance_id))
+
+    def _read(self, scenario_instance_id):
+        try:
+            with open(self._path(scenario_instance_id), 'rb') as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            # Removed or corrupted file, consider it a miss
+            del self._entries[scenario_instance_id]
+            return None
+
+    def _remove(self, scenario_instance_id):
+        with suppress(OSError):
+            os.remove(self._path(scenario_instance_id))
+
+    def _evict(self):
+        size = sum(entry['size'] for entry in self._entries.values())
+        while size > self.max_bytes and len(self._entries) > 1:
+            scenario_instance_id, entry = self._entries.popitem(last=False)
+            self._remove(scenario_instance_id)
+            size -= entry['size']
+            self.evictions += 1
+
+    def _read_index(self):
+        try:
+            with open(os.path.join(self.directory, INDEX_FILENAME)) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return OrderedDict()
+        return OrderedDict(
+                (scenario_instance_id, entry)
+                for scenario_instance_id, entry in entries
+                if os.path.exists(self._path(scenario_instance_id)))
+
+    def _write_index(self):
+        path = os.path.join(self.directory, INDEX_FILENAME)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(list(self._entries.items()), f)
+        os.replace(path + '.tmp', path)
@@ -28,13 +28,40 @@
 
 __author__ = 'Adrien THIBAUD <adrien.thibaud@toulouse.viveris.com>'
 __credits__ = 'contributions: Mathias ETTINGER'
-__all__ = ['CollectorConnection']
+__all__ = ['CollectorConnection', 'PartialResultsWarning']
 
+import os
+import warnings
+from functools import partial
 from contextlib import suppress
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError
 
 from .influxdb_tools import InfluxDBConnection
 from .elasticsearch_tools import ElasticSearchConnection
+from .importer import ImportPipeline
+from .cache import IncompleteScenario
+from .archive import ScenarioArchive
 from .result_data import extract_jobs, get_or_create_scenario
+from .sessions import build_session
+
+
+class PartialResultsWarning(UserWarning):
+    """Issued when a database did not answer in time and results
+    only hold the data of the other one.
+    """
+
+
+def _timed_out(database, timeout):
+    warnings.warn(
+            '{} did not answer within {}s, results are partial'.format(database, timeout),
+            PartialResultsWarning, stacklevel=3)
+
+
+def merge_bounds(*bounds):
+    """Merge pairs of first and last timestamps, ignoring None"""
+    bounds = [bound for bound in bounds if bound is not None]
+    if bounds:
+        return min(first for first, _ in bounds), max(last for _, last in bounds)
 
 
 class CollectorConnection:
@@ -48,49 +75,98 @@ class CollectorConnection:
                  elasticsearch_port=9200,
                  influxdb_port=8086,
                  database_name='openbach',
-                 epoch='ms'):
-        self.influxdb = InfluxDBConnection(collector_ip, influxdb_port, database_name, epoch)
-        self.elasticsearch = ElasticSearchConnection(collector_ip, elasticsearch_port)
+                 epoch='ms', *,
+                 session=None,
+                 compress=False,
+                 cache=None,
+                 timeout=None):
+        """Connect to the databases of the given collector.
+
+        Pass a `ScenarioCache` as `cache` to reuse the `Scenario`
+        instances already retrieved by the `scenarios` method.
+
+        Both databases are queried concurrently; if `timeout` is
+        provided, a database that did not answer within `timeout`
+        seconds is ignored, with a `PartialResultsWarning`, and
+        only the results of the other one are returned.
+        """
+        if session is None:
+            session = build_session()
+        self.session = session
+        self.cache = cache
+        self.timeout = timeout
+        self.influxdb = InfluxDBConnection(
+                collector_ip, influxdb_port, database_name, epoch,
+                session=session, compress=compress)
+        self.elasticsearch = ElasticSearchConnection(
+                collector_ip, elasticsearch_port,
+                session=session, compress=compress)
+
+    def _query_both(self, influxdb_query, elasticsearch_query, default=None, timed_out=None):
+        """Call both queries concurrently and return the pair of their
+        results; using `default` for a query that timed out. The name
+        of such database is also appended to the `timed_out` list, if
+        provided.
+        """
+        executor = ThreadPoolExecutor(2)
+        futures = {
+                executor.submit(influxdb_query): 'InfluxDB',
+                executor.submit(elasticsearch_query): 'ElasticSearch',
+        }
+        results = {}
+        try:
+            for future in as_completed(futures, timeout=self.timeout):
+                results[futures[future]] = future.result()
+        except TimeoutError:
+            for database in futures.values():
+                if database not in results:
+                    _timed_out(database, self.timeout)
+                    if timed_out is not None:
+                        timed_out.append(database)
+        finally:
+            # Do not wait for a timed out query to complete
+            executor.shutdown(wait=False)
+        return results.get('InfluxDB', default), results.get('ElasticSearch', default)
 
     def agent_names(
             self, job_name=None, scenario_instance_id=None,
             job_instance_id=None, suffix=None, timestamps=None):
         """List all the avaible agent names in InfluxDB and ElasticSearch"""
-        return self.influxdb.agent_names(
-                job_name, scenario_instance_id, job_instance_id, suffix,
-        ) | self.elasticsearch.agent_names(
-                job_name, scenario_instance_id, job_instance_id, timestamps,
-        )
+        influxdb, elasticsearch = self._query_both(
+                partial(self.influxdb.agent_names, job_name, scenario_instance_id, job_instance_id, suffix),
+                partial(self.elasticsearch.agent_names, job_name, scenario_instance_id, job_instance_id, timestamps),
+                set())
+        return influxdb | elasticsearch
 
     def job_names(
             self, scenario_instance_id=None, agent_name=None,
             job_instance_id=None, suffix=None, timestamps=None):
         """List all the avaible job names in InfluxDB and ElasticSearch"""
-        return self.influxdb.job_names(
-                scenario_instance_id, agent_name, job_instance_id, suffix,
-        ) | self.elasticsearch.job_names(
-                scenario_instance_id, agent_name, job_instance_id, timestamps,
-        )
+        influxdb, elasticsearch = self._query_both(
+                partial(self.influxdb.job_names, scenario_instance_id, agent_name, job_instance_id, suffix),
+                partial(self.elasticsearch.job_names, scenario_instance_id, agent_name, job_instance_id, timestamps),
+                set())
+        return influxdb | elasticsearch
 
     def job_instance_ids(
             self, job_name=None, scenario_instance_id=None,
             agent_name=None, suffix=None, timestamps=None):
         """List all the avaible job instance IDs in InfluxDB and ElasticSearch"""
-        return self.influxdb.job_instance_ids(
-                job_name, scenario_instance_id, agent_name, suffix,
-        ) | self.elasticsearch.job_instance_ids(
-                job_name, scenario_instance_id, agent_name, timestamps,
-        )
+        influxdb, elasticsearch = self._query_both(
+                partial(self.influxdb.job_instance_ids, job_name, scenario_instance_id, agent_name, suffix),
+                partial(self.elasticsearch.job_instance_ids, job_name, scenario_instance_id, agent_name, timestamps),
+                set())
+        return influxdb | elasticsearch
 
     def scenario_instance_ids(
             self, job_name=None, agent_name=None,
             job_instance_id=None, suffix=None, timestamps=None):
         """List all the avaible scenario instance IDs in InfluxDB and ElasticSearch"""
-        return self.influxdb.scenario_instance_ids(
-                job_name, agent_name, job_instance_id, suffix,
-        ) | self.elasticsearch.scenario_instance_ids(
-                job_name, agent_name, job_instance_id, timestamps,
-        )
+        influxdb, elasticsearch = self._query_both(
+                partial(self.influxdb.scenario_instance_ids, job_name, agent_name, job_instance_id, suffix),
+                partial(self.elasticsearch.scenario_instance_ids, job_name, agent_name, job_instance_id, timestamps),
+                set())
+        return influxdb | elasticsearch
 
     def timestamps(
             self, job_name=None, scenario_instance_id=None,
@@ -100,20 +176,31 @@ class CollectorConnection:
         that correspond to the given constraints.
 
         Sort them before returning the list. Optionally return only
-        a couple containing the minimum and maximum values.
+        a couple containing the minimum and maximum values, computed
+        by the databases themselves.
         """
-        timestamps = self.influxdb.timestamps(
-            job_name, scenario_instance_id, agent_name,
-            job_instance_id, suffix, condition,
-        ) | self.elasticsearch.timestamps(
-            job_name, scenario_instance_id, agent_name, job_instance_id,
-        )
+        if only_bounds:
+            bounds = self._query_both(
+                    partial(
+                        self.influxdb.bounds, job_name, scenario_instance_id,
+                        agent_name, job_instance_id, suffix, condition),
+                    partial(
+                        self.elasticsearch.timestamp_bounds, job_name,
+                        scenario_instance_id, agent_name, job_instance_id))
+            return merge_bounds(*bounds)
+
+        influxdb, elasticsearch = self._query_both(
+                partial(
+                    self.influxdb.timestamps, job_name, scenario_instance_id,
+                    agent_name, job_instance_id, suffix, condition),
+                partial(
+                    self.elasticsearch.timestamps, job_name,
+                    scenario_instance_id, agent_name, job_instance_id),
+                set())
+        timestamps = (influxdb | elasticsearch) - {None}
 
         if not timestamps:
             return None
-
-        if only_bounds:
-            return min(timestamps), max(timestamps)
         return sorted(timestamps)
 
     def suffixes(
@@ -125,25 +212,66 @@ class CollectorConnection:
     def scenarios(
             self, job_name=None, scenario_instance_id=None,
             agent_name=None, job_instance_id=None, suffix=None,
-            fields=None, condition=None, timestamps=None):
+            fields=None, condition=None, timestamps=None, chunk_size=None,
+            windows=None, concurrency=None):
         """Fetch data from InfluxDB and ElasticSearch that correspond to
         the given constraints and generate according `Scenario`s instances.
+
+        Use `chunk_size` to stream statistics from InfluxDB by chunks
+        of at most that many points instead of a single response, or
+        `windows` to split the query into concurrent time intervals.
+
+        Whole scenario instances (only `scenario_instance_id` being
+        provided amongst the constraints) are read from and stored
+        into the cache, if any.
         """
-        response = self.elasticsearch.logs(
-                job_name, scenario_instance_id,
-                agent_name, job_instance_id, timestamps)
+        constraints = (job_name, agent_name, job_instance_id, suffix, fields, condition, timestamps)
+        if self.cache is None or scenario_instance_id is None or any(c is not None for c in constraints):
+            yield from self._scenarios(
+                    job_name, scenario_instance_id, agent_name,
+                    job_instance_id, suffix, fields, condition,
+                    timestamps, chunk_size, windows, concurrency)
+            return
+
+        def retrieve(timestamps):
+            timed_out = []
+            scenarios = self._scenarios(
+                    scenario_instance_id=scenario_instance_id, timestamps=timestamps,
+                    chunk_size=chunk_size, windows=windows, concurrency=concurrency,
+                    timed_out=timed_out)
+            scenario = next(scenarios, None)
+            if timed_out:
+                # Do not let the cache consider missing data as retrieved
+                raise IncompleteScenario(scenario)
+            return scenario
+
+        scenario = self.cache.fetch(scenario_instance_id, retrieve)
+        if scenario is not None:
+            yield scenario
+
+    def _scenarios(
+            self, job_name=None, scenario_instance_id=None,
+            agent_name=None, job_instance_id=None, suffix=None,
+            fields=None, condition=None, timestamps=None, chunk_size=None,
+            windows=None, concurrency=None, timed_out=None):
+        statistics, logs = self._query_both(
+                lambda: list(self.influxdb.statistics(
+                    job_name, scenario_instance_id, agent_name,
+                    job_instance_id, suffix, fields, condition, timestamps,
+                    chunk_size, windows, concurrency)),
+                lambda: list(self.elasticsearch.logs(
+                    job_name, scenario_instance_id,
+                    agent_name, job_instance_id, timestamps)),
+                [], timed_out)
         # Flatten scenarios instances from ElasticSearch
         scenarios = {
                 (subscenario.instance_id,): subscenario
-                for scenario in response
+                for scenario in logs
                 for subscenario in scenario.scenarios
         }
 
-        response = self.influxdb.statistics(
-                job_name, scenario_instance_id, agent_name,
-                job_instance_id, suffix, fields, condition, timestamps)
         # For each job found in InfluxDB
-        for scenario_with_stats in response:
+        for scenario_with_stats in statistics:
             for scenario_id, owner_id, job in extract_jobs(scenario_with_stats):
                 # Retrieve the (existing) scenario holding it
                 scenario = get_or_create_scenario(scenario_id, scenarios)
@@ -163,24 +291,56 @@ class CollectorConnection:
             with suppress(KeyError):
                 yield scenarios[(scenario_instance_id,)]
 
-    def import_scenario(self, scenario_instance):
+    def import_scenario(self, scenario_instance, workers=8, progress=None, **pipeline_options):
         """Import the results of the `Scenario` instance in
-        InfluxDB and ElasticSearch"""
-        for scenario_id, owner_id, job in extract_jobs(scenario_instance):
-            self.influxdb.import_job(scenario_id, owner_id, job)
-            self.elasticsearch.import_job(scenario_id, owner_id, job)
+        InfluxDB and ElasticSearch. `scenario_instance` can also
+        be the path to a directory created by `archive.write_archive`.
+
+        Data are written concurrently by `workers` threads, see
+        `ImportPipeline` for the other options. Return the
+        `ImportReport` describing the import.
+        """
+        pipeline = ImportPipeline(
+                self.influxdb, self.elasticsearch,
+                workers, progress=progress, **pipeline_options)
+        if isinstance(scenario_instance, (str, os.PathLike)):
+            # Stream jobs out of the archive instead of loading it whole
+            archive = ScenarioArchive(scenario_instance)
+            scenario_ids = [scenario['@scenario_instance_id'] for scenario in archive.scenarios]
+            jobs = archive.iter_jobs()
+        else:
+            scenario_ids = [scenario.instance_id for scenario in scenario_instance.scenarios]
+            jobs = extract_jobs(scenario_instance)
+        try:
+            return pipeline.run_jobs(jobs)
+        finally:
+            if self.cache is not None:
+                self.cache.invalidate(*scenario_ids)
 
     def remove_statistics(
             self, job_name=None, scenario_instance_id=None,
             agent_name=None, job_instance_id=None,
-            suffix=None, condition=None, timestamps=None):
-        """Delete data in InfluxDB that matches the given constraints"""
-        self.influxdb.remove_statistics(
-                job_name, scenario_instance_id, agent_name,
-                job_instance_id, suffix, condition, timestamps)
-        self.elasticsearch.remove_logs(
+            suffix=None, condition=None, timestamps=None, *, dry_run=False):
+        """Delete data in InfluxDB and ElasticSearch that matches the
+        given constraints.
+
+        Return the amount of DELETE queries sent to InfluxDB, or that
+        would have been sent if `dry_run` is True; in which case
+        nothing is removed from ElasticSearch either. The cache, if
+        any, is cleared.
+        """
+        queries = self.influxdb.remove_statistics(
                 job_name, scenario_instance_id, agent_name,
-                job_instance_id, timestamps)
+                job_instance_id, suffix, condition, timestamps,
+                dry_run=dry_run)
+        if not dry_run:
+            self.elasticsearch.remove_logs(
+                    job_name, scenario_instance_id, agent_name,
+                    job_instance_id, timestamps)
+            if self.cache is not None:
+                # Removed data may be cached along any owner scenario
+                self.cache.clear()
+        return queries
 
     def orphans(self, timestamps=None, condition=None):
         """Retrieve orphans logs from ElasticSearch and orphans
@@ -40,67 +40,180 @@ __credits__ = 'Maintainer: Mathias ETTINGER <mettinger@toulouse.viveris.com>'
 __all__ = ['ElasticSearchConnection']
 
 
+import sys
 import json
-import locale
+import time
+import queue
 import datetime
-from contextlib import suppress
-
-import requests
+import threading
+from collections import defaultdict
+from functools import partial, lru_cache
+from contextlib import suppress, closing
+from concurrent.futures import ThreadPoolExecutor
 
 from .result_data import Log, get_or_create_scenario
+from .sessions import build_session, connection_statistics, compress_body
 
 
 ############################################
 # Helper functions for formatting purposes #
 ############################################
 
-class LocaleManager():
-    def __init__(self, loc):
-        self.lc_all = locale.setlocale(locale.LC_ALL)
-        self.locale = loc
-          
-    def __enter__(self):
-        locale.setlocale(locale.LC_ALL, self.locale)
-        return self
-      
-    def __exit__(self, exc_type, exc_value, exc_traceback):
-        locale.setlocale(locale.LC_ALL, self.lc_all)
-        
-
-def tags_to_query(scenario, job, agent, job_instance, timestamps):
-    """Build an ElasticSearch query out of the given parameters"""
-    filter_query = {}
+BULK_CHUNCK_SIZE = 1000
+BULK_CHUNCK_BYTES = 5 * 1024 * 1024
+BULK_RETRIES = 3
+BULK_BACKOFF_FACTOR = 0.5
+SYSLOG_MONTHS = {
+        name: number for number, name in enumerate((
+            'Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+            'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'), 1)
+}
+LOG_SOURCE_FIELDS = (
+        'agent_name', 'program', 'job_instance_id', 'scenario_instance_id',
+        'owner_scenario_instance_id', '@timestamp', 'timestamp', '@version',
+        'facility', 'facility_label', 'host', 'logsource', 'message', 'pid',
+        'priority', 'severity', 'severity_label',
+)
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+MILLISECOND = datetime.timedelta(milliseconds=1)
+
+
+def tags_to_query(scenario, job, agent, job_instance, timestamps, source_fields=None, exact_fields=None):
+    """Build an ElasticSearch query out of the given parameters.
+
+    Tags are matched in a non-scoring, cacheable, filter context.
+    `exact_fields` maps tag fields to the name of the field holding
+    their exact value, such as returned by `keyword_field`: tags are
+    matched on it using a `term` clause or, if mapped to None, using
+    a `match` clause on the tag field itself. Unmapped tag fields
+    are matched using a `term` clause on themselves.
+
+    If `source_fields` is provided, only these fields of
+    the `_source` of the matching documents are returned.
+    """
+    if exact_fields is None:
+        exact_fields = {}
+
+    def exact_match(field_name, value):
+        exact_field = exact_fields.get(field_name, field_name)
+        if exact_field is None:
+            return {'match': {field_name: value}}
+        return {'term': {exact_field: value}}
 
+    filters = []
     if timestamps is not None:
         try:
             timestamp_lower, timestamp_upper = timestamps
         except (TypeError, ValueError):
             timestamp_lower = timestamp_upper = timestamps
-        filter_query['filter'] = [{
+        filters.append({
             'range': {
                 '@timestamp': {
                     'gte': timestamp_lower,
                     'lte': timestamp_upper,
                 },
             },
-        }]
+        })
+
+    if scenario is not None:
+        filters.append({'bool': {
+            'should': [
+                exact_match('scenario_instance_id', scenario),
+                exact_match('owner_scenario_instance_id', scenario),
+            ],
+            'minimum_should_match': 1,
+        }})
 
     fields = {
-        'scenario_instance_id:{0} || owner_scenario_instance_id:{0}': scenario,
-        'program:{}': job,
-        'agent_name:{}': agent,
-        'job_instance_id:{}': job_instance,
+        'program': job,
+        'agent_name': agent,
+        'job_instance_id': job_instance,
     }
-    query = ' && '.join(
-            pattern.format(value)
-            for pattern, value in fields.items()
+    filters.extend(
+            exact_match(field_name, value)
+            for field_name, value in fields.items()
             if value is not None)
-    if query:
-        filter_query['must'] = [{'query_string': {'query': query}}]
+
+    if filters:
+        query = {'query': {'bool': {'filter': filters}}}
     else:
-        filter_query['must'] = [{'match_all': {}}]
+        query = {'query': {'match_all': {}}}
+    if source_fields is not None:
+        query['_source'] = {'includes': list(source_fields)}
+    return query
 
-    return {'query': {'bool': filter_query}}
+
+def _tag_fields(scenario, job, agent, job_instance):
+    """Names of the fields `tags_to_query` filters on"""
+    fields = {
+        'scenario_instance_id': scenario,
+        'owner_scenario_instance_id': scenario,
+        'program': job,
+        'agent_name': agent,
+        'job_instance_id': job_instance,
+    }
+    return [field_name for field_name, value in fields.items() if value is not None]
+
+
+def bounds_query(query, field_name='@timestamp'):
+    """Extend an ElasticSearch query to compute the minimum and
+    maximum values of a field amongst the matching documents,
+    without returning any of them.
+    """
+    aggregations = {
+            'first': {'min': {'field': field_name}},
+            'last': {'max': {'field': field_name}},
+    }
+    return dict(query, size=0, aggs=aggregations)
+
+
+def parse_aggregated_bounds(elasticsearch_result):
+    """Extract the minimum and maximum values out of the response
+    of a query created by `bounds_query`, or None if no document
+    matched. Raise `LookupError` if the query failed.
+    """
+    if 'error' in elasticsearch_result:
+        raise LookupError(elasticsearch_result['error'])
+    aggregations = elasticsearch_result.get('aggregations', {})
+    first = aggregations.get('first', {}).get('value')
+    last = aggregations.get('last', {}).get('value')
+    if first is not None and last is not None:
+        return int(first), int(last)
+
+
+def convert_or_None(value, converter=str):
+    """Helper function to convert a value aggregated by
+    ElasticSearch the same way `extract_field_or_None` would.
+    """
+    if value is not None:
+        with suppress(ValueError):
+            return converter(value)
+
+
+def _mapping_types(mapping):
+    """Generate the full name and type of each field found
+    in the response of a field mapping request.
+    """
+    if not isinstance(mapping, dict):
+        return
+    if 'full_name' in mapping and 'mapping' in mapping:
+        for field in mapping['mapping'].values():
+            with suppress(TypeError, KeyError):
+                yield mapping['full_name'], field['type']
+        return
+    for value in mapping.values():
+        yield from _mapping_types(value)
+
+
+def _keyword_candidate(mapping, candidates):
+    """Return the first of the candidate fields that is only
+    mapped with aggregatable types in the response of a field
+    mapping request, or None.
+    """
+    types = defaultdict(set)
+    for name, kind in _mapping_types(mapping):
+        types[name].add(kind)
+    return next((name for name in candidates if types[name] and types[name] <= AGGREGATABLE_TYPES), None)
 
 
 def extract_field_or_None(record, field_name, converter=str):
@@ -121,23 +234,66 @@ def extract_timestamp_or_None(record, field_name):
         return parse_timestamp_with_index(timestamp, index)
 
 
+def extract_log_timestamp_or_None(record):
+    """Helper function to convert the `@timestamp` field of a result
+    from ElasticSearch, or its syslog `timestamp` field otherwise,
+    the same way `extract_timestamp_with_index` does for logs.
+    """
+    with suppress(LookupError, ValueError):
+        fields = {name: values[0] for name, values in record['fields'].items()}
+        return extract_timestamp_with_index(fields, record['_index'])
+
+
+@lru_cache(maxsize=1024)
+def _index_year(index, number_of_year_digits=4):
+    """Extract the year out of an index name such as logstash-2023.01.31"""
+    return int(index.split('.')[0][-number_of_year_digits:])
+
+
+def parse_syslog_timestamp(date, year):
+    """Convert a syslog date (`%b %d %H:%M:%S` using english month
+    abbreviations) into a local timestamp in milliseconds.
+
+    Does not rely on the process locale, unlike `strptime`.
+    """
+    try:
+        month, day, clock = date.split()
+        hour, minute, second = clock.split(':')
+        month = SYSLOG_MONTHS[month.title()]
+    except (KeyError, AttributeError):
+        raise ValueError('invalid syslog date: {!r}'.format(date)) from None
+    timestamp = datetime.datetime(year, month, int(day), int(hour), int(minute), int(second))
+    return int(timestamp.timestamp() * 1000)
+
+
+def parse_iso_timestamp(date):
+    """Convert an ISO 8601 date, such as ElasticSearch's
+    `@timestamp`, into a timestamp in milliseconds.
+
+    Dates without timezone information are considered UTC.
+    """
+    if date.endswith('Z'):
+        date = date[:-1] + '+00:00'
+    timestamp = datetime.datetime.fromisoformat(date)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=datetime.timezone.utc)
+    return (timestamp - EPOCH) // MILLISECOND
+
+
 def parse_timestamp_with_index(date, index, number_of_year_digits=4):
     """Convert a date representation from ElasticSearch into
     a timestamp as used throughout OpenBACH.
     """
-    with LocaleManager('en_US.utf8'):
-        year = int(index.split('.')[0][-number_of_year_digits:])
-        timestamp = datetime.datetime.strptime(date, '%b %d %H:%M:%S')
-        return int(timestamp.replace(year).timestamp() * 1000)
+    return parse_syslog_timestamp(date, _index_year(index, number_of_year_digits))
 
 
 def extract_timestamp_with_index(source, index, number_of_year_digits=4):
-    try:
-        timestamp = source['@timestamp']
-    except KeyError:
-        return parse_timestamp_with_index(source['timestamp'], index, number_of_year_digits)
-    else:
-        return datetime.datetime.fromisoformat(timestamp)
+    """Retrieve the timestamp, in milliseconds, of a log; preferably
+    from its `@timestamp` or from its syslog date otherwise.
+    """
+    with suppress(KeyError, ValueError):
+        return parse_iso_timestamp(source['@timestamp'])
+    return parse_timestamp_with_index(source['timestamp'], index, number_of_year_digits)
 
 
 def parse_logs(elasticsearch_result):
@@ -214,9 +370,20 @@ def parse_orphans(elasticsearch_result, log):
                     severity, severity_label, logsource)
 
 
-def rest_protocol(job_name, scenario_id, owner_id, agent_name, job_id, logs):
+def rest_protocol(
+        job_name, scenario_id, owner_id, agent_name, job_id, logs,
+        max_bytes=BULK_CHUNCK_BYTES, max_actions=BULK_CHUNCK_SIZE):
+    """Generate NDJSON bodies for bulk requests to ElasticSearch.
+
+    Each body holds as many index actions as possible without
+    exceeding `max_bytes` once UTF-8 encoded nor `max_actions`
+    actions. Actions larger than `max_bytes` are sent alone.
+    """
+    actions = []
+    size = 0
     for _id, log in logs.items():
         timestamp = datetime.datetime.fromtimestamp(log._timestamp / 1000)
+        utc_timestamp = EPOCH + log._timestamp * MILLISECOND
         metadata = {'index': {
             '_id': _id,
             '_index': log._index,
@@ -239,23 +406,81 @@ def rest_protocol(job_name, scenario_id, owner_id, agent_name, job_id, logs):
             'severity': log.severity,
             'severity_label': log.severity_label,
             'timestamp': timestamp.strftime('%b %d %H:%M:%S'),
-            '@timestamp': timestamp.isoformat(timespec='milliseconds') + 'Z',
+            '@timestamp': utc_timestamp.replace(tzinfo=None).isoformat(timespec='milliseconds') + 'Z',
             '@version': log._version,
         }
-        yield '{}\n{}\n'.format(json.dumps(metadata), json.dumps(data))
+        action = '{}\n{}\n'.format(json.dumps(metadata), json.dumps(data))
+        length = len(action) if action.isascii() else len(action.encode())
+        if actions and (size + length > max_bytes or len(actions) >= max_actions):
+            yield ''.join(actions)
+            actions = []
+            size = 0
+        actions.append(action)
+        size += length
+    if actions:
+        yield ''.join(actions)
+
+
+def parse_bulk_response(body, bulk_result):
+    """Split the actions of a bulk request body according to the
+    per-item results ElasticSearch sent back for them.
+
+    Return a pair of the body holding the actions worth retrying
+    (rejected because the server was overloaded or unavailable)
+    and a list of pairs of action and error for the others that
+    failed. Each action must span two lines, as generated by
+    `rest_protocol`.
+    """
+    if not bulk_result.get('errors'):
+        return '', []
+
+    lines = body.splitlines(keepends=True)
+    actions = [''.join(lines[i:i + 2]) for i in range(0, len(lines), 2)]
+    retries = []
+    failures = []
+    for action, item in zip(actions, bulk_result.get('items', [])):
+        result, = item.values()
+        status = result.get('status', 200)
+        if status < 300:
+            continue
+        if status == 429 or status >= 500:
+            retries.append(action)
+        else:
+            failures.append((action, result.get('error', status)))
+    return ''.join(retries), failures
 
 
 ###############################
 # Fetching and receiving data #
 ###############################
 
+SCROLL_DURATION = '1m'
+SEARCH_FILTER_PATH = ','.join((
+        # Response metadata such as shards statistics or scores are not needed
+        'error', '_scroll_id', 'pit_id', 'hits.hits._id', 'hits.hits._index',
+        'hits.hits._type', 'hits.hits._source', 'hits.hits.fields', 'hits.hits.sort',
+))
+QUEUE_POLLING_INTERVAL = 0.1  # Seconds between checks for a stopped retrieval
+AGGREGATION_PAGE_SIZE = 1000
+TIMESTAMP_FIELDS = '@timestamp,timestamp'
+AGGREGATABLE_TYPES = {
+        'keyword', 'constant_keyword', 'boolean', 'date', 'ip',
+        'long', 'integer', 'short', 'byte', 'double', 'float',
+}
+
+
 class ElasticSearchCommunicator:
     """Manage network access to an ElasticSearch server"""
 
     TIMEOUT = (2, 3600)  # Requests (connection, data) timeouts in second
 
-    def __init__(self, ip, port=9200, credentials=None):
-        """Configure the routes to send/get data to/from ElasticSearch"""
+    def __init__(self, ip, port=9200, credentials=None, *, session=None, compress=False):
+        """Configure the routes to send/get data to/from ElasticSearch.
+
+        Requests are sent through the given `requests.Session`, or
+        through a new pooled session if none is provided. Bodies
+        of write requests are gzipped if `compress` is True.
+        """
 
         base_url = 'http://{}:{}'.format(ip, port)
         self.settings_URL = base_url + '/logstash-*/_settings/'
@@ -263,114 +488,361 @@ class ElasticSearchCommunicator:
         self.writing_URL = base_url + '/_bulk'
         self.scrolling_URL = base_url + '/_search/scroll'
         self.deleting_URL = base_url + '/logstash-*/_delete_by_query'
+        self.opening_pit_URL = base_url + '/logstash-*/_pit'
+        self.pit_URL = base_url + '/_pit'
+        self.pit_querying_URL = base_url + '/_search'
+        self.mapping_URL = base_url + '/logstash-*/_mapping/field/'
         if credentials is None:
             self.auth_header = None
         else:
             self.auth_header = {'Authorization': 'Basic {}'.format(credentials)}
+        self.session = build_session() if session is None else session
+        self.compress = compress
+        self._keyword_fields = {}
+
+    @property
+    def connection_statistics(self):
+        """Amount of connections opened and requests sent by the session"""
+        return connection_statistics(self.session)
 
     def settings_query(self, *settings):
         filters = ','.join(settings)
-        response = requests.get(self.settings_URL + filters, headers=self.auth_header, timeout=self.TIMEOUT)
+        response = self.session.get(self.settings_URL + filters, headers=self.auth_header, timeout=self.TIMEOUT)
         return response.json()
 
-    def search_query(self, body=None, **query):
-        """Send a query to ElasticSearch and gather the results"""
+    def _post(self, url, **kwargs):
+        response = self.session.post(url, headers=self.auth_header, timeout=self.TIMEOUT, **kwargs)
+        return response.json()
 
-        query['scroll'] = '1m'
-        session = requests.Session()
-        response = session.post(self.querying_URL, params=query, json=body, headers=self.auth_header, timeout=self.TIMEOUT).json()
+    def search_query(self, body=None, *, slices=None, page_size=None, point_in_time=False, **query):
+        """Send a query to ElasticSearch and gather the results.
+
+        Results are paginated through a scroll cursor, or through
+        `search_after` in a point in time if `point_in_time` is True,
+        `page_size` hits at a time. If `slices` is provided, the
+        query is split into that many slices retrieved in parallel.
+        Responses are stripped down to `SEARCH_FILTER_PATH` unless
+        another `filter_path` is provided.
+        """
+        if page_size is not None:
+            query['size'] = page_size
+        query.setdefault('filter_path', SEARCH_FILTER_PATH)
+        if not point_in_time:
+            yield from self._sliced_pages(self._scroll_pages, body, query, slices)
+            return
+
+        response = self._post(self.opening_pit_URL, params={'keep_alive': SCROLL_DURATION})
+        try:
+            pit_id = response['id']
+        except KeyError:
+            raise RuntimeError('ElasticSearch could not open a point in time: {}'.format(
+                response.get('error', response))) from None
+        try:
+            pages = partial(self._point_in_time_pages, pit_id)
+            yield from self._sliced_pages(pages, body, query, slices)
+        finally:
+            self._delete(self.pit_URL, {'id': pit_id})
+
+    def _scroll_pages(self, body, query):
+        """Generate pages of hits from a scroll cursor, clearing
+        its context on completion or error.
+        """
+        scroll_id = None
+        try:
+            response = self._post(self.querying_URL, params=dict(query, scroll=SCROLL_DURATION), json=body)
+            while True:
+                scroll_id = response.get('_scroll_id', scroll_id)
+                hits = response.get('hits', {}).get('hits', [])
+                if not hits:
+                    break
+                yield hits
+                if scroll_id is None:
+                    break
+                body = {'scroll': SCROLL_DURATION, 'scroll_id': scroll_id}
+                response = self._post(self.scrolling_URL, params={'filter_path': query.get('filter_path')}, json=body)
+        finally:
+            if scroll_id is not None:
+                self.clear_scroll(scroll_id)
+
+    def _point_in_time_pages(self, pit_id, body, query):
+        """Generate pages of hits using `search_after` in the given point in time"""
+        body = dict(body or {}, sort=[{'_shard_doc': 'asc'}])
         while True:
+            body['pit'] = {'id': pit_id, 'keep_alive': SCROLL_DURATION}
+            response = self._post(self.pit_querying_URL, params=query, json=body)
             hits = response.get('hits', {}).get('hits', [])
             if not hits:
                 break
-            yield from hits
+            yield hits
+            pit_id = response.get('pit_id', pit_id)
+            body['search_after'] = hits[-1]['sort']
+
+    def _sliced_pages(self, pages, body, query, slices=None):
+        """Generate the hits of the pages generated by `pages`,
+        retrieving `slices` slices of the query in parallel.
+        """
+        if slices is None or slices < 2:
+            for hits in pages(body, query):
+                yield from hits
+            return
+
+        # Bounded so slices are not retrieved faster than consumed
+        results = queue.Queue(2 * slices)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                with suppress(queue.Full):
+                    results.put(item, timeout=QUEUE_POLLING_INTERVAL)
+                    return True
+            return False
+
+        def fetch_slice(index):
+            try:
+                sliced_body = dict(body or {}, slice={'id': index, 'max': slices})
+                with closing(pages(sliced_body, query)) as slice_pages:
+                    for hits in slice_pages:
+                        if not put(hits):
+                            break
+            except Exception as error:
+                put(error)
+            finally:
+                put(None)
+
+        with ThreadPoolExecutor(slices) as executor:
+            for index in range(slices):
+                executor.submit(fetch_slice, index)
             try:
-                scroll_id = response['_scroll_id']
-            except KeyError:
+                remaining = slices
+                while remaining:
+                    hits = results.get()
+                    if hits is None:
+                        remaining -= 1
+                    elif isinstance(hits, Exception):
+                        raise hits
+                    else:
+                        yield from hits
+            finally:
+                stop.set()
+
+    def _delete(self, url, body):
+        # Releasing server-side contexts must not hide the original error
+        with suppress(OSError):
+            self.session.delete(url, json=body, headers=self.auth_header, timeout=self.TIMEOUT)
+
+    def clear_scroll(self, *scroll_ids):
+        """Release the server-side contexts of the given scroll cursors"""
+        self._delete(self.scrolling_URL, {'scroll_id': list(scroll_ids)})
+
+    def keyword_field(self, field_name):
+        """Retrieve the name of the field that can be used to aggregate
+        or filter on the exact values of `field_name`: either the field
+        itself or its `.keyword` sub-field. Return None if neither are
+        mapped with an aggregatable type.
+        """
+        with suppress(KeyError):
+            return self._keyword_fields[field_name]
+
+        candidates = (field_name, field_name + '.keyword')
+        response = self.session.get(self.mapping_URL + ','.join(candidates), headers=self.auth_header, timeout=self.TIMEOUT)
+        try:
+            mapping = response.json()
+        except ValueError:
+            # Not cached: the server may answer properly next time
+            return None
+        if not isinstance(mapping, dict) or 'error' in mapping:
+            return None
+
+        keyword = _keyword_candidate(mapping, candidates)
+        if mapping:
+            # Not cached without indices: fields are mapped once logs are written
+            self._keyword_fields[field_name] = keyword
+        return keyword
+
+    def distinct_query(self, field_name, body=None, page_size=AGGREGATION_PAGE_SIZE):
+        """Generate the distinct values of `field_name` amongst the
+        documents matching the query, using a composite aggregation
+        paginated with its `after_key`. Documents without this field
+        are reported using a None value.
+
+        Raise `LookupError` if the field can not be aggregated.
+        """
+        keyword = self.keyword_field(field_name)
+        if keyword is None:
+            raise LookupError('field {} is not mapped as a keyword'.format(field_name))
+
+        composite = {
+                'size': page_size,
+                'sources': [{field_name: {'terms': {'field': keyword, 'missing_bucket': True}}}],
+        }
+        body = dict(body or {}, size=0, aggs={'distinct': {'composite': composite}})
+        while True:
+            response = self._post(self.querying_URL, json=body)
+            if 'error' in response:
+                raise LookupError(response['error'])
+            aggregation = response.get('aggregations', {}).get('distinct', {})
+            buckets = aggregation.get('buckets', [])
+            for bucket in buckets:
+                yield bucket['key'][field_name]
+            after_key = aggregation.get('after_key')
+            if not buckets or after_key is None:
                 break
-            body = {'scroll': '1m', 'scroll_id': scroll_id}
-            response = session.post(self.scrolling_URL, json=body, headers=self.auth_header).json()
+            composite['after'] = after_key
 
     def delete_query(self, query):
         """Send query to ElasticSearch so that matching logs are removed"""
-        response = requests.post(self.deleting_URL, json=query, headers=self.auth_header, timeout=self.TIMEOUT)
+        response = self.session.post(self.deleting_URL, json=query, headers=self.auth_header, timeout=self.TIMEOUT)
         return response.json()
 
-    def data_write(self, body, first_time_request=False):
+    def data_write(self, body):
         """Send data to ElasticSearch so they are stored"""
-        if first_time_request:
-            self.data_write(body)
-        return requests.post(self.writing_URL, data=body.encode(), headers=self.auth_header, timeout=self.TIMEOUT)
+        if self.compress:
+            data, headers = compress_body(body, self.auth_header)
+        else:
+            data, headers = body.encode(), self.auth_header
+        return self.session.post(self.writing_URL, data=data, headers=headers, timeout=self.TIMEOUT)
+
+    def rejected_actions(self, body, response):
+        """Parse the response of a successful bulk request and
+        return the pair of the body of actions to retry and the
+        list of actions that failed for good, alongside their
+        error. See `parse_bulk_response`.
+        """
+        try:
+            bulk_result = response.json()
+        except ValueError:
+            return '', []
+        return parse_bulk_response(body, bulk_result)
+
+    def bulk_write(self, body, retries=BULK_RETRIES, backoff_factor=BULK_BACKOFF_FACTOR):
+        """Send a bulk request to ElasticSearch and resend the
+        actions it rejected, up to `retries` times, with an
+        exponential backoff.
+
+        Return the list of pairs of action and error that could
+        not be written.
+        """
+        failures = []
+        for attempt in range(retries + 1):
+            if attempt:
+                time.sleep(backoff_factor * 2 ** (attempt - 1))
+            response = self.data_write(body)
+            status = response.status_code
+            if status < 300:
+                body, rejected = self.rejected_actions(body, response)
+                failures.extend(rejected)
+                if not body:
+                    return failures
+                error = 'actions rejected by an overloaded or unavailable server'
+            elif status == 429 or status >= 500:
+                error = response.content
+            else:
+                # Client errors will not succeed on retries
+                failures.append((body, response.content))
+                return failures
+        failures.append((body, error))
+        return failures
 
 
 class ElasticSearchConnection(ElasticSearchCommunicator):
+    def tags_query(self, scenario, job, agent, job_instance, timestamps, source_fields=None):
+        """Build an ElasticSearch query out of the given parameters
+        using `tags_to_query`, filtering on the exact value of tags
+        as mapped by the server.
+        """
+        exact_fields = {
+                field_name: self.keyword_field(field_name)
+                for field_name in _tag_fields(scenario, job, agent, job_instance)
+        }
+        return tags_to_query(scenario, job, agent, job_instance, timestamps, source_fields, exact_fields)
+
+    def _distinct(self, field_name, query, converter=str):
+        """Gather the distinct values of a field through an aggregation,
+        falling back to scrolling through each matching document if the
+        server does not map this field as a keyword.
+        """
+        try:
+            values = list(self.distinct_query(field_name, query))
+        except LookupError:
+            response = self.search_query(query, fields=field_name)
+            return {extract_field_or_None(record, field_name, converter) for record in response}
+        else:
+            return {convert_or_None(value, converter) for value in values}
+
     def agent_names(self, job=None, scenario=None, job_instance=None, timestamps=None):
         """List the available agent names in ElasticSearch
         that correspond to the given constraints.
         """
-        field_name = 'agent_name'
-        query = tags_to_query(scenario, job, None, job_instance, timestamps)
-        response = self.search_query(query, fields=field_name)
-        return {extract_field_or_None(record, field_name) for record in response}
+        query = self.tags_query(scenario, job, None, job_instance, timestamps)
+        return self._distinct('agent_name', query)
 
     def job_names(self, scenario=None, agent=None, job_instance=None, timestamps=None):
         """List the available job names in ElasticSearch
         that correspond to the given constraints.
         """
-        field_name = 'program'
-        query = tags_to_query(scenario, None, agent, job_instance, timestamps)
-        response = self.search_query(query, fields=field_name)
-        return {extract_field_or_None(record, field_name) for record in response}
+        query = self.tags_query(scenario, None, agent, job_instance, timestamps)
+        return self._distinct('program', query)
 
     def job_instance_ids(self, job=None, scenario=None, agent=None, timestamps=None):
         """List the available job instance IDs in ElasticSearch
         that correspond to the given constraints.
         """
-        field_name = 'job_instance_id'
-        query = tags_to_query(scenario, job, agent, None, timestamps)
-        response = self.search_query(query, fields=field_name)
-        return {extract_field_or_None(record, field_name, int) for record in response}
+        query = self.tags_query(scenario, job, agent, None, timestamps)
+        return self._distinct('job_instance_id', query, int)
 
     def scenario_instance_ids(self, job=None, agent=None, job_instance=None, timestamps=None):
         """List the available scenario instance IDs in ElasticSearch
         that correspond to the given constraints.
         """
-        field_name = 'scenario_instance_id'
-        query = tags_to_query(None, job, agent, job_instance, timestamps)
-        response = self.search_query(query, fields=field_name)
-        return {extract_field_or_None(record, field_name, int) for record in response}
+        query = self.tags_query(None, job, agent, job_instance, timestamps)
+        return self._distinct('scenario_instance_id', query, int)
 
     def timestamps(self, job=None, scenario=None, agent=None, job_instance=None):
         """List the available timestamps in ElasticSearch
         that correspond to the given constraints.
         """
-        field_name = 'timestamp'
-        query = tags_to_query(scenario, job, agent, job_instance, None)
-        response = self.search_query(query, fields=field_name)
-        return {extract_timestamp_or_None(record, field_name) for record in response}
-
-    def logs(self, job=None, scenario=None, agent=None, job_instance=None, timestamps=None):
+        query = self.tags_query(scenario, job, agent, job_instance, None)
+        response = self.search_query(query, fields=TIMESTAMP_FIELDS)
+        return {extract_log_timestamp_or_None(record) for record in response}
+
+    def timestamp_bounds(self, job=None, scenario=None, agent=None, job_instance=None):
+        """Retrieve the first and last timestamps in ElasticSearch
+        that correspond to the given constraints, using min and max
+        aggregations on the `@timestamp` field; falling back to going
+        through each timestamp if they can not be computed.
+        """
+        query = self.tags_query(scenario, job, agent, job_instance, None)
+        try:
+            return parse_aggregated_bounds(self._post(self.querying_URL, json=bounds_query(query)))
+        except LookupError:
+            timestamps = self.timestamps(job, scenario, agent, job_instance) - {None}
+            if timestamps:
+                return min(timestamps), max(timestamps)
+
+    def logs(
+            self, job=None, scenario=None, agent=None, job_instance=None, timestamps=None,
+            *, slices=None, page_size=None, point_in_time=False):
         """Fetch data from ElasticSearch that correspond to the given
         constraints and generate according `Scenario`s instances.
         """
-        query = tags_to_query(scenario, job, agent, job_instance, timestamps)
-        response = self.search_query(query)
+        query = self.tags_query(scenario, job, agent, job_instance, timestamps, LOG_SOURCE_FIELDS)
+        response = self.search_query(query, slices=slices, page_size=page_size, point_in_time=point_in_time)
         yield from parse_logs(response)
 
-    def all_logs(self, timestamps=None):
+    def all_logs(self, timestamps=None, *, slices=None, page_size=None, point_in_time=False):
         """Fetch data from ElasticSearch that correspond to the given
         constraints and return the according logs.
         """
-        query = tags_to_query(None, None, None, None, timestamps)
-        response = self.search_query(query)
+        query = self.tags_query(None, None, None, None, timestamps)
+        response = self.search_query(query, slices=slices, page_size=page_size, point_in_time=point_in_time)
         return response
 
-    def orphans(self, timestamps=None):
+    def orphans(self, timestamps=None, *, slices=None, page_size=None, point_in_time=False):
         """Fetch data from ElasticSearch that were not emitted using
         the collect-agent API and generate according `Log`s instances.
         """
-        query = tags_to_query(None, None, None, None, timestamps)
-        response = self.search_query(query)
+        query = self.tags_query(None, None, None, None, timestamps, LOG_SOURCE_FIELDS)
+        response = self.search_query(query, slices=slices, page_size=page_size, point_in_time=point_in_time)
         result = Log()
         parse_orphans(response, result)
         return result
@@ -379,16 +851,35 @@ class ElasticSearchConnection(ElasticSearchCommunicator):
         """Remove logs in ElasticSearch that
         correspond to the given constraints.
         """
-        query = tags_to_query(scenario, job, agent, job_instance, timestamps)
+        query = self.tags_query(scenario, job, agent, job_instance, timestamps)
         self.delete_query(query)
 
-    def import_job(self, scenario_id, owner_id, job):
-        """Write the data of the given job into ElasticSearch"""
-        job_name = job.name
-        agent_name = job.agent
-        job_id = job.instance_id
-        data_stream = rest_protocol(
-                job_name, scenario_id, owner_id,
-                agent_name, job_id, job.logs_data.numbered_data)
-        for index, chunck in enumerate(data_stream):
-            self.data_write(chunck, first_time_request=not index)
+    def import_chunks(
+            self, scenario_id, owner_id, job,
+            max_bytes=BULK_CHUNCK_BYTES, max_actions=BULK_CHUNCK_SIZE):
+        """Generate the bodies of the bulk requests
+        needed to import the logs of the given job.
+
+        See `rest_protocol` for the meaning of `max_bytes`
+        and `max_actions`.
+        """
+        return rest_protocol(
+                job.name, scenario_id, owner_id, job.agent,
+                job.instance_id, job.logs_data.numbered_data,
+                max_bytes, max_actions)
+
+    def import_job(
+            self, scenario_id, owner_id, job,
+            max_bytes=BULK_CHUNCK_BYTES, max_actions=BULK_CHUNCK_SIZE):
+        """Write the data of the given job into ElasticSearch
+
+        Return the list of pairs of action and error that
+        could not be written, see `bulk_write`.
+        """
+        failures = []
+        for chunck in self.import_chunks(scenario_id, owner_id, job, max_bytes, max_actions):
+            failures.extend(self.bulk_write(chunck))
+        if __debug__:
+            for _, error in failures:
+                print(error, file=sys.stderr)
+        return failures
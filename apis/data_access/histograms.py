@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016-2023 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+"""Mergeable accumulators to build distributions of statistics
+without holding every point in memory.
+
+This module provide the `StreamingHistogram` class, which counts
+values into fixed bins, and the `QuantileSketch` class, which
+approximate quantiles with a bounded relative error. Both can be
+updated chunk after chunk and merged across chunks, job instances
+or processes.
+"""
+
+__author__ = 'Mathias ETTINGER <mettinger@toulouse.viveris.com>'
+__all__ = ['StreamingHistogram', 'QuantileSketch']
+
+
+import math
+from collections import Counter
+
+import numpy as np
+
+
+def _finite(values):
+    """Flatten values into a float array without its NaNs"""
+    values = np.asarray(values, dtype=float).ravel()
+    return values[~np.isnan(values)]
+
+
+class StreamingHistogram:
+    """Count values into the bins delimited by `edges`.
+
+    Bins are half-open except for the last one, which includes
+    its upper edge, as in `numpy.histogram`. Values outside of
+    the edges are only accounted for in `underflow` and `overflow`.
+    """
+
+    def __init__(self, edges):
+        self.edges = np.asarray(edges, dtype=float)
+        if self.edges.ndim != 1 or len(self.edges) < 2:
+            raise ValueError('a histogram requires at least two edges')
+        if np.any(np.diff(self.edges) <= 0):
+            raise ValueError('histogram edges must be strictly increasing')
+        self.counts = np.zeros(len(self.edges) - 1, dtype=np.int64)
+        self.underflow = 0
+        self.overflow = 0
+
+    @classmethod
+    def linear(cls, minimum, maximum, buckets):
+        """Build a histogram of `buckets` bins of equal width"""
+        return cls(np.linspace(minimum, maximum, buckets + 1))
+
+    @classmethod
+    def logarithmic(cls, minimum, maximum, buckets):
+        """Build a histogram of `buckets` bins whose widths
+        grow geometrically; bounds must be strictly positive.
+        """
+        if minimum <= 0:
+            raise ValueError('logarithmic bins require a strictly positive minimum')
+        return cls(np.geomspace(minimum, maximum, buckets + 1))
+
+    def __len__(self):
+        return len(self.counts)
+
+    @property
+    def total(self):
+        """Amount of values counted into the bins"""
+        return int(self.counts.sum())
+
+    @property
+    def centers(self):
+        return (self.edges[:-1] + self.edges[1:]) / 2
+
+    def update(self, values):
+        """Account for an array-like of values, ignoring NaNs"""
+        values = _finite(values)
+        counts, _ = np.histogram(values, self.edges)
+        self.counts += counts
+        self.underflow += int(np.count_nonzero(values < self.edges[0]))
+        self.overflow += int(np.count_nonzero(values > self.edges[-1]))
+        return self
+
+    def merge(self, other):
+        """Add the counts of an other histogram with the same
+        edges into this one.
+        """
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError('cannot merge histograms with different edges')
+        self.counts += other.counts
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+        return self
+
+    def copy(self):
+        histogram = type(self)(self.edges)
+        return histogram.merge(self)
+
+    def __add__(self, other):
+        return self.copy().merge(other)
+
+    def pdf(self):
+        """Fraction of the counted values falling into each bin"""
+        return self.counts / self.counts.sum()
+
+    def cdf(self):
+        """Fraction of the counted values up to each bin"""
+        return np.cumsum(self.pdf())
+
+
+class QuantileSketch:
+    """Approximate quantiles of a stream of values.
+
+    Values are counted into buckets whose boundaries grow
+    geometrically so that any returned quantile lies within
+    `relative_accuracy` of the exact value. Memory only depends
+    on the range of the values, not on their amount, and sketches
+    built with the same accuracy can be merged.
+    """
+
+    def __init__(self, relative_accuracy=0.01):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError('relative accuracy must be between 0 and 1')
+        self.relative_accuracy = relative_accuracy
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self._positives = Counter()
+        self._negatives = Counter()
+        self.zeros = 0
+        self.count = 0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+
+    def __len__(self):
+        return self.count
+
+    def _accumulate(self, counter, values):
+        keys = np.ceil(np.log(values) / self._log_gamma).astype(np.int64)
+        keys, counts = np.unique(keys, return_counts=True)
+        counter.update(dict(zip(keys.tolist(), counts.tolist())))
+
+    def _value(self, key):
+        return 2 * self._gamma ** key / (self._gamma + 1)
+
+    def update(self, values):
+        """Account for an array-like of values, ignoring NaNs"""
+        values = _finite(values)
+        if not values.size:
+            return self
+        self._accumulate(self._positives, values[values > 0])
+        self._accumulate(self._negatives, -values[values < 0])
+        self.zeros += int(np.count_nonzero(values == 0))
+        self.count += values.size
+        self.minimum = min(self.minimum, values.min())
+        self.maximum = max(self.maximum, values.max())
+        return self
+
+    def merge(self, other):
+        """Add the buckets of an other sketch with the same
+        relative accuracy into this one.
+        """
+        if self.relative_accuracy != other.relative_accuracy:
+            raise ValueError('cannot merge sketches with different accuracies')
+        self._positives.update(other._positives)
+        self._negatives.update(other._negatives)
+        self.zeros += other.zeros
+        self.count += other.count
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+        return self
+
+    def copy(self):
+        sketch = type(self)(self.relative_accuracy)
+        return sketch.merge(self)
+
+    def __add__(self, other):
+        return self.copy().merge(other)
+
+    def quantiles(self, quantiles):
+        """Approximate the values at the given quantiles
+        (numbers between 0 and 1)"""
+        quantiles = np.asarray(quantiles, dtype=float)
+        if not self.count:
+            return np.full(quantiles.shape, np.nan)
+        if np.any((quantiles < 0) | (quantiles > 1)):
+            raise ValueError('quantiles must be between 0 and 1')
+
+        negatives = sorted(self._negatives, reverse=True)
+        positives = sorted(self._positives)
+        values = np.concatenate((
+            [-self._value(key) for key in negatives],
+            [0.0] if self.zeros else [],
+            [self._value(key) for key in positives]))
+        counts = np.concatenate((
+            [self._negatives[key] for key in negatives],
+            [self.zeros] if self.zeros else [],
+            [self._positives[key] for key in positives]))
+
+        ranks = quantiles * (self.count - 1)
+        indices = np.searchsorted(np.cumsum(counts), ranks, side='right')
+        values = np.clip(values[indices], self.minimum, self.maximum)
+        # Extremes are known exactly
+        return np.where(quantiles == 0, self.minimum, np.where(quantiles == 1, self.maximum, values))
+
+    def quantile(self, quantile):
+        """Approximate the value at the given quantile"""
+        return float(self.quantiles(quantile))
+
+    def cdf(self, values):
+        """Approximate the fraction of values lower than or equal
+        to each of the given values"""
+        values = np.asarray(values, dtype=float)
+        below = np.zeros(values.shape, dtype=np.int64)
+        for key, count in self._negatives.items():
+            below += count * (-self._value(key) <= values)
+        below += self.zeros * (values >= 0)
+        for key, count in self._positives.items():
+            below += count * (self._value(key) <= values)
+        return below / self.count if self.count else np.full(values.shape, np.nan)
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016-2023 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+
+"""Concurrent import of `Scenario` instances into a collector.
+
+This module provide the `ImportPipeline` class that writes the
+chunks of data generated by the `import_chunks` methods of the
+`InfluxDBConnection` and `ElasticSearchConnection` classes using
+a bounded pool of workers.
+"""
+
+__author__ = 'Mathias ETTINGER <mettinger@toulouse.viveris.com>'
+__all__ = ['ImportPipeline', 'ImportReport', 'ImportFailure']
+
+
+import sys
+import copy
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .sessions import build_session
+from .result_data import extract_jobs
+
+
+class ImportFailure(Exception):
+    """Raised when chunks could not be written at all"""
+
+    def __init__(self, report):
+        super().__init__('{} chunks could not be written: {}'.format(len(report.failures), report))
+        self.report = report
+
+
+class ImportReport:
+    """Progress and throughput of an import"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.end = None
+        self.chunks = {}
+        self.bytes = {}
+        self.retries = 0
+        self.rejected = {}
+        self.failures = []
+        self._lock = threading.Lock()
+
+    def _record(self, backend, body, retry='', failures=()):
+        """Account for a successful write of `body` whose `retry`
+        actions were rejected for the time being and `failures` ones
+        for good; the chunk is counted as written only if some of its
+        actions were not rejected.
+        """
+        written = len(body) - len(retry) - sum(len(action) for action, _ in failures)
+        with self._lock:
+            if failures:
+                self.rejected[backend] = self.rejected.get(backend, 0) + len(failures)
+                self.failures.extend((backend, action, error) for action, error in failures)
+            if written > 0:
+                self.chunks[backend] = self.chunks.get(backend, 0) + 1
+                self.bytes[backend] = self.bytes.get(backend, 0) + written
+
+    @property
+    def elapsed(self):
+        end = time.perf_counter() if self.end is None else self.end
+        return end - self.start
+
+    @property
+    def throughput(self):
+        """Amount of bytes written per second"""
+        elapsed = self.elapsed
+        return sum(self.bytes.values()) / elapsed if elapsed else 0.0
+
+    def __str__(self):
+        written = ', '.join(
+                '{}: {} chunks ({} bytes)'.format(backend, count, self.bytes[backend])
+                for backend, count in sorted(self.chunks.items()))
+        return '{} in {:.2f}s ({:.0f} B/s), {} retries, {} rejected actions, {} failures'.format(
+                written or 'nothing written', self.elapsed, self.throughput,
+                self.retries, sum(self.rejected.values()), len(self.failures))
+
+
+class ImportPipeline:
+    """Write the data of `Scenario` instances into InfluxDB and
+    ElasticSearch concurrently.
+
+    Chunks are written by a pool of `workers` threads; at most
+    `concurrency[backend]` of them are sent at once to a given
+    backend and at most `max_pending` chunks are generated ahead
+    of being written. Chunks that fail to be written are retried
+    `retries` times with an exponential backoff; connections are
+    copied to send their requests through a session that does not
+    retry on its own. The optional `progress` callable is called
+    with the `ImportReport` each time a chunk has been written.
+
+    Backends providing a `rejected_actions` method have the response
+    of their successful writes parsed by it: actions failing for good
+    are reported as failures while the others are retried as a
+    smaller chunk.
+    """
+
+    def __init__(
+            self, influxdb, elasticsearch, workers=8,
+            concurrency=None, max_pending=None, retries=3,
+            backoff_factor=0.5, progress=None):
+        session = build_session(pool_size=workers, retries=0)
+        self.backends = {
+                'influxdb': _with_session(influxdb, session),
+                'elasticsearch': _with_session(elasticsearch, session),
+        }
+        if concurrency is None:
+            concurrency = {'influxdb': workers, 'elasticsearch': max(1, workers // 2)}
+        self.limits = {
+                backend: threading.BoundedSemaphore(concurrency.get(backend, workers))
+                for backend in self.backends
+        }
+        self.workers = workers
+        self.pending = threading.BoundedSemaphore(2 * workers if max_pending is None else max_pending)
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.progress = progress
+
+    def chunks(self, scenario):
+        """Generate pairs of backend name and body to write"""
+        return self._job_chunks(extract_jobs(scenario))
+
+    def _job_chunks(self, jobs):
+        for scenario_id, owner_id, job in jobs:
+            for backend, connection in self.backends.items():
+                for chunk in connection.import_chunks(scenario_id, owner_id, job):
+                    yield backend, chunk
+
+    def run(self, *scenarios):
+        """Import the given `Scenario` instances and
+        return the associated `ImportReport`.
+
+        Raise `ImportFailure`, holding the report, if some chunks
+        could not be written at all; chained to the first exception
+        raised while writing, if any.
+        """
+        return self.run_jobs(job for scenario in scenarios for job in extract_jobs(scenario))
+
+    def run_jobs(self, jobs):
+        """Import the jobs of an iterable of triplets of scenario
+        instance ID, owner scenario instance ID and `Job` instance
+        (such as generated by `extract_jobs`), consuming it lazily;
+        see `run` for the returned value and raised exception.
+        """
+        report = ImportReport()
+        with ThreadPoolExecutor(self.workers) as executor:
+            for backend, chunk in self._job_chunks(jobs):
+                # Back-pressure: wait for a pending write to finish
+                self.pending.acquire()
+                future = executor.submit(self._write, backend, chunk, report)
+                future.add_done_callback(lambda _: self.pending.release())
+        report.end = time.perf_counter()
+
+        if report.failures:
+            errors = (error for _, _, error in report.failures if isinstance(error, Exception))
+            raise ImportFailure(report) from next(errors, None)
+        return report
+
+    def _write(self, backend, chunk, report):
+        connection = self.backends[backend]
+        for attempt in range(self.retries + 1):
+            if attempt:
+                with report._lock:
+                    report.retries += 1
+                time.sleep(self.backoff_factor * 2 ** (attempt - 1))
+            try:
+                with self.limits[backend]:
+                    response = connection.data_write(chunk)
+            except Exception as e:
+                error = e
+                continue
+
+            status = response.status_code
+            if status < 300:
+                rejected_actions = getattr(connection, 'rejected_actions', None)
+                if rejected_actions is None:
+                    retry, failures = '', []
+                else:
+                    # Bulk requests may succeed while some of their items failed
+                    retry, failures = rejected_actions(chunk, response)
+                report._record(backend, chunk, retry, failures)
+                if self.progress is not None:
+                    self.progress(report)
+                chunk = retry
+                if not chunk:
+                    return
+                error = 'actions rejected by an overloaded or unavailable server'
+                continue
+            error = response.content
+            if status != 429 and status < 500:
+                # Client errors will not succeed on retries
+                break
+
+        if __debug__:
+            print(error, file=sys.stderr)
+        with report._lock:
+            report.failures.append((backend, chunk, error))
+
+
+def _with_session(connection, session):
+    """Shallow copy of a database connection that
+    sends its requests through the given session.
+    """
+    if not hasattr(connection, 'session'):
+        return connection
+    connection = copy.copy(connection)
+    connection.session = session
+    return connection
@@ -50,14 +50,16 @@ __all__ = [
 
 import re
 import sys
+import json
 import enum
-import itertools
 from collections import defaultdict
 from contextlib import suppress
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 
 from .result_data import Scenario, get_or_create_scenario
+from .sessions import build_session, connection_statistics, compress_body
 
 
 #########################################
@@ -184,6 +186,22 @@ class ConditionTimestamp(ComparatorCondition):
 ############################################
 
 LINE_PROTOCOL_CHUNCK_SIZE = 4000
+LINE_PROTOCOL_CHUNCK_BYTES = 1024 * 1024
+DEFAULT_CHUNK_SIZE = 10000
+STREAM_READ_SIZE = 256 * 1024  # Lines of chunked responses can weigh hundreds of KB
+MULTI_STATEMENT_MAX_SIZE = 16384
+DOWNSAMPLING_AGGREGATORS = {
+        'mean': 'MEAN',
+        'max': 'MAX',
+        'min': 'MIN',
+        'count': 'COUNT',
+        'percentile': 'PERCENTILE',
+}
+DOWNSAMPLING_FILL_POLICIES = ('none', 'null', 'previous', 'linear')
+DOWNSAMPLING_TAGS = (
+        '@job_instance_id', '@scenario_instance_id',
+        '@owner_scenario_instance_id', '@agent_name', '@suffix',
+)
 MEASUREMENT_SPECIALS = re.compile(r'[ ,]')
 TAGS_AND_FIELDS_SPECIALS = re.compile(r'[ ,=]')
 FIELDS_VALUE_SPECIALS = re.compile(r'["]')
@@ -268,6 +286,73 @@ def select_query(job_name=None, field_names=None, condition=None):
     return query
 
 
+def downsampled_query(
+        job_name=None, field_names=None, condition=None, interval='1m',
+        aggregator='mean', percentile=None, fill='none'):
+    """Build a SELECT query that aggregates the points of each
+    series over consecutive `interval`s (a duration literal such
+    as '10s' or an amount of milliseconds).
+
+    `aggregator` is one of `DOWNSAMPLING_AGGREGATORS`; the
+    'percentile' one requires the `percentile` to compute. Empty
+    intervals are filled according to `fill`: one of 'none' (the
+    default, they are omitted), 'null', 'previous', 'linear' or
+    a number.
+
+    Fields are named after their statistic when `field_names` is
+    provided, or prefixed by the aggregator name and an underscore
+    otherwise.
+    """
+    try:
+        function = DOWNSAMPLING_AGGREGATORS[aggregator]
+    except KeyError:
+        raise ValueError('unknown aggregator: {}'.format(aggregator)) from None
+    if aggregator == 'percentile':
+        if percentile is None:
+            raise ValueError('the percentile aggregator requires a percentile to compute')
+        function = '{}({{}}, {})'.format(function, percentile)
+    else:
+        function = '{}({{}})'.format(function)
+    if fill not in DOWNSAMPLING_FILL_POLICIES and not isinstance(fill, (int, float)):
+        raise ValueError('unknown fill policy: {}'.format(fill))
+    if isinstance(interval, int):
+        interval = '{}ms'.format(interval)
+
+    if field_names:
+        fields = ','.join(
+                '{} AS "{}"'.format(function.format('"{}"'.format(name)), name)
+                for name in field_names)
+    else:
+        fields = function.format('*')
+    measurement_name = '/.*/' if job_name is None else '"{}"'.format(job_name)
+    query = 'SELECT {} FROM {}'.format(fields, measurement_name)
+    if condition is not None:
+        query = '{} WHERE {}'.format(query, condition)
+    tags = ','.join('"{}"'.format(tag) for tag in DOWNSAMPLING_TAGS)
+    return '{} GROUP BY time({}),{} fill({})'.format(query, interval, tags, fill)
+
+
+def bounds_queries(job_name=None, condition=None):
+    """Create the InfluxDB query strings to fetch the first
+    and last points (of each measurement) matching the given
+    optional condition.
+    """
+    query = select_query(job_name, condition=condition)
+    return '{} LIMIT 1'.format(query), '{} ORDER BY time DESC LIMIT 1'.format(query)
+
+
+def parse_bounds(first_response, last_response):
+    """Extract the first and last timestamps out of the responses
+    of the queries created by `bounds_queries`, or None if there
+    is no matching point.
+    """
+    # Each measurement returns its own first/last point
+    first = [stat['time'] for _, stat in parse_influx(first_response)]
+    last = [stat['time'] for _, stat in parse_influx(last_response)]
+    if first and last:
+        return min(first), max(last)
+
+
 def measurement_query(job=None, condition=None):
     """Build a SHOW MEASUREMENTS query"""
     query = 'SHOW MEASUREMENTS'
@@ -290,6 +375,42 @@ def delete_query(job_name=None, scenario=None, agent=None, job_instance=None, su
     return query
 
 
+def coalesce_timestamps(matching, timestamps):
+    """Group the sorted `timestamps` into ranges of consecutive
+    values that all belong to the `matching` set.
+    """
+    start = end = None
+    for timestamp in timestamps:
+        if timestamp in matching:
+            if start is None:
+                start = timestamp
+            end = timestamp
+        elif start is not None:
+            yield start, end
+            start = None
+    if start is not None:
+        yield start, end
+
+
+def pack_queries(statements, max_size=MULTI_STATEMENT_MAX_SIZE):
+    """Join statements into multi-statements queries whose length
+    does not exceed `max_size` (unless a single statement does).
+    """
+    queries = []
+    pack = []
+    length = 0
+    for statement in statements:
+        if pack and length + len(statement) + 1 > max_size:
+            queries.append(';'.join(pack))
+            pack = []
+            length = 0
+        pack.append(statement)
+        length += len(statement) + 1
+    if pack:
+        queries.append(';'.join(pack))
+    return queries
+
+
 def tag_query(tag_name, job=None, condition=None):
     """Build a SHOW TAG VALUES query"""
     query = 'SHOW TAG VALUES'
@@ -302,19 +423,27 @@ def tag_query(tag_name, job=None, condition=None):
 
 
 def parse_influx(response):
-    """Extract out relevant informations from an InfluxDB's response"""
-    for result in response.get('results', []):
-        for serie in result.get('series', []):
-            with suppress(KeyError):
-                name = serie.get('name')
-                fields = serie['columns']
-                for values in serie['values']:
-                    yield name, {f: v for f, v in zip(fields, values) if v is not None}
+    """Extract out relevant informations from an InfluxDB's response.
+
+    The response can either be the JSON of a regular query or an
+    iterable of such JSON objects, as generated by a chunked query.
+    Chunks are consumed one at a time and never stored.
+    """
+    responses = (response,) if isinstance(response, dict) else response
+    for chunk in responses:
+        for result in chunk.get('results', []):
+            for serie in result.get('series', []):
+                with suppress(KeyError):
+                    name = serie.get('name')
+                    fields = serie['columns']
+                    for values in serie['values']:
+                        yield name, {f: v for f, v in zip(fields, values) if v is not None}
 
 
 def parse_statistics(influx_result):
     """Generate `Scenario`s instances from InfluxDB stored data"""
     scenarios = {}  # Cache
+    stats, rows = None, []
     for job_name, statistics in parse_influx(influx_result):
         try:
             timestamp = statistics.pop('time')
@@ -332,8 +461,15 @@ def parse_statistics(influx_result):
                 scenario.owner = owner
                 owner.sub_scenarios[(scenario.instance_id,)] = scenario
             job = scenario.get_or_create_job(job_name, job, agent)
-            stats = job.get_or_create_statistics(suffix)
-            stats.add_statistic(timestamp, **statistics)
+            statistic = job.get_or_create_statistics(suffix)
+            if statistic is not stats:
+                # Rows of a serie are consecutive, store them in bulk
+                if rows:
+                    stats.extend(rows)
+                stats, rows = statistic, []
+            rows.append((timestamp, statistics))
+    if rows:
+        stats.extend(rows)
 
     yield from scenarios.values()
 
@@ -351,10 +487,91 @@ def parse_orphans(influx_result):
     return scenario
 
 
-def line_protocol(job_name, scenario_id, owner_id, agent_name, job_id, suffix, statistics):
-    """Generate chuncked bodies for write requests to InfluxDB"""
-    if not statistics:
-        return
+class LineProtocolEncoder:
+    """Format statistics as lines of InfluxDB's line protocol.
+
+    Escaped field names are cached per measurement so that
+    escaping rules are applied once per name rather than once
+    per line. Integers are written with the `i` suffix (thus
+    stored as integers by InfluxDB rather than floats) only if
+    `integer_suffix` is True.
+    """
+
+    def __init__(self, integer_suffix=False):
+        self.integer_suffix = integer_suffix
+        self.field_names = defaultdict(dict)
+        self.formatters = {
+                str: _format_string,
+                bool: str,
+                int: '{}i'.format if integer_suffix else str,
+                float: str,
+        }
+
+    def _format(self, value):
+        """Slow path for subclasses of the usual types"""
+        if isinstance(value, str):
+            return _format_string(value)
+        if self.integer_suffix and isinstance(value, int) and not isinstance(value, bool):
+            return '{}i'.format(value)
+        return str(value)
+
+    def _escape(self, names, name):
+        if ' ' in name or ',' in name or '=' in name:
+            escaped = TAGS_AND_FIELDS_SPECIALS.sub(r'\\\g<0>', name)
+        else:
+            escaped = name
+        names[name] = prefix = escaped + '='
+        return prefix
+
+    def lines(self, measurement, header, statistics):
+        """Generate the lines for each pair of timestamp and
+        dictionary of statistics, prefixed by `header`.
+        """
+        names = self.field_names[measurement]
+        escape = self._escape
+        formatters = self.formatters
+        default = self._format
+        header = header + ' '
+        for timestamp, data in statistics:
+            fields = ','.join([
+                    (names.get(name) or escape(names, name)) +
+                    formatters.get(value.__class__, default)(value)
+                    for name, value in data.items()
+                    if value or value == 0])
+            yield header + fields + ' ' + str(timestamp)
+
+
+def _format_string(value):
+    if '"' in value:
+        value = FIELDS_VALUE_SPECIALS.sub(r'\\\g<0>', value)
+    return '"' + value + '"'
+
+
+_ENCODER = LineProtocolEncoder()
+
+
+def line_protocol(
+        job_name, scenario_id, owner_id, agent_name, job_id, suffix, statistics,
+        max_bytes=LINE_PROTOCOL_CHUNCK_BYTES, max_lines=None, encoder=None):
+    """Generate chuncked bodies for write requests to InfluxDB.
+
+    Each body holds as many lines as possible without exceeding
+    `max_bytes` once UTF-8 encoded, and without exceeding `max_lines`
+    lines if provided (historically `LINE_PROTOCOL_CHUNCK_SIZE`).
+    Lines larger than `max_bytes` are sent alone.
+
+    Lines are formatted using the given `LineProtocolEncoder`
+    or a default one that writes integers as floats.
+
+    `statistics` is either a mapping of timestamps to dictionaries
+    of statistics or an iterable of such pairs, as generated by
+    `Statistic.rows`.
+    """
+    if hasattr(statistics, 'items'):
+        statistics = statistics.items()
+
+    if encoder is None:
+        encoder = _ENCODER
 
     tags = {
         '@scenario_instance_id': scenario_id,
@@ -372,21 +589,42 @@ def line_protocol(job_name, scenario_id, owner_id, agent_name, job_id, suffix, s
             for tag, value in tags.items() if value or value == 0)
     header = ','.join(measurement)
 
-    def build_lines_of_data(statistics_chunck):
-        for timestamp, data in statistics_chunck:
-            fields = ','.join(
-                    escape_field(name, value)
-                    for name, value in data.items()
-                    if value or value == 0)
-            yield '{} {} {}'.format(header, fields, timestamp)
-
-    stats_iterator = iter(statistics.items())
-    while True:
-        chunck = itertools.islice(stats_iterator, LINE_PROTOCOL_CHUNCK_SIZE)
-        lines = '\n'.join(build_lines_of_data(chunck))
-        if not lines:
-            break
-        yield lines
+    lines = []
+    size = 0
+    for line in encoder.lines(job_name, header, statistics):
+        length = len(line) if line.isascii() else len(line.encode())
+        if lines and (
+                (max_bytes is not None and size + length > max_bytes) or
+                (max_lines is not None and len(lines) >= max_lines)):
+            yield '\n'.join(lines)
+            lines = []
+            size = 0
+        lines.append(line)
+        size += length + 1
+    if lines:
+        yield '\n'.join(lines)
+
+
+def _series_key(job_name, statistics):
+    """Build the arguments of `delete_query` that
+    identify the serie a line of data belongs to.
+    """
+    return (
+            job_name,
+            statistics.get('@scenario_instance_id'),
+            statistics.get('@agent_name'),
+            statistics.get('@job_instance_id'),
+            statistics.get('@suffix'),
+    )
+
+
+def _is_deleted_along(series, deleted_series):
+    """Check whether a DELETE query on the `deleted_series`
+    would also remove points from `series`.
+    """
+    return all(
+            deleted is None or deleted == tag
+            for tag, deleted in zip(series, deleted_series))
 
 
 ###############################
@@ -398,8 +636,13 @@ class InfluxDBCommunicator:
 
     TIMEOUT = (2, 3600)  # Requests (connection, data) timeouts in second
 
-    def __init__(self, ip, port=8086, db_name='openbach', precision='ms'):
-        """Configure the routes to send/get data to/from InfluxDB"""
+    def __init__(self, ip, port=8086, db_name='openbach', precision='ms', *, session=None, compress=False):
+        """Configure the routes to send/get data to/from InfluxDB.
+
+        Requests are sent through the given `requests.Session`, or
+        through a new pooled session if none is provided. Bodies
+        of write requests are gzipped if `compress` is True.
+        """
 
         def url_builder(route, time_unit):
             return requests.Request(
@@ -410,14 +653,47 @@ class InfluxDBCommunicator:
 
         self.writing_URL = url_builder('write', 'precision')
         self.querying_URL = url_builder('query', 'epoch')
+        self.precision = precision
+        self.session = build_session() if session is None else session
+        self.compress = compress
+
+    @property
+    def connection_statistics(self):
+        """Amount of connections opened and requests sent by the session"""
+        return connection_statistics(self.session)
 
     def sql_query(self, query):
         """Send a query to InfluxDB and gather the results"""
-        return requests.get(self.querying_URL, params={'q': query}, timeout=self.TIMEOUT).json()
+        return self.session.get(self.querying_URL, params={'q': query}, timeout=self.TIMEOUT).json()
+
+    def chunked_query(self, query, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Send a query to InfluxDB and generate the results
+        as they arrive, in chunks of at most `chunk_size` points.
+
+        Each chunk is a JSON object similar to the one returned
+        by `sql_query`; a serie may span several chunks.
+        """
+        params = {'q': query, 'chunked': 'true', 'chunk_size': chunk_size}
+        with self.session.get(self.querying_URL, params=params, timeout=self.TIMEOUT, stream=True) as response:
+            for line in response.iter_lines(chunk_size=STREAM_READ_SIZE):
+                if line:
+                    yield json.loads(line)
+
+    def _query(self, query, chunk_size=None):
+        """Dispatch the query to either `sql_query` or `chunked_query`
+        depending on the requested `chunk_size`.
+        """
+        if chunk_size is None:
+            return self.sql_query(query)
+        return self.chunked_query(query, chunk_size)
 
     def data_write(self, data):
         """Send data to InfluxDB so they are stored"""
-        return requests.post(self.writing_URL, data.encode(), timeout=self.TIMEOUT)
+        if self.compress:
+            body, headers = compress_body(data)
+        else:
+            body, headers = data.encode(), None
+        return self.session.post(self.writing_URL, body, headers=headers, timeout=self.TIMEOUT)
 
 
 class InfluxDBConnection(InfluxDBCommunicator):
@@ -459,7 +735,7 @@ class InfluxDBConnection(InfluxDBCommunicator):
         """List the available timestamps in InfluxDB
         that correspond to the given constraints.
         """
-        condition = tags_to_condition(scenario, agent, job_instance, suffix)
+        condition = tags_to_condition(scenario, agent, job_instance, suffix, condition)
         response = self.sql_query(select_query(job, condition=condition))
         return {stat['time'] for _, stat in parse_influx(response)}
 
@@ -475,6 +751,64 @@ class InfluxDBConnection(InfluxDBCommunicator):
             (_, origin_stat), = parse_influx(response)
             return origin_stat['time']
 
+    def bounds(self, job=None, scenario=None, agent=None,
+               job_instance=None, suffix=None, condition=None):
+        """Retrieve the first and last timestamps in InfluxDB
+        that correspond to the given constraints.
+        """
+        condition = tags_to_condition(scenario, agent, job_instance, suffix, condition)
+        return self._time_bounds(job, condition)
+
+    def _time_bounds(self, job, condition):
+        first, last = bounds_queries(job, condition)
+        return parse_bounds(self.sql_query(first), self.sql_query(last))
+
+    def _windowed_query(self, job, fields, condition, windows, concurrency=None):
+        """Split the time range covered by the query into `windows`
+        intervals queried concurrently, and merge the responses
+        back so they can be parsed as if a single query was made.
+        """
+        bounds = self._time_bounds(job, condition)
+        if bounds is None:
+            return []
+        lower, upper = bounds
+        span = upper - lower + 1
+        edges = sorted({lower + span * window // windows for window in range(windows)} | {upper + 1})
+
+        queries = []
+        for start, end in zip(edges, edges[1:]):
+            window = ConditionAnd(
+                    ConditionTimestamp(Operator.GreaterOrEqual, start, self.precision),
+                    ConditionTimestamp(Operator.LessThan, end, self.precision))
+            window_condition = window if condition is None else ConditionAnd(condition, window)
+            queries.append(select_query(job, fields, window_condition))
+
+        with ThreadPoolExecutor(concurrency or len(queries)) as executor:
+            responses = list(executor.map(self.sql_query, queries))
+
+        # Series are sorted by measurement name in each response,
+        # regroup them so each measurement is in timestamp order
+        series = defaultdict(list)
+        for response in responses:
+            for result in response.get('results', []):
+                for serie in result.get('series', []):
+                    series[serie.get('name')].append(serie)
+        return [
+                {'results': [{'series': [serie]}]}
+                for name in sorted(series, key=lambda name: (name is not None, name or ''))
+                for serie in series[name]
+        ]
+
+    def _select(self, job, fields, condition, chunk_size=None, windows=None, concurrency=None):
+        """Send the SELECT query using either a single request,
+        a chunked request or a set of time-partitioned requests.
+        """
+        if windows is None or windows < 2:
+            return self._query(select_query(job, fields, condition), chunk_size)
+        if chunk_size is not None:
+            raise ValueError('chunk_size and windows can not be used together')
+        return self._windowed_query(job, fields, condition, windows, concurrency)
+
     def suffixes(self, job=None, scenario=None, agent=None, job_instance=None):
         """List the available suffixes in InfluxDB
         that correspond to the given constraints.
@@ -485,36 +819,56 @@ class InfluxDBConnection(InfluxDBCommunicator):
 
     def raw_statistics(
             self, job=None, scenario=None, agent=None, job_instance=None,
-            suffix=None, fields=None, condition=None, timestamps=None):
+            suffix=None, fields=None, condition=None, timestamps=None,
+            chunk_size=None, windows=None, concurrency=None):
         """Fetch data from InfluxDB that correspond to the given constraints
         and generate values in series.
+
+        If `chunk_size` is provided, the response is streamed from
+        InfluxDB and parsed by chunks of at most `chunk_size` points.
+
+        If `windows` is provided, the time range of the data is split
+        into that many intervals queried concurrently (by at most
+        `concurrency` threads) and merged back in timestamp order.
         """
         if timestamps is not None:
             timestamp_condition = ConditionTimestamp.from_timestamps(timestamps)
             condition = timestamp_condition if condition is None else ConditionAnd(condition, timestamp_condition)
         _condition = tags_to_condition(scenario, agent, job_instance, suffix, condition)
-        response = self.sql_query(select_query(job, fields, _condition))
+        response = self._select(job, fields, _condition, chunk_size, windows, concurrency)
         yield from parse_influx(response)
 
     def statistics(
             self, job=None, scenario=None, agent=None, job_instance=None,
-            suffix=None, fields=None, condition=None, timestamps=None):
+            suffix=None, fields=None, condition=None, timestamps=None,
+            chunk_size=None, windows=None, concurrency=None):
         """Fetch data from InfluxDB that correspond to the given constraints
         and generate according `Scenario`s instances.
+
+        If `chunk_size` is provided, the response is streamed from
+        InfluxDB and parsed by chunks of at most `chunk_size` points.
+
+        If `windows` is provided, the time range of the data is split
+        into that many intervals queried concurrently (by at most
+        `concurrency` threads) and merged back in timestamp order.
         """
         if timestamps is not None:
             timestamp_condition = ConditionTimestamp.from_timestamps(timestamps)
             condition = timestamp_condition if condition is None else ConditionAnd(condition, timestamp_condition)
         _condition = tags_to_condition(scenario, agent, job_instance, suffix, condition, subscenarios=True)
-        response = self.sql_query(select_query(job, fields, _condition))
+        response = self._select(job, fields, _condition, chunk_size, windows, concurrency)
 
         if scenario is not None:
             for scenario_instance in parse_statistics(response):
                 if scenario_instance.instance_id == scenario:
                     owner = scenario_instance.owner_instance_id
                     _condition = tags_to_condition(owner, agent, job_instance, suffix, condition, subscenarios=True)
-                    response = self.sql_query(select_query(job, fields, _condition))
+                    response = self._select(job, fields, _condition, chunk_size, windows, concurrency)
                     break
+            else:
+                if chunk_size is not None:
+                    # Streamed chunks were consumed searching for the owner
+                    response = self._select(job, fields, _condition, chunk_size)
         yield from parse_statistics(response)
 
     def orphans(self, condition=None, timestamps=None):
@@ -530,29 +884,75 @@ class InfluxDBConnection(InfluxDBCommunicator):
 
     def remove_statistics(
             self, job=None, scenario=None, agent=None,
-            job_instance=None, suffix=None, condition=None, timestamps=None):
-        """Delete data in InfluxDB that matches the given constraints"""
+            job_instance=None, suffix=None, condition=None, timestamps=None,
+            *, dry_run=False, max_query_size=MULTI_STATEMENT_MAX_SIZE):
+        """Delete data in InfluxDB that matches the given constraints.
+
+        Return the amount of DELETE queries sent to InfluxDB, or that
+        would have been sent if `dry_run` is True.
+        """
         if timestamps is not None:
             timestamp_condition = ConditionTimestamp.from_timestamps(timestamps)
             condition = timestamp_condition if condition is None else ConditionAnd(condition, timestamp_condition)
         if condition is None or condition.is_timestamp:
-            self.sql_query(delete_query(job, scenario, agent, job_instance, suffix, condition))
-            return
-        # As InfluxDB cannot delete data based on field
-        # content, delete timestamps one by one
-        condition = tags_to_condition(scenario, agent, job_instance, suffix, condition)
-        response = self.sql_query(select_query(job, [], condition))
+            if not dry_run:
+                self.sql_query(delete_query(job, scenario, agent, job_instance, suffix, condition))
+            return 1
+        # As InfluxDB cannot delete data based on field content,
+        # delete ranges of consecutive matching timestamps instead
+        _condition = tags_to_condition(scenario, agent, job_instance, suffix, condition)
+        response = self.sql_query(select_query(job, [], _condition))
+        matching = defaultdict(set)
         for job_name, statistics in parse_influx(response):
-            timestamp = ConditionTimestamp(Operator.Equal, statistics['time'])
-            scenario = statistics.get('@scenario_instance_id')
-            agent = statistics.get('@agent_name')
-            job_instance = statistics.get('@job_instance_id')
-            suffix = statistics.get('@suffix')
-            # Delete the current timestamp only
-            self.sql_query(delete_query(job_name, scenario, agent, job_instance, suffix, timestamp))
-
-    def import_job(self, scenario_id, owner_id, job):
-        """Write the data of the given job into InfluxDB"""
+            matching[_series_key(job_name, statistics)].add(statistics['time'])
+        if not matching:
+            return 0
+
+        # Retrieve non-matching points in between so they are kept;
+        # only measurements with matching points are concerned and
+        # each of them only within the span of its matching points.
+        # All fields are selected as InfluxDB omits points whose
+        # selected fields are all empty, which would then be deleted.
+        spans = {}
+        for (job_name, *_), times in matching.items():
+            lower, upper = spans.get(job_name, (min(times), max(times)))
+            spans[job_name] = min(lower, min(times)), max(upper, max(times))
+        statements = [
+                select_query(job_name, [], tags_to_condition(
+                    scenario, agent, job_instance, suffix,
+                    ConditionTimestamp.from_timestamps(span)))
+                for job_name, span in spans.items()
+        ]
+        timelines = defaultdict(set)
+        for query in pack_queries(statements, max_query_size):
+            for job_name, statistics in parse_influx(self.sql_query(query)):
+                timelines[_series_key(job_name, statistics)].add(statistics['time'])
+
+        statements = []
+        for series, times in matching.items():
+            timeline = set(times)
+            for other_series, other_times in timelines.items():
+                if _is_deleted_along(other_series, series):
+                    timeline.update(other_times)
+            for start, end in coalesce_timestamps(times, sorted(timeline)):
+                timestamp = ConditionTimestamp.from_timestamps(start if start == end else (start, end))
+                statements.append(delete_query(*series, timestamp))
+
+        queries = pack_queries(statements, max_query_size)
+        if not dry_run:
+            for query in queries:
+                self.sql_query(query)
+        return len(queries)
+
+    def import_chunks(
+            self, scenario_id, owner_id, job,
+            max_bytes=LINE_PROTOCOL_CHUNCK_BYTES, max_lines=None):
+        """Generate the bodies of the write requests
+        needed to import the data of the given job.
+
+        See `line_protocol` for the meaning of `max_bytes`
+        and `max_lines`.
+        """
         job_name = job.name
         agent_name = job.agent
         job_id = job.instance_id
@@ -560,13 +960,19 @@ class InfluxDBConnection(InfluxDBCommunicator):
             # For simplicity, statistics names are stored as 1-tuples
             # keys in statistics_data throughout this package. Extract
             # them here to send them to influx as single strings.
-            data_stream = line_protocol(
+            yield from line_protocol(
                     job_name, scenario_id, owner_id, agent_name,
-                    job_id, suffix[0], statistics.dated_data)
-            for chunck in data_stream:
-                response = self.data_write(chunck)
-                if __debug__ and response.content:
-                    print(response.content, file=sys.stderr)
+                    job_id, suffix[0], statistics.rows(),
+                    max_bytes, max_lines)
+
+    def import_job(
+            self, scenario_id, owner_id, job,
+            max_bytes=LINE_PROTOCOL_CHUNCK_BYTES, max_lines=None):
+        """Write the data of the given job into InfluxDB"""
+        for chunck in self.import_chunks(scenario_id, owner_id, job, max_bytes, max_lines):
+            response = self.data_write(chunck)
+            if __debug__ and response.content:
+                print(response.content, file=sys.stderr)
 
     def get_field_keys(self):
         """Get the names of the fields from InfluxDB"""
@@ -31,14 +31,18 @@
 """
 
 __author__ = 'Mathias ETTINGER <mettinger@toulouse.viveris.com>'
-__all__ = ['save', 'Statistics']
+__all__ = ['save', 'histograms_to_dataframe', 'render_figures', 'FigureSpec', 'Statistics']
 
+import os
 import math
+import time
 import pickle
 import stat
 import warnings
 import itertools
 from functools import partial
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from contextlib import suppress
 from datetime import datetime,timedelta
 
@@ -47,8 +51,9 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 
+from .histograms import StreamingHistogram
 from .influxdb_tools import (
-        tags_to_condition, select_query,
+        DEFAULT_CHUNK_SIZE, tags_to_condition, select_query, downsampled_query,
         InfluxDBCommunicator, Operator,
         ConditionTag, ConditionAnd, ConditionOr,ConditionTimestamp,
 )
@@ -57,10 +62,6 @@ from .influxdb_tools import (
 DEFAULT_COLLECTOR_FILEPATH = '/opt/openbach/agent/collector.yml'
 
 
-def _identity(x):
-    return x
-
-
 def _column_name_serializer(name):
     return '_'.join(map(str, name))
 
@@ -71,6 +72,19 @@ def _prepare_columns(df, columns):
     return df
 
 
+def _convert_dataframe(df):
+    """Convert the columns of a DataFrame built from an InfluxDB
+    response into numbers; except for the agent name and suffix
+    tags that are kept as strings.
+    """
+    converted = df.drop(columns=['@owner_scenario_instance_id', '@agent_name', '@suffix'], errors='ignore')
+    converted = converted.apply(partial(pd.to_numeric, errors='coerce'))
+    converted['@agent_name'] = df['@agent_name']
+    converted = converted[[column for column in df.columns if column in converted.columns]]
+    converted['@suffix'] = df['@suffix'].fillna('') if '@suffix' in df else ''
+    return converted
+
+
 def influx_to_pandas(response, query):
     try:
         results = response['results']
@@ -87,10 +101,14 @@ def influx_to_pandas(response, query):
 
         for serie in series:
             try:
-                yield pd.DataFrame(serie['values'], columns=serie['columns'])
+                df = pd.DataFrame(serie['values'], columns=serie['columns'])
             except KeyError:
                 warnings.warn('The query \'{}\' returned time series with no data, ignoring'.format(query))
-                pass
+                continue
+            # Grouped queries return their tags alongside the values
+            for tag, value in serie.get('tags', {}).items():
+                df[tag] = value
+            yield df
 
 
 def compute_histogram(bins):
@@ -109,6 +127,25 @@ def compute_annotated_histogram(bins):
     return _compute_annotated_histogram
 
 
+def histograms_to_dataframe(histograms, cumulative=False):
+    """Turn a mapping of column labels and `StreamingHistogram`s
+    sharing the same edges into a DataFrame alike to the ones
+    returned by `_Plot.histogram` (or `_Plot.cumulative_histogram`
+    if `cumulative` is set).
+    """
+    labels = list(histograms)
+    if not labels:
+        return pd.DataFrame()
+    index = histograms[labels[0]].centers
+    values = np.column_stack([
+        histogram.cdf() if cumulative else histogram.pdf()
+        for histogram in histograms.values()])
+    columns = pd.Index(labels)
+    if columns.nlevels == 5:
+        columns.names = ['job', 'scenario', 'agent', 'suffix', 'statistic']
+    return pd.DataFrame(values, index=index, columns=columns)
+
+
 def save(figure, filename, use_pickle=False, set_legend=True):
     if use_pickle:
         with open(filename, 'wb') as storage:
@@ -120,6 +157,17 @@ def save(figure, filename, use_pickle=False, set_legend=True):
         figure.savefig(filename, bbox_inches='tight')
 
 
+FigureSpec = namedtuple('FigureSpec', 'data kind filename options', defaults=(None,))
+FigureSpec.__doc__ = """Description of a figure to render through `render_figures`:
+`data` is a `_Plot` (or a DataFrame laid out alike), `kind` the
+name of one of its `plot_*` method without the prefix (e.g.
+'time_series'), `filename` the file to write (or a sequence of
+files, to write the same figure in several formats) and `options`
+the keyword arguments of the plot method.
+"""
+RenderedFigure = namedtuple('RenderedFigure', 'filename elapsed error')
+
+
 def aggregator_factory(mapping):
     def aggregator(pd_datetime):
         for moment, intervals in mapping.items():
@@ -129,6 +177,47 @@ def aggregator_factory(mapping):
     return aggregator
 
 
+def binned_counts(values, group_codes, groups, bins):
+    """Count values into a 2D histogram of shape `(groups, len(bins) - 1)`
+    in a single pass; values being associated to the group of the same
+    index in `group_codes`.
+
+    Bins follow the `numpy.histogram` conventions: they are half-open
+    except the last one, and values outside of them or NaNs are ignored.
+    """
+    buckets = len(bins) - 1
+    positions = np.searchsorted(bins, values, side='right') - 1
+    positions[values == bins[-1]] = buckets - 1
+    kept = (positions >= 0) & (positions < buckets) & ~np.isnan(values)
+    flat = np.bincount(group_codes[kept] * buckets + positions[kept], minlength=groups * buckets)
+    return flat.reshape(groups, buckets)
+
+
+def label_moments(index, earliest, midday, latest):
+    """Label each date of a DatetimeIndex with the moment of the
+    day it belongs to; moments being `(starting hour, label)` pairs.
+
+    Moments are right-closed: a date exactly on the starting hour of
+    a moment is labelled as the previous one. A midnight whose previous
+    day does not appear in the index is labelled 'Undefined', as with
+    the `aggregator_factory` function.
+    """
+    days = index.normalize()
+    elapsed = (index - days).to_numpy()
+    earliest_hour, midday_hour, latest_hour = (
+            np.timedelta64(hour, 'h') for hour, _ in (earliest, midday, latest))
+
+    labels = np.array([earliest[1], midday[1], latest[1], 'Undefined'], dtype=object)
+    codes = np.full(len(index), 2, dtype=np.int8)
+    codes[(elapsed > earliest_hour) & (elapsed <= midday_hour)] = 0
+    codes[(elapsed > midday_hour) & (elapsed <= latest_hour)] = 1
+    midnights = np.flatnonzero(elapsed == np.timedelta64(0))
+    previous_days = days[midnights] - pd.Timedelta(days=1)
+    codes[midnights[~previous_days.isin(days)]] = 3
+    moments = labels[codes]
+    return moments
+
+
 class Statistics(InfluxDBCommunicator):
     @classmethod
     def from_default_collector(cls, filepath=DEFAULT_COLLECTOR_FILEPATH):
@@ -155,7 +244,8 @@ class Statistics(InfluxDBCommunicator):
 
     def _raw_influx_query(
             self, job=None, scenario=None, agent=None, job_instances=(),
-            suffix=None, fields=None,timestamps=None, condition=None):
+            suffix=None, fields=None,timestamps=None, condition=None,
+            downsampling=None, aggregator='mean', percentile=None, fill='none'):
 
         if timestamps is not None:
             timestamp_condition = ConditionTimestamp.from_timestamps(timestamps)
@@ -175,50 +265,119 @@ class Statistics(InfluxDBCommunicator):
             _condition = ConditionOr(*instances)
         else:
             _condition = ConditionAnd(conditions, ConditionOr(*instances))
-        return select_query(job, fields, _condition)
+        if downsampling is None:
+            return select_query(job, fields, _condition)
+        return downsampled_query(job, fields, _condition, downsampling, aggregator, percentile, fill)
 
-    def _parse_dataframes(self, response, query):
+    def _parse_dataframes(self, response, query, prefix=None):
         offset = self.origin
         names = ['job', 'scenario', 'agent', 'suffix', 'statistic']
+        tags = ['@job_instance_id', '@scenario_instance_id', '@agent_name', '@suffix']
         for df in influx_to_pandas(response, query):
-            converters = dict.fromkeys(df.columns, partial(pd.to_numeric, errors='coerce'))            
-            converters.pop('@owner_scenario_instance_id')
-            converters.pop('@suffix', None)
-            converters['@agent_name'] = _identity
-            converted = [convert(df[column]) for column, convert in converters.items()]
-
-            if '@suffix' in df:
-                converted.append(df['@suffix'].fillna(''))
+            if df.empty:
+                continue
+            if prefix is not None:
+                df = df.rename(columns=lambda name: name[len(prefix):] if name.startswith(prefix) else name)
+            df = _convert_dataframe(df)
+
+            # Sort rows by group, keeping the order of first appearance
+            codes, uniques = pd.MultiIndex.from_frame(df[tags]).factorize()
+            order = np.argsort(codes, kind='stable')
+            counts = np.bincount(codes, minlength=len(uniques))
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+            times = df['time'].to_numpy()[order]
+            if offset is None:
+                times = times - np.repeat(times[starts], counts)
             else:
-                converted.append(pd.Series('', index=df.index, name='@suffix'))
-            df = pd.concat(converted, axis=1)
-
-            df.set_index(['@job_instance_id', '@scenario_instance_id', '@agent_name', '@suffix'], inplace=True)
-            for index in df.index.unique():
-                extract = df.xs(index)
-                if isinstance(extract, pd.Series):
-                    extract = pd.DataFrame(extract.to_dict(), index=[0])
-                section = extract.reset_index(drop=True).dropna(axis=1, how='all')
-                section['time'] -= section.time[0] if offset is None else offset
-                section.set_index('time', inplace=True)
-                section.index.name = 'Time (ms)'
-                section.reindex(columns=section.columns.sort_values())
-                section.columns = pd.MultiIndex.from_tuples([index + (name,) for name in section.columns], names=names)
+                times = times - offset
+
+            statistics = [column for column in df.columns if column not in tags and column != 'time']
+            columns = [df[column].to_numpy()[order] for column in statistics]
+            not_empty = np.logical_or.reduceat(df[statistics].notna().to_numpy()[order], starts, axis=0)
+
+            # Build the columns of every section at once
+            groups, kept = np.nonzero(not_empty)
+            labels = pd.MultiIndex.from_arrays(
+                    [uniques.get_level_values(level)[groups] for level in range(len(tags))]
+                    + [np.array(statistics, dtype=object)[kept]],
+                    names=names)
+            bounds = np.concatenate(([0], np.cumsum(not_empty.sum(axis=1))))
+
+            for group, (start, count) in enumerate(zip(starts, counts)):
+                end = start + count
+                first, last = bounds[group:group + 2]
+                section = pd.DataFrame(
+                        {i: columns[kept[i]][start:end] for i in range(first, last)},
+                        index=pd.Index(times[start:end], name='Time (ms)'))
+                section.columns = labels[first:last]
                 yield section
 
+    def _downsampled_prefix(self, fields, downsampling, aggregator):
+        """Prefix InfluxDB gives to the statistics aggregated
+        by a wildcard downsampled query, if any.
+        """
+        if downsampling is not None and not fields:
+            return aggregator + '_'
+
+    def accumulate(
+            self, factory, job=None, scenario=None, agent=None, job_instances=(),
+            suffix=None, fields=None, timestamps=None, condition=None,
+            chunk_size=DEFAULT_CHUNK_SIZE):
+        """Stream statistics out of InfluxDB and feed them, chunk
+        after chunk, into accumulators created by calling `factory`
+        (e.g. a `StreamingHistogram` or a `QuantileSketch`).
+
+        Return a dictionary of the accumulators keyed by the same
+        column labels than the DataFrames of `_Plot`s, so they can
+        be merged further across job instances. Memory usage only
+        depends on the `chunk_size` and on the accumulators.
+        """
+        query = self._raw_influx_query(job, scenario, agent, job_instances, suffix, fields, timestamps, condition)
+        accumulators = {}
+        for chunk in self.chunked_query(query, chunk_size):
+            for df in self._parse_dataframes(chunk, query):
+                for label, column in df.items():
+                    if label not in accumulators:
+                        accumulators[label] = factory()
+                    accumulators[label].update(column.to_numpy())
+        return accumulators
+
     def fetch(
             self, job=None, scenario=None, agent=None, job_instances=(),
-            suffix=None, fields=None,timestamps=None, condition=None):
-        query = self._raw_influx_query(job, scenario, agent, job_instances, suffix, fields, timestamps,condition)
+            suffix=None, fields=None,timestamps=None, condition=None,
+            downsampling=None, aggregator='mean', percentile=None, fill='none'):
+        """Retrieve statistics and yield a _Plot per job instance
+        (and suffix).
+
+        When `downsampling` is an interval (e.g. '1m' or an amount of
+        milliseconds), points are aggregated over consecutive intervals
+        by the database using the `aggregator` ('mean', 'max', 'min',
+        'count' or 'percentile', in which case `percentile` holds the
+        percentile to compute); empty intervals are handled according
+        to the `fill` policy ('none', 'null', 'previous', 'linear' or
+        a number).
+        """
+        query = self._raw_influx_query(
+                job, scenario, agent, job_instances, suffix, fields, timestamps,condition,
+                downsampling, aggregator, percentile, fill)
         data = self.sql_query(query)
-        yield from (_Plot(df) for df in self._parse_dataframes(data, query))
+        prefix = self._downsampled_prefix(fields, downsampling, aggregator)
+        yield from (_Plot(df) for df in self._parse_dataframes(data, query, prefix))
 
     def fetch_all(
             self, job=None, scenario=None, agent=None, job_instances=(),
-            suffix=None, fields=None, timestamps=None, condition=None, columns=None):
-        query = self._raw_influx_query(job, scenario, agent, job_instances, suffix, fields,timestamps, condition)
+            suffix=None, fields=None, timestamps=None, condition=None, columns=None,
+            downsampling=None, aggregator='mean', percentile=None, fill='none'):
+        """Retrieve statistics into a single _Plot, see `fetch`
+        for the downsampling options.
+        """
+        query = self._raw_influx_query(
+                job, scenario, agent, job_instances, suffix, fields,timestamps, condition,
+                downsampling, aggregator, percentile, fill)
         data = self.sql_query(query)
-        df = pd.concat(self._parse_dataframes(data, query), axis=1)
+        prefix = self._downsampled_prefix(fields, downsampling, aggregator)
+        df = pd.concat(self._parse_dataframes(data, query, prefix), axis=1)
         if not job_instances or columns is None:
             return _Plot(df)
         columns = iter(columns)
@@ -250,11 +409,12 @@ class _Plot:
     def histogram(self, buckets):
         r_min = self.df.min().min()
         r_max = self.df.max().max()
-        bins = np.linspace(r_min, r_max, buckets + 1)
-        histogram = compute_histogram(bins)
-        df = self.df.apply(histogram)
-        bins = (bins + np.roll(bins, -1)) / 2
-        df.index = bins[:buckets]
+        histograms = {
+                label: StreamingHistogram.linear(r_min, r_max, buckets).update(column.to_numpy())
+                for label, column in self.df.items()
+        }
+        df = histograms_to_dataframe(histograms)
+        df.columns = self.df.columns
         return df
 
     def cumulative_histogram(self, buckets):
@@ -285,30 +445,27 @@ class _Plot:
             add_total=True, scale_factor=None):
         df = self._find_statistic(statistic_name, index)
         if scale_factor:
-            df /= scale_factor
-        
-        df.index = pd.to_datetime(df.index, unit='ms')
+            df = df / scale_factor
         
+        moments = getattr(pd.to_datetime(df.index, unit='ms'), time_aggregation)
+
         if maximum is None:
             nb_segments = math.ceil((df.max().max() - offset) / bin_size)
             maximum = nb_segments * bin_size + offset
         nb_segments = math.ceil((maximum - offset) / bin_size)
 
         bins = np.linspace(offset, maximum, nb_segments + 1, dtype='int')
-        
+        groups, group_codes = np.unique(np.asarray(moments), return_inverse=True)
+        index = pd.Index(['{}-{}'.format(i, i+1) for i in groups], name='Time ({}s)'.format(time_aggregation))
+
         for _, column in df.items():
-            cframe = column.to_frame()
-            groups = cframe.groupby(getattr(cframe.index, time_aggregation))
-            stats = groups.apply(compute_annotated_histogram(bins)) * 100
-            stats.index = ['{}-{}'.format(i, i+1) for i in stats.index.droplevel()]
-            stats.index.name = 'Time ({}s)'.format(time_aggregation)
-            if add_total:
-                total = cframe.apply(compute_histogram(bins)) * 100
-                total.index = bins[1:]
-                total.columns = ['total']
-                yield pd.concat([stats, total.T])
-            else:
-                yield stats
+            # Per-group and total histograms out of the same counts
+            counts = binned_counts(column.to_numpy(dtype=float), group_codes, len(groups), bins)
+            total = counts.sum(axis=0, keepdims=True)
+            with np.errstate(invalid='ignore'):
+                stats = pd.DataFrame(counts / counts.sum(axis=1, keepdims=True) * 100, index=index, columns=bins[1:])
+                total = pd.DataFrame(total / total.sum() * 100, index=['total'], columns=bins[1:])
+            yield pd.concat([stats, total]) if add_total else stats
 
     def compute_function(
             self, operation, scale_factor,
@@ -322,22 +479,10 @@ class _Plot:
                 (start_evening, f'{label_evening} ({start_evening}h − {start_night}h)'),
                 (start_night, f'{label_night} ({start_night}h − {start_day}h)'),
         ])
-        intervals = [(
-            pd.Interval(pd.Timestamp(date), pd.Timestamp(date).replace(hour=earliest[0])),
-            pd.Interval(pd.Timestamp(date).replace(hour=earliest[0]), pd.Timestamp(date).replace(hour=midday[0])),
-            pd.Interval(pd.Timestamp(date).replace(hour=midday[0]), pd.Timestamp(date).replace(hour=latest[0])),
-            pd.Interval(pd.Timestamp(date).replace(hour=latest[0]), pd.Timestamp(date) + pd.Timedelta(days=1)),
-        ) for date in np.unique(df.index.date)]
-
-        wrap_around, begin, middle, end = zip(*intervals)
-        moments = aggregator_factory({
-                earliest[1]: begin,
-                midday[1]: middle,
-                latest[1]: end + wrap_around,
-        })
+        moments = label_moments(df.index, earliest, midday, latest)
 
         aggregated = getattr(df, operation)(axis=1)
-        grouped = aggregated.groupby(moments)
+        grouped = aggregated.groupby(pd.Index(moments, name=aggregated.index.name))
         return getattr(grouped, operation)()
 
     def plot_time_series(self, axis=None, secondary_title=None, legend=True):
@@ -468,3 +613,38 @@ class _Plot:
                 axis.set_ylabel(secondary_title)
 
         return axis
+
+
+def _use_agg_backend():
+    plt.switch_backend('Agg')
+
+
+def _render_figure(spec, use_pickle=False, set_legend=True):
+    """Draw and save a single figure, measuring the time it takes"""
+    start = time.perf_counter()
+    filenames = [spec.filename] if isinstance(spec.filename, (str, os.PathLike)) else spec.filename
+    plot = spec.data if isinstance(spec.data, _Plot) else _Plot(spec.data)
+    figure, axis = plt.subplots()
+    try:
+        getattr(plot, 'plot_' + spec.kind)(axis=axis, **(spec.options or {}))
+        for filename in filenames:
+            save(figure, filename, use_pickle, set_legend)
+    except Exception as error:
+        return RenderedFigure(spec.filename, time.perf_counter() - start, error)
+    finally:
+        plt.close(figure)
+    return RenderedFigure(spec.filename, time.perf_counter() - start, None)
+
+
+def render_figures(specs, processes=None, use_pickle=False, set_legend=True):
+    """Render figures described by `FigureSpec`s in a pool of
+    `processes` (defaults to the amount of CPUs) using the Agg
+    backend; output formats are deduced from the filenames.
+
+    Return a `RenderedFigure` for each spec, in order, holding its
+    filename, the time spent rendering it in seconds and the
+    exception that prevented to render it, if any.
+    """
+    render = partial(_render_figure, use_pickle=use_pickle, set_legend=set_legend)
+    with ProcessPoolExecutor(processes, initializer=_use_agg_backend) as pool:
+        return list(pool.map(render, specs))
@@ -35,8 +35,13 @@ __credits__ = 'Maintainer: Mathias ETTINGER <mettinger@toulouse.viveris.com>'
 
 
 import json
+from operator import itemgetter
+from itertools import repeat
+from contextlib import suppress
 from collections import OrderedDict
 
+import numpy as np
+
 
 class Scenario:
     """Container of data for a whole scenario instance.
@@ -318,26 +323,443 @@ class Job:
         return job_instance
 
 
+class _Column:
+    """Typed storage of the values of a single statistic.
+
+    Values are stored in a NumPy array whose dtype is inferred
+    from the first value and promoted if need be; missing values
+    are tracked using an optional boolean mask.
+    """
+
+    def __init__(self, value, size, capacity):
+        self.values = np.empty(capacity, dtype=_dtype_of(value))
+        self.mask = None
+        # Which values of a float column were stored as integers
+        self.integers = None
+        if size:
+            self.values[:size] = _empty_value(self.values.dtype)
+            self.mask = np.zeros(capacity, dtype=bool)
+            self.mask[:size] = True
+
+    @classmethod
+    def from_array(cls, values, mask=None, integers=None):
+        """Build a column out of an array of values, an optional
+        boolean mask of missing values and, for float values, an
+        optional boolean array of values to convert back to integers.
+        """
+        column = cls(None, 0, 0)
+        values = np.asarray(values)
+        if values.dtype.kind in 'iu':
+            values = values.astype(np.int64)
+        elif values.dtype.kind == 'f':
+            values = values.astype(np.float64)
+        elif values.dtype != bool:
+            values = values.astype(object)
+        column.values = values.copy()
+        if mask is not None and np.any(mask):
+            column.mask = np.array(mask, dtype=bool)
+            column.values[column.mask] = _empty_value(values.dtype)
+        if integers is not None and values.dtype == np.float64 and np.any(integers):
+            column.integers = np.array(integers, dtype=bool)
+            if column.mask is not None:
+                column.integers[column.mask] = False
+        return column
+
+    def resize(self, capacity):
+        self.values = _resized(self.values, capacity)
+        if self.mask is not None:
+            self.mask = _resized(self.mask, capacity)
+        if self.integers is not None:
+            self.integers = _resized(self.integers, capacity)
+
+    def set(self, index, value):
+        dtype = self.values.dtype
+        if dtype != object:
+            value_dtype = _dtype_of(value)
+            promoted = _promote(dtype, value_dtype)
+            if promoted == np.float64 and not self._exact_as_float(index, value, value_dtype):
+                promoted = np.dtype(object)
+            if promoted != dtype:
+                self._convert(promoted, index)
+            if self.integers is not None:
+                self.integers[index] = value_dtype == np.int64
+        self.values[index] = value
+        if self.mask is not None:
+            self.mask[index] = False
+
+    def _exact_as_float(self, size, value, value_dtype):
+        """Whether integers involved in storing `value` in a float
+        column would be represented exactly.
+        """
+        if value_dtype == np.int64 and abs(value) > MAX_EXACT_FLOAT_INTEGER:
+            return False
+        if self.values.dtype == np.int64 and size:
+            values = self.values[:size]
+            return -MAX_EXACT_FLOAT_INTEGER <= values.min() and values.max() <= MAX_EXACT_FLOAT_INTEGER
+        return True
+
+    def _convert(self, dtype, size):
+        if dtype == object:
+            values = np.empty(len(self.values), dtype=object)
+            values[:size] = self.tolist(size)
+            self.values = values
+            self.integers = None
+        else:
+            if self.values.dtype == np.int64:
+                self.integers = np.zeros(len(self.values), dtype=bool)
+                self.integers[:size] = True
+            self.values = self.values.astype(dtype)
+
+    def extend(self, start, values, present=None):
+        """Store a batch of values from the `start` index on; `present`
+        being an optional boolean array telling, for each row of the
+        batch, whether it holds one of the `values` or is missing.
+        """
+        count = len(values) if present is None else len(present)
+        rows = slice(start, start + count) if present is None else start + np.flatnonzero(present)
+        if values:
+            batch, integers = _batch_array(values)
+            dtype = self.values.dtype
+            promoted = _promote(dtype, batch.dtype)
+            if promoted == np.float64 and not self._exact_batch_as_float(start, batch):
+                promoted = np.dtype(object)
+            if promoted != dtype:
+                self._convert(promoted, start)
+            if promoted == object:
+                self.values[rows] = batch if batch.dtype == object else _object_array(values)
+            else:
+                if batch.dtype == np.int64 and promoted == np.float64:
+                    integers = np.ones(len(batch), dtype=bool)
+                self.values[rows] = batch
+                if promoted == np.float64:
+                    if integers is not None and self.integers is None:
+                        self.integers = np.zeros(len(self.values), dtype=bool)
+                    if self.integers is not None:
+                        self.integers[start:start + count] = False
+                        if integers is not None:
+                            self.integers[rows] = integers
+        if self.mask is not None:
+            self.mask[rows] = False
+        if present is not None and not present.all():
+            self.extend_missing(start + np.flatnonzero(~present))
+
+    def _exact_batch_as_float(self, size, batch):
+        """Whether integers involved in storing `batch` in a float
+        column would be represented exactly.
+        """
+        if batch.dtype == np.int64 and len(batch):
+            if batch.min() < -MAX_EXACT_FLOAT_INTEGER or batch.max() > MAX_EXACT_FLOAT_INTEGER:
+                return False
+        return self._exact_as_float(size, 0, batch.dtype)
+
+    def extend_missing(self, rows):
+        """Mark the given rows (indices or slice) as missing"""
+        if self.mask is None:
+            self.mask = np.zeros(len(self.values), dtype=bool)
+        self.values[rows] = _empty_value(self.values.dtype)
+        self.mask[rows] = True
+        if self.integers is not None:
+            self.integers[rows] = False
+
+    def set_missing(self, index):
+        if self.mask is None:
+            self.mask = np.zeros(len(self.values), dtype=bool)
+        self.values[index] = _empty_value(self.values.dtype)
+        self.mask[index] = True
+
+    def view(self, size):
+        values = self.values[:size]
+        if self.mask is None:
+            return values, None
+        return values, self.mask[:size]
+
+    def tolist(self, size):
+        """Python values stored in this column, integers
+        stored in a float column being converted back.
+        """
+        values = self.values[:size].tolist()
+        if self.integers is not None:
+            for index in np.flatnonzero(self.integers[:size]).tolist():
+                values[index] = int(values[index])
+        return values
+
+
 class Statistic:
+    """Collection of data generated by a job instance under a
+    given suffix.
+
+    Data are stored column-wise: timestamps are held in an int64
+    array and each statistic in its own typed array (optionally
+    masked for missing values). Arrays grow by chunks when data
+    are added.
+    """
+
+    CHUNK_SIZE = 1024
+    BUFFER_SIZE = 4096
+
     def __init__(self):
-        self.dated_data = OrderedDict({})
+        self._size = 0
+        self._timestamps = np.empty(0, dtype=np.int64)
+        self._positions = {}
+        self._columns = OrderedDict()
+        # Rows added since the last conversion into columns
+        self._pending = {}
+
+    def __setstate__(self, state):
+        # Instances pickled before rows were buffered
+        state.setdefault('_pending', {})
+        self.__dict__.update(state)
+
+    def __len__(self):
+        self._flush()
+        return self._size
 
     def __eq__(self, other):
         if not isinstance(other, Statistic):
             raise NotImplementedError
 
-        return self.dated_data == other.dated_data
+        return dict(self.rows()) == dict(other.rows())
+
+    def _reserve(self, count):
+        """Make room for `count` more rows in the arrays"""
+        needed = self._size + count
+        if needed > len(self._timestamps):
+            capacity = max(self.CHUNK_SIZE, 2 * len(self._timestamps), needed)
+            self._timestamps = _resized(self._timestamps, capacity)
+            for column in self._columns.values():
+                column.resize(capacity)
 
     def add_statistic(self, timestamp, **kwargs):
-        self.dated_data[timestamp] = kwargs
+        if timestamp in self._pending:
+            # Store the overwritten row first, as if it was never buffered
+            self._flush()
+        self._pending[timestamp] = kwargs
+        if len(self._pending) >= self.BUFFER_SIZE:
+            self._flush()
+
+    def extend(self, rows):
+        """Add many pairs of timestamp and dictionary of statistics at
+        once; same as calling `add_statistic` for each of them.
+        """
+        pending = self._pending
+        for timestamp, statistics in rows:
+            if timestamp in pending or len(pending) >= self.BUFFER_SIZE:
+                self._flush()
+                pending = self._pending
+            pending[timestamp] = statistics
+        self._flush()
+
+    def _flush(self):
+        """Convert the pending rows into columns"""
+        pending = self._pending
+        if not pending:
+            return
+        self._pending = {}
+
+        positions = self._positions
+        if positions and not positions.keys().isdisjoint(pending):
+            appended = {}
+            for timestamp, statistics in pending.items():
+                index = positions.get(timestamp)
+                if index is None:
+                    appended[timestamp] = statistics
+                else:
+                    # Known timestamp, its row is overwritten
+                    self._set_row(index, statistics)
+            pending = appended
+        if pending:
+            self._append_rows(pending)
+
+    def _set_row(self, index, statistics):
+        columns = self._columns
+        for name, value in statistics.items():
+            try:
+                column = columns[name]
+            except KeyError:
+                columns[name] = column = _Column(value, self._size, len(self._timestamps))
+            column.set(index, value)
+        if len(statistics) != len(columns):
+            for name, column in columns.items():
+                if name not in statistics:
+                    column.set_missing(index)
+
+    def _append_rows(self, rows):
+        start = self._size
+        count = len(rows)
+        self._reserve(count)
+
+        timestamps = list(rows)
+        batch, _ = _batch_array(timestamps)
+        if self._timestamps.dtype != object and batch.dtype != np.int64:
+            self._timestamps = self._timestamps.astype(object)
+        if self._timestamps.dtype == object and batch.dtype != object:
+            batch = _object_array(timestamps)
+        self._timestamps[start:start + count] = batch
+        self._positions.update(zip(timestamps, range(start, start + count)))
+        self._size = start + count
+
+        statistics = list(rows.values())
+        names = list(statistics[0])
+        values = None
+        if len(set(map(len, statistics))) == 1:
+            # Most likely the same statistics in each row
+            with suppress(KeyError):
+                if len(names) == 1:
+                    values = [[row[names[0]] for row in statistics]]
+                else:
+                    values = list(zip(*map(itemgetter(*names), statistics))) if names else []
+        if values is not None:
+            batches = [(name, list(column), None) for name, column in zip(names, values)]
+        else:
+            names = list(dict.fromkeys(name for row in statistics for name in row))
+            batches = []
+            for name in names:
+                column = [row.get(name, _MISSING) for row in statistics]
+                present = np.fromiter((value is not _MISSING for value in column), dtype=bool, count=count)
+                batches.append((name, [value for value in column if value is not _MISSING], present))
+
+        columns = self._columns
+        for name, values, present in batches:
+            column = columns.get(name)
+            if column is None:
+                columns[name] = column = _Column(values[0], start, len(self._timestamps))
+            column.extend(start, values, present)
+        if len(names) != len(columns):
+            names = set(names)
+            for name, column in columns.items():
+                if name not in names:
+                    column.extend_missing(slice(start, start + count))
+
+    @property
+    def fields(self):
+        """Names of the statistics stored in this instance"""
+        self._flush()
+        return list(self._columns)
+
+    @property
+    def timestamps(self):
+        """View over the timestamps of the stored data"""
+        self._flush()
+        return self._timestamps[:self._size]
+
+    def numpy(self, name):
+        """View over the values of the given statistic.
+
+        Return a masked array if some values are missing.
+        """
+        self._flush()
+        values, mask = self._columns[name].view(self._size)
+        if mask is None:
+            return values
+        return np.ma.MaskedArray(values, mask, copy=False)
+
+    def integers(self, name):
+        """Boolean array telling which values of the given float
+        statistic were added as integers; None if there are none.
+        """
+        self._flush()
+        integers = self._columns[name].integers
+        if integers is None or not integers[:self._size].any():
+            return None
+        return integers[:self._size]
+
+    @property
+    def dataframe(self):
+        """Build a pandas DataFrame indexed by timestamps and
+        backed, whenever possible, by the stored arrays.
+        """
+        import pandas as pd  # Only needed here, avoid importing it for the whole package
+
+        self._flush()
+        data = OrderedDict()
+        for name, column in self._columns.items():
+            values, mask = column.view(self._size)
+            if mask is None or not mask.any():
+                data[name] = values
+            elif values.dtype == np.int64:
+                data[name] = pd.arrays.IntegerArray(values, mask)
+            elif values.dtype == np.float64:
+                data[name] = pd.arrays.FloatingArray(values, mask)
+            elif values.dtype == bool:
+                data[name] = pd.arrays.BooleanArray(values, mask)
+            else:
+                data[name] = np.where(mask, None, values)
+        index = pd.Index(self.timestamps, name='time', copy=False)
+        return pd.DataFrame(data, index=index, copy=False)
+
+    def rows(self):
+        """Iterate over pairs of timestamp and dictionary of
+        statistics, in insertion order, for each stored data.
+        """
+        self._flush()
+        return zip(self.timestamps.tolist(), self._dictionaries())
+
+    def _dictionaries(self, timestamp_name=None):
+        """Generate a dictionary of statistics for each stored data,
+        including its timestamp under `timestamp_name` if provided.
+        """
+        self._flush()
+        size = self._size
+        names = list(self._columns)
+        values = [column.tolist(size) for column in self._columns.values()]
+        masks = [None if column.mask is None else column.mask[:size] for column in self._columns.values()]
+        if timestamp_name is not None:
+            names.insert(0, timestamp_name)
+            values.insert(0, self.timestamps.tolist())
+            masks.insert(0, None)
+
+        if not names:
+            for _ in range(size):
+                yield {}
+        elif all(mask is None or not mask.any() for mask in masks):
+            yield from map(dict, map(zip, repeat(names), zip(*values)))
+        else:
+            missing = zip(*(repeat(False, size) if mask is None else mask.tolist() for mask in masks))
+            for row, absent in zip(zip(*values), missing):
+                yield {
+                        name: value
+                        for name, value, skip in zip(names, row, absent)
+                        if not skip
+                }
+
+    @property
+    def dated_data(self):
+        """Dictionary of statistics (as dictionaries) keyed by timestamp.
+
+        Built anew on each access: prefer iterating over `rows()`.
+        """
+        return OrderedDict(self.rows())
 
     @property
     def json(self):
         """Build a JSON representation of this Statistic instance"""
-        return [
-            {'time': timestamp, **stats}
-            for timestamp, stats in self.dated_data.items()
-        ]
+        return list(self._dictionaries('time'))
+
+    @classmethod
+    def from_columns(cls, timestamps, columns):
+        """Generate a Statistic instance from an array of (unique)
+        timestamps and a mapping of statistic names and their
+        values, either as arrays or as pairs of array and boolean
+        mask of missing values; a third boolean array can tell
+        which values of a float array were integers.
+        """
+        statistic_instance = cls()
+        timestamps = np.asarray(timestamps)
+        if timestamps.dtype.kind in 'iu':
+            timestamps = timestamps.astype(np.int64)
+        else:
+            timestamps = timestamps.astype(object)
+        statistic_instance._timestamps = timestamps
+        statistic_instance._size = size = len(timestamps)
+        statistic_instance._positions = dict(zip(timestamps.tolist(), range(size)))
+        if len(statistic_instance._positions) != size:
+            raise ValueError('timestamps of a Statistic should be unique')
+        for name, values in columns.items():
+            values = values if isinstance(values, tuple) else (values,)
+            statistic_instance._columns[name] = column = _Column.from_array(*values)
+            if len(column.values) != size:
+                raise ValueError('statistic {} does not have as many values as timestamps'.format(name))
+        return statistic_instance
 
     @classmethod
     def load(cls, statistics_data):
@@ -465,6 +887,84 @@ def _get_or_create(container, constructor, *key, args=None):
         return instance
 
 
+MAX_EXACT_FLOAT_INTEGER = 2**53
+
+
+_MISSING = object()
+
+
+def _object_array(values):
+    """Build an array of Python objects, even out of sequences"""
+    array = np.empty(len(values), dtype=object)
+    for index, value in enumerate(values):
+        array[index] = value
+    return array
+
+
+def _batch_array(values):
+    """Store a non-empty list of values in an array of the dtype
+    `_Column` would use for them. Return the array and, for float
+    arrays, which values were integers (or None).
+    """
+    types = set(map(type, values))
+    if types == {float}:
+        return np.array(values, dtype=np.float64), None
+    if types == {bool}:
+        return np.array(values, dtype=bool), None
+    if types == {int}:
+        try:
+            return np.array(values, dtype=np.int64), None
+        except OverflowError:
+            return _object_array(values), None
+    if types == {int, float}:
+        array = np.array(values, dtype=np.float64)
+        integers = np.fromiter((type(value) is int for value in values), dtype=bool, count=len(values))
+        if not np.any(np.abs(array[integers]) > MAX_EXACT_FLOAT_INTEGER):
+            return array, integers
+        return _object_array(values), None
+
+    # Other types (strings, NumPy scalars…) follow the rules of single values
+    column = _Column(values[0], 0, len(values))
+    for index, value in enumerate(values):
+        column.set(index, value)
+    return column.values, column.integers
+
+
+def _dtype_of(value):
+    """Choose the NumPy dtype suitable to store the given value"""
+    if isinstance(value, (bool, np.bool_)):
+        return np.dtype(bool)
+    if isinstance(value, (int, np.integer)):
+        if -2**63 <= value < 2**63:
+            return np.dtype(np.int64)
+    elif isinstance(value, (float, np.floating)):
+        return np.dtype(np.float64)
+    return np.dtype(object)
+
+
+def _promote(dtype, other):
+    """Choose a dtype able to store values of both dtypes"""
+    if dtype == other:
+        return dtype
+    if {dtype, other} == {np.dtype(np.int64), np.dtype(np.float64)}:
+        return np.dtype(np.float64)
+    return np.dtype(object)
+
+
+def _empty_value(dtype):
+    """Placeholder for missing values in an array of the given dtype"""
+    if dtype == object:
+        return None
+    return np.zeros(1, dtype=dtype)[0]
+
+
+def _resized(array, capacity):
+    """Copy an array into a bigger one of the given capacity"""
+    resized = np.empty(capacity, dtype=array.dtype)
+    resized[:len(array)] = array
+    return resized
+
+
 def read_scenario(filename):
     """Generate a `Scenario` instance from a file.
 
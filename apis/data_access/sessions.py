@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016-2023 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+
+"""Helpers to build the HTTP sessions used to communicate with
+the databases of a collector.
+
+Sessions keep their connections alive and pool them so that
+successive requests to the same server reuse them instead of
+opening a new TCP connection each time.
+"""
+
+__author__ = 'Mathias ETTINGER <mettinger@toulouse.viveris.com>'
+__all__ = ['build_session', 'connection_statistics', 'compress_body']
+
+
+import gzip
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import (
+        MaxRetryError, ResponseError, ConnectTimeoutError,
+        NewConnectionError, ProtocolError)
+from urllib3.util.retry import Retry
+
+
+POOL_SIZE = 10
+RETRIES = 3
+BACKOFF_FACTOR = 0.5
+RETRY_STATUSES = (429, 502, 503, 504)
+COMPRESSION_LEVEL = 6
+# Failures to open a connection, or to reuse a pooled one
+CONNECTION_ERRORS = (ConnectTimeoutError, NewConnectionError, ProtocolError)
+
+
+class _DatabaseRetry(Retry):
+    """Retry policy that never resends a request moving a server-side
+    cursor once it may have reached the server: ElasticSearch would
+    have advanced the scroll and a page would be silently skipped.
+    Such requests are only retried on connection errors.
+    """
+
+    CURSOR_ROUTES = ('/_search/scroll',)
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        if url is not None and urlsplit(url).path.endswith(self.CURSOR_ROUTES):
+            if not isinstance(error, CONNECTION_ERRORS):
+                raise MaxRetryError(_pool, url, error or ResponseError('cursor requests are not resent'))
+        return super().increment(method, url, response, error, _pool, _stacktrace)
+
+
+def build_session(pool_size=POOL_SIZE, retries=RETRIES, backoff_factor=BACKOFF_FACTOR):
+    """Create a `requests.Session` whose connections are kept alive
+    and pooled (up to `pool_size` per host) and whose requests are
+    retried with an exponential backoff on connection errors and
+    on temporary server errors.
+    """
+    retry = _DatabaseRetry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            # Queries and writes sent to the databases can be replayed
+            # safely; scroll requests are excluded by _DatabaseRetry
+            allowed_methods=None,
+            raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def connection_statistics(session):
+    """Count the amount of connections opened and requests sent
+    through the pools of the given session.
+
+    The difference between both counters is the amount of
+    requests that reused an existing connection.
+    """
+    connections = sent = 0
+    adapters = {id(adapter): adapter for adapter in session.adapters.values()}
+    for adapter in adapters.values():
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            connections += pool.num_connections
+            sent += pool.num_requests
+    return {'connections': connections, 'requests': sent, 'reused': sent - connections}
+
+
+def compress_body(body, headers=None):
+    """Gzip the given request body and return it along with
+    the headers needed to send it.
+    """
+    if isinstance(body, str):
+        body = body.encode()
+    headers = {} if headers is None else dict(headers)
+    headers['Content-Encoding'] = 'gzip'
+    return gzip.compress(body, COMPRESSION_LEVEL), headers
@@ -0,0 +1,685 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them.
+# It is composed of an Auditorium (HMIs), a Controller, a Collector
+# and multiple Agents (one for each network entity that wants to be
+# tested).
+#
+#
+# Copyright © 2016-2023 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY, without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see http://www.gnu.org/licenses/.
+
+"""Benchmarks of the data access hot paths.
+
+Run them from the `apis` folder using:
+
+    python3 -m data_access.tests.benchmarks [NAME ...]
+
+All benchmarks are run if no name is provided. Each of them also
+checks that the optimized code path produces the same results than
+the reference implementation it is compared against.
+"""
+
+__author__ = 'Mathias ETTINGER <mathias.ettinger@toulouse.viveris.com>'
+__version__ = 'v0.1'
+
+
+import os
+import sys
+import math
+import gzip
+import json
+import time
+import locale
+import datetime
+import tempfile
+import warnings
+import argparse
+import itertools
+import threading
+import http.server
+import urllib.parse
+from functools import partial
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from data_access.result_data import Job, Scenario
+from data_access.archive import pa, write_archive, read_archive, ScenarioArchive
+from data_access.influxdb_tools import (
+        LINE_PROTOCOL_CHUNCK_SIZE, InfluxDBConnection, LineProtocolEncoder,
+        line_protocol, escape_names, escape_field)
+from data_access.post_processing import (
+        Statistics, influx_to_pandas, aggregator_factory, _Plot,
+        compute_histogram, compute_annotated_histogram,
+        FigureSpec, render_figures, _render_figure, _use_agg_backend)
+from data_access.elasticsearch_tools import (
+        ElasticSearchConnection, parse_timestamp_with_index,
+        extract_timestamp_with_index, parse_logs, tags_to_query,
+        LOG_SOURCE_FIELDS)
+
+
+BENCHMARKS = {}
+
+
+def benchmark(function):
+    BENCHMARKS[function.__name__[len('benchmark_'):]] = function
+    return function
+
+
+def timed(function, *args, repeat=3, **kwargs):
+    """Call the function several times and return its
+    last result along with the best elapsed time.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def report(name, elapsed, reference=None):
+    if reference is None:
+        print('  {:<40} {:>10.3f} ms'.format(name, elapsed * 1000))
+    else:
+        print('  {:<40} {:>10.3f} ms  (x{:.1f})'.format(name, elapsed * 1000, reference / elapsed))
+
+
+############################
+# Synthetic data generators #
+############################
+
+def synthetic_influx_response(flows=1000, points=50, job='iperf3'):
+    """Build an InfluxDB JSON response holding `points` lines
+    for each of the `flows` job instances/suffixes.
+    """
+    columns = [
+            'time', '@agent_name', '@job_instance_id',
+            '@owner_scenario_instance_id', '@scenario_instance_id',
+            '@suffix', 'throughput', 'sent_data', 'jitter',
+    ]
+    values = [
+            [
+                1600000000000 + 1000 * point + flow,
+                'agent{}'.format(flow % 4),
+                str(flow // 10),
+                '42', '42',
+                'Flow{}'.format(flow % 10) if flow % 10 else None,
+                point * 1.5 + flow,
+                point * 1024,
+                None if flow % 3 else point / 10,
+            ]
+            for point in range(points)
+            for flow in range(flows)
+    ]
+    return {'results': [{'series': [{'name': job, 'columns': columns, 'values': values}]}]}
+
+
+def synthetic_job(points=100000, fields=1, name='fping'):
+    """Build a `Job` holding `points` lines of `fields` statistics"""
+    job = Job(name, 1, 'agent')
+    statistics = job.get_or_create_statistics(None)
+    for point in range(points):
+        statistics.add_statistic(
+                1600000000000 + point,
+                **{'statistic_{}'.format(field): point * 1.5 + field for field in range(fields)})
+    return job
+
+
+class InfluxDBStandIn(http.server.BaseHTTPRequestHandler):
+    """Minimal InfluxDB write endpoint that only counts
+    the requests and lines it receives.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    requests = 0
+    lines = 0
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        InfluxDBStandIn.requests += 1
+        InfluxDBStandIn.lines += body.count(b'\n') + 1
+        self.send_response(204)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def synthetic_search_response(records=20000):
+    """Build the JSON response of an ElasticSearch search holding
+    `records` logs, along with the extra fields logstash stores.
+    """
+    hits = []
+    for record, source in enumerate(synthetic_log_sources(records)):
+        source.update({
+            'agent_name': 'agent', 'program': 'iperf3', 'job_instance_id': 2,
+            'scenario_instance_id': 1, 'owner_scenario_instance_id': 1,
+            '@version': '1', 'facility': 1, 'facility_label': 'user-level',
+            'host': '192.168.1.{}'.format(record % 250), 'logsource': 'agent',
+            'message': 'Flow {} reached its target bitrate'.format(record),
+            'pid': 4242, 'priority': 14, 'severity': 6, 'severity_label': 'Informational',
+            'type': 'syslog', 'tags': ['_grokparsefailure', 'collect-agent'],
+            'received_at': source['@timestamp'], 'received_from': '192.168.1.1',
+            'syslog_hostname': 'agent', 'path': '/var/log/syslog',
+        })
+        hits.append({
+            '_index': 'logstash-2023.11.14', '_type': 'logs', '_id': str(record),
+            '_score': 1.0, '_source': source,
+        })
+    return {
+        '_scroll_id': None, 'took': 42, 'timed_out': False,
+        '_shards': {'total': 5, 'successful': 5, 'skipped': 0, 'failed': 0},
+        'hits': {'total': records, 'max_score': 1.0, 'hits': hits},
+    }
+
+
+class ElasticSearchStandIn(http.server.BaseHTTPRequestHandler):
+    """Minimal ElasticSearch search endpoint that replies with a canned
+    response, honoring `_source` includes, `filter_path` and gzip
+    compression; and counts the amount of bytes it sends back.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    response = {}
+    bodies = {}
+    sent = 0
+
+    @classmethod
+    def _encode(cls, includes, filter_path, compress):
+        response = cls.response
+        hits = response['hits']['hits']
+        if includes is not None:
+            hits = [dict(hit, _source={k: v for k, v in hit['_source'].items() if k in includes}) for hit in hits]
+        if filter_path is not None:
+            kept = filter_path.split(',')
+            hits = [{k: v for k, v in hit.items() if 'hits.hits.' + k in kept} for hit in hits]
+            response = {'hits': {'hits': hits}}
+        else:
+            response = dict(response, hits=dict(response['hits'], hits=hits))
+        body = json.dumps(response).encode()
+        return gzip.compress(body, 1) if compress else body
+
+    def do_POST(self):
+        query = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        parameters = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+        includes = query.get('_source', {}).get('includes')
+        filter_path = parameters.get('filter_path', [None])[0]
+        compress = 'gzip' in self.headers.get('Accept-Encoding', '')
+        key = (includes and tuple(includes), filter_path, compress)
+        # Encode each variant once so only the client side is measured
+        if key not in self.bodies:
+            self.bodies[key] = self._encode(includes, filter_path, compress)
+        body = self.bodies[key]
+
+        self.send_response(200)
+        if compress:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        ElasticSearchStandIn.sent += len(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def stand_in_server(handler):
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server.server_port
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+#############################
+# Reference implementations #
+#############################
+
+def _legacy_parse_dataframes(response, query, offset=None):
+    """Former implementation of `Statistics._parse_dataframes`"""
+    names = ['job', 'scenario', 'agent', 'suffix', 'statistic']
+    for df in influx_to_pandas(response, query):
+        converters = dict.fromkeys(df.columns, partial(pd.to_numeric, errors='coerce'))
+        converters.pop('@owner_scenario_instance_id')
+        converters.pop('@suffix', None)
+        converters['@agent_name'] = lambda x: x
+        converted = [convert(df[column]) for column, convert in converters.items()]
+
+        if '@suffix' in df:
+            converted.append(df['@suffix'].fillna(''))
+        else:
+            converted.append(pd.Series('', index=df.index, name='@suffix'))
+        df = pd.concat(converted, axis=1)
+
+        df.set_index(['@job_instance_id', '@scenario_instance_id', '@agent_name', '@suffix'], inplace=True)
+        for index in df.index.unique():
+            extract = df.xs(index)
+            if isinstance(extract, pd.Series):
+                extract = pd.DataFrame(extract.to_dict(), index=[0])
+            section = extract.reset_index(drop=True).dropna(axis=1, how='all')
+            section['time'] -= section.time[0] if offset is None else offset
+            section.set_index('time', inplace=True)
+            section.index.name = 'Time (ms)'
+            section.columns = pd.MultiIndex.from_tuples([index + (name,) for name in section.columns], names=names)
+            yield section
+
+
+def _legacy_compute_function(
+        plot, operation, scale_factor, start_day, start_evening, start_night,
+        label_day='Journée', label_evening='Soirée', label_night='Nuit'):
+    """Former implementation of `_Plot.compute_function`"""
+    df = plot.dataframe / scale_factor
+    df.index = pd.to_datetime(df.index, unit='ms')
+
+    earliest, midday, latest = sorted([
+            (start_day, f'{label_day} ({start_day}h − {start_evening}h)'),
+            (start_evening, f'{label_evening} ({start_evening}h − {start_night}h)'),
+            (start_night, f'{label_night} ({start_night}h − {start_day}h)'),
+    ])
+    intervals = [(
+        pd.Interval(pd.Timestamp(date), pd.Timestamp(date).replace(hour=earliest[0])),
+        pd.Interval(pd.Timestamp(date).replace(hour=earliest[0]), pd.Timestamp(date).replace(hour=midday[0])),
+        pd.Interval(pd.Timestamp(date).replace(hour=midday[0]), pd.Timestamp(date).replace(hour=latest[0])),
+        pd.Interval(pd.Timestamp(date).replace(hour=latest[0]), pd.Timestamp(date) + pd.Timedelta(days=1)),
+    ) for date in np.unique(df.index.date)]
+
+    wrap_around, begin, middle, end = zip(*intervals)
+    moments = aggregator_factory({
+            earliest[1]: begin,
+            midday[1]: middle,
+            latest[1]: end + wrap_around,
+    })
+
+    aggregated = getattr(df, operation)(axis=1)
+    grouped = aggregated.groupby(moments)
+    return getattr(grouped, operation)()
+
+
+def _legacy_temporal_binning_histogram(
+        plot, statistic_name=None, index=None, bin_size=100,
+        offset=0, maximum=None, time_aggregation='hour',
+        add_total=True, scale_factor=None):
+    """Former implementation of `_Plot.temporal_binning_histogram`"""
+    df = plot._find_statistic(statistic_name, index)
+    if scale_factor:
+        df /= scale_factor
+
+    df.index = pd.to_datetime(df.index, unit='ms')
+
+    if maximum is None:
+        nb_segments = math.ceil((df.max().max() - offset) / bin_size)
+        maximum = nb_segments * bin_size + offset
+    nb_segments = math.ceil((maximum - offset) / bin_size)
+
+    bins = np.linspace(offset, maximum, nb_segments + 1, dtype='int')
+
+    for _, column in df.items():
+        cframe = column.to_frame()
+        groups = cframe.groupby(getattr(cframe.index, time_aggregation))
+        stats = groups.apply(compute_annotated_histogram(bins)) * 100
+        stats.index = ['{}-{}'.format(i, i+1) for i in stats.index.droplevel()]
+        stats.index.name = 'Time ({}s)'.format(time_aggregation)
+        if add_total:
+            total = cframe.apply(compute_histogram(bins)) * 100
+            total.index = bins[1:]
+            total.columns = ['total']
+            yield pd.concat([stats, total.T])
+        else:
+            yield stats
+
+
+def _legacy_line_protocol(job_name, scenario_id, owner_id, agent_name, job_id, suffix, statistics):
+    """Former implementation of `influxdb_tools.line_protocol`"""
+    tags = {
+        '@scenario_instance_id': scenario_id,
+        '@owner_scenario_instance_id': owner_id,
+        '@job_instance_id': job_id,
+        '@agent_name': agent_name,
+        '@suffix': suffix,
+    }
+
+    measurement = [escape_names(job_name, True)]
+    measurement.extend(
+            '{}={}'.format(tag, escape_names(value) if isinstance(value, str) else value)
+            for tag, value in tags.items() if value or value == 0)
+    header = ','.join(measurement)
+
+    def build_lines_of_data(statistics_chunck):
+        for timestamp, data in statistics_chunck:
+            fields = ','.join(
+                    escape_field(name, value)
+                    for name, value in data.items()
+                    if value or value == 0)
+            yield '{} {} {}'.format(header, fields, timestamp)
+
+    stats_iterator = iter(statistics.items())
+    while True:
+        chunck = itertools.islice(stats_iterator, LINE_PROTOCOL_CHUNCK_SIZE)
+        lines = '\n'.join(build_lines_of_data(chunck))
+        if not lines:
+            break
+        yield lines
+
+
+def synthetic_monitoring_plot(days=7, frequency=1, columns=2):
+    """Build a _Plot of `days` of data sampled at `frequency` Hz,
+    starting at midnight"""
+    start = int(pd.Timestamp('2023-11-13').timestamp() * 1000)
+    index = np.arange(start, start + days * 86400000, 1000 // frequency)
+    values = np.random.default_rng(42).random((len(index), columns)) * 100
+    labels = pd.MultiIndex.from_tuples(
+            [(1, 1, 'agent', '', 'rate_{}'.format(column)) for column in range(columns)],
+            names=['job', 'scenario', 'agent', 'suffix', 'statistic'])
+    return _Plot(pd.DataFrame(values, index=pd.Index(index, name='Time (ms)'), columns=labels))
+
+
+def synthetic_log_sources(records=100000, start=1700000000000):
+    """Build `_source` dictionaries of logs, one per second,
+    holding both their syslog and ISO dates.
+    """
+    sources = []
+    for record in range(records):
+        date = datetime.datetime.fromtimestamp((start + record * 1000) / 1000)
+        sources.append({
+            'timestamp': date.strftime('%b %d %H:%M:%S'),
+            '@timestamp': date.astimezone(datetime.timezone.utc).isoformat(timespec='milliseconds'),
+        })
+    return sources
+
+
+class _LegacyLocaleManager():
+    def __init__(self, loc):
+        self.lc_all = locale.setlocale(locale.LC_ALL)
+        self.locale = loc
+
+    def __enter__(self):
+        locale.setlocale(locale.LC_ALL, self.locale)
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        locale.setlocale(locale.LC_ALL, self.lc_all)
+
+
+def _legacy_parse_timestamp_with_index(date, index, number_of_year_digits=4, locale_name='en_US.utf8'):
+    """Former implementation of `elasticsearch_tools.parse_timestamp_with_index`"""
+    with _LegacyLocaleManager(locale_name):
+        year = int(index.split('.')[0][-number_of_year_digits:])
+        timestamp = datetime.datetime.strptime(date, '%b %d %H:%M:%S')
+        return int(timestamp.replace(year).timestamp() * 1000)
+
+
+##############
+# Benchmarks #
+##############
+
+@benchmark
+def benchmark_parse_dataframes(flows=1000, points=50):
+    """Build per-flow DataFrames out of an InfluxDB response"""
+    response = synthetic_influx_response(flows, points)
+    statistics = Statistics('localhost')
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', pd.errors.PerformanceWarning)
+        legacy, legacy_time = timed(lambda: list(_legacy_parse_dataframes(response, 'benchmark')), repeat=1)
+    current, current_time = timed(lambda: list(statistics._parse_dataframes(response, 'benchmark')))
+    for expected, result in itertools.zip_longest(legacy, current):
+        pd.testing.assert_frame_equal(result, expected)
+
+    print('{} flows of {} points:'.format(flows, points))
+    report('legacy xs() per flow', legacy_time)
+    report('single pass groupby', current_time, legacy_time)
+
+
+@benchmark
+def benchmark_line_protocol_chunking(points=50000):
+    """Write narrow and wide statistics to an InfluxDB stand-in"""
+    policies = [
+            ('{} lines (legacy)'.format(LINE_PROTOCOL_CHUNCK_SIZE), {'max_bytes': None, 'max_lines': LINE_PROTOCOL_CHUNCK_SIZE}),
+            ('256 KiB', {'max_bytes': 256 * 1024}),
+            ('1 MiB (default)', {}),
+            ('4 MiB', {'max_bytes': 4 * 1024 * 1024}),
+    ]
+    jobs = [('fping', 1), ('tc_qdisc_stats', 40)]
+
+    with stand_in_server(InfluxDBStandIn) as port:
+        for name, fields in jobs:
+            job = synthetic_job(points, fields, name)
+            print('{} points of {} fields:'.format(points, fields))
+            for compress in (False, True):
+                influxdb = InfluxDBConnection('127.0.0.1', port, compress=compress)
+                for policy, options in policies:
+                    InfluxDBStandIn.requests = InfluxDBStandIn.lines = 0
+                    _, elapsed = timed(influxdb.import_job, 1, 1, job, repeat=1, **options)
+                    assert InfluxDBStandIn.lines == points
+                    print('  {:<28} {:>5} requests {:>10.0f} lines/s'.format(
+                        policy + (' gzip' if compress else ''),
+                        InfluxDBStandIn.requests, points / elapsed))
+
+
+@benchmark
+def benchmark_line_protocol_encoding(points=20000, fields=20):
+    """Serialize statistics into line protocol"""
+    statistics = {
+            1600000000000 + point: {
+                'stat_{}'.format(field) if field % 5 else 'stat {}'.format(field):
+                point * 1.5 if field % 3 else ('text "{}"'.format(point) if field % 2 else point)
+                for field in range(fields)
+            }
+            for point in range(points)
+    }
+    arguments = ('job name', 1, 1, 'agent', 2, 'Flow1', statistics)
+
+    legacy, legacy_time = timed(lambda: list(_legacy_line_protocol(*arguments)))
+    current, current_time = timed(lambda: list(line_protocol(*arguments, max_bytes=None, max_lines=LINE_PROTOCOL_CHUNCK_SIZE)))
+    typed, typed_time = timed(lambda: list(line_protocol(
+        *arguments, max_bytes=None, max_lines=LINE_PROTOCOL_CHUNCK_SIZE,
+        encoder=LineProtocolEncoder(integer_suffix=True))))
+    assert legacy == current, 'line protocol output differs'
+
+    print('{} points of {} fields:'.format(points, fields))
+    report('legacy escape_field per value', legacy_time)
+    report('cached names encoder', current_time, legacy_time)
+    report('cached names encoder (integers)', typed_time, legacy_time)
+
+
+@benchmark
+def benchmark_timestamp_parsing(records=100000):
+    """Convert the dates of ElasticSearch logs into timestamps"""
+    sources = synthetic_log_sources(records)
+    index = 'logstash-2023.11.14'
+    try:
+        locale_name = 'en_US.utf8'
+        _legacy_parse_timestamp_with_index(sources[0]['timestamp'], index, locale_name=locale_name)
+    except locale.Error:
+        # The C locale also uses english month names
+        locale_name = 'C'
+
+    legacy, legacy_time = timed(lambda: [
+        _legacy_parse_timestamp_with_index(source['timestamp'], index, locale_name=locale_name)
+        for source in sources], repeat=1)
+    current, current_time = timed(lambda: [
+        parse_timestamp_with_index(source['timestamp'], index)
+        for source in sources])
+    iso, iso_time = timed(lambda: [
+        extract_timestamp_with_index(source, index)
+        for source in sources])
+    assert legacy == current, 'syslog dates parsing differs'
+    assert legacy == iso, 'ISO dates parsing differs'
+
+    print('{} records ({:.2f} µs per record before, {:.2f} µs after):'.format(
+        records, legacy_time / records * 1e6, current_time / records * 1e6))
+    report('legacy locale switch + strptime', legacy_time)
+    report('syslog month table', current_time, legacy_time)
+    report('ISO @timestamp', iso_time, legacy_time)
+
+
+@benchmark
+def benchmark_logs_retrieval(records=20000):
+    """Retrieve and parse logs from an ElasticSearch stand-in"""
+    ElasticSearchStandIn.response = synthetic_search_response(records)
+    ElasticSearchStandIn.bodies = {}
+
+    def retrieve(elasticsearch, query, **options):
+        ElasticSearchStandIn.sent = 0
+        scenarios = list(parse_logs(elasticsearch.search_query(query, **options)))
+        return scenarios, ElasticSearchStandIn.sent
+
+    with stand_in_server(ElasticSearchStandIn) as port:
+        elasticsearch = ElasticSearchConnection('127.0.0.1', port)
+        legacy_query = tags_to_query(1, None, None, None, None)
+        query = tags_to_query(1, None, None, None, None, LOG_SOURCE_FIELDS)
+        options = [
+            ('full documents (legacy)', legacy_query, {'filter_path': None}, 'identity'),
+            ('selected fields', query, {}, 'identity'),
+            ('selected fields, gzip', query, {}, 'gzip'),
+        ]
+        print('{} logs:'.format(records))
+        reference = None
+        for name, body, parameters, encoding in options:
+            elasticsearch.session.headers['Accept-Encoding'] = encoding
+            (scenarios, sent), elapsed = timed(retrieve, elasticsearch, body, **parameters)
+            job, = scenarios[0].jobs
+            assert len(job.logs_data.numbered_data) == records
+            report('{} ({:.1f} MiB)'.format(name, sent / 1024 / 1024), elapsed, reference)
+            reference = reference or elapsed
+
+
+@benchmark
+def benchmark_time_of_day_aggregation(days=7, frequency=1):
+    """Aggregate monitoring data by moments of the day"""
+    plot = synthetic_monitoring_plot(days, frequency)
+    arguments = ('mean', 1000, 7, 19, 23)
+    legacy, legacy_time = timed(_legacy_compute_function, plot, *arguments, repeat=1)
+    current, current_time = timed(plot.compute_function, *arguments)
+    pd.testing.assert_series_equal(legacy, current)
+
+    print('{} days at {} Hz ({} rows):'.format(days, frequency, len(plot.dataframe)))
+    report('legacy pd.Interval lookups', legacy_time)
+    report('vectorised labelling', current_time, legacy_time)
+
+
+@benchmark
+def benchmark_temporal_binning_histogram(days=7, frequency=1, columns=20):
+    """Build per-hour histograms of monitoring data"""
+    plot = synthetic_monitoring_plot(days, frequency, columns)
+    legacy, legacy_time = timed(lambda: list(_legacy_temporal_binning_histogram(
+        _Plot(plot.dataframe.copy()), bin_size=5)), repeat=1)
+    current, current_time = timed(lambda: list(plot.temporal_binning_histogram(bin_size=5)))
+    for expected, result in zip(legacy, current):
+        pd.testing.assert_frame_equal(expected, result)
+
+    print('{} columns of {} days at {} Hz ({} rows):'.format(columns, days, frequency, len(plot.dataframe)))
+    report('legacy groupby + apply', legacy_time)
+    report('2D bincount', current_time, legacy_time)
+
+
+@benchmark
+def benchmark_figure_rendering(figures=16, days=1, frequency=1):
+    """Render a batch of figures into PNG and SVG files"""
+    plot = synthetic_monitoring_plot(days, frequency)
+    kinds = ['time_series', 'histogram', 'cumulative_histogram', 'comparison']
+    with tempfile.TemporaryDirectory() as directory:
+        specs = [
+            FigureSpec(plot, kinds[i % len(kinds)], os.path.join(directory, 'figure_{}.{}'.format(i, 'svg' if i % 2 else 'png')))
+            for i in range(figures)
+        ]
+        _use_agg_backend()
+        serial, serial_time = timed(lambda: [_render_figure(spec) for spec in specs], repeat=1)
+        parallel, parallel_time = timed(render_figures, specs, repeat=1)
+    assert not any(figure.error for figure in serial + parallel), 'rendering failed'
+
+    print('{} figures of {} rows on {} CPUs (slowest figure: {:.0f} ms):'.format(
+        figures, len(plot.dataframe), os.cpu_count(), max(figure.elapsed for figure in parallel) * 1000))
+    report('serial rendering', serial_time)
+    report('process pool', parallel_time, serial_time)
+
+
+@benchmark
+def benchmark_archive_formats(jobs=4, points=100000, fields=4):
+    """Store and load scenario results as JSON or Parquet"""
+    if pa is None:
+        print('pyarrow is not installed, skipping')
+        return
+
+    scenario = Scenario(1)
+    for instance in range(jobs):
+        job = synthetic_job(points, fields)
+        job.instance_id = instance
+        scenario.job_instances[(job.name, job.instance_id, job.agent)] = job
+
+    def directory_size(path):
+        return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+    def dump_json(path):
+        with open(path, 'w') as f:
+            json.dump(scenario.json, f)
+
+    def load_json(path):
+        with open(path) as f:
+            return Scenario.load(json.load(f))
+
+    with tempfile.TemporaryDirectory() as directory:
+        json_path = os.path.join(directory, 'scenario.json')
+        _, json_dump_time = timed(dump_json, json_path, repeat=1)
+        loaded, json_load_time = timed(load_json, json_path, repeat=1)
+        archive_paths = iter(os.path.join(directory, 'archive_{}'.format(i)) for i in itertools.count())
+        _, archive_dump_time = timed(lambda: write_archive(scenario, next(archive_paths)))
+        archive_path = os.path.join(directory, 'archive_0')
+        archived, archive_load_time = timed(read_archive, archive_path)
+        _, dataframe_time = timed(lambda: ScenarioArchive(archive_path).dataframe(job_instance_id=0, columns=['statistic_0']))
+        assert all(job == expected for job, expected in zip(archived.jobs, loaded.jobs)), 'archive content differs'
+
+        print('{} jobs of {} points with {} statistics (JSON: {:.1f} MiB, Parquet: {:.1f} MiB):'.format(
+            jobs, points, fields,
+            os.path.getsize(json_path) / 1024 / 1024,
+            directory_size(archive_path) / 1024 / 1024))
+        report('JSON dump', json_dump_time)
+        report('Parquet write', archive_dump_time, json_dump_time)
+        report('JSON load', json_load_time)
+        report('Parquet load', archive_load_time, json_load_time)
+        report('Parquet single statistic DataFrame', dataframe_time, json_load_time)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+            'benchmarks', metavar='NAME', nargs='*', choices=[[]] + list(BENCHMARKS),
+            help='name of the benchmarks to run, among: {}'.format(', '.join(BENCHMARKS)))
+    args = parser.parse_args(argv)
+
+    for name in args.benchmarks or BENCHMARKS:
+        print('[{}] {}'.format(name, BENCHMARKS[name].__doc__))
+        BENCHMARKS[name]()
+        print()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -31,13 +31,47 @@ __author__ = 'Mathias ETTINGER <mathias.ettinger@toulouse.viveris.com>'
 __version__ = 'v0.3'
 
 
+import re
+import copy
+import math
+import gzip
+import time
+import os
+import json
+import tempfile
+import asyncio
+import datetime
 import unittest
+import unittest.mock
+import threading
+import http.server
+
+import pandas as pd
+from urllib3.exceptions import (
+        MaxRetryError, ConnectTimeoutError, NewConnectionError,
+        ProtocolError, ReadTimeoutError)
 
 from data_access.influxdb_tools import (Operator,
         ConditionAnd, ConditionOr, ConditionField, ConditionTag, ConditionTimestamp,
         escape_names, escape_field, tags_to_condition,
-        select_query, measurement_query, delete_query, tag_query,
+        select_query, measurement_query, delete_query, tag_query, downsampled_query,
         parse_influx, parse_statistics, parse_orphans, line_protocol)
+from data_access.result_data import Statistic, Scenario
+from data_access.importer import ImportPipeline, ImportFailure
+from data_access.post_processing import Statistics, FigureSpec, render_figures, _Plot
+from data_access.influxdb_tools import (
+        InfluxDBCommunicator, InfluxDBConnection, LineProtocolEncoder,
+        coalesce_timestamps, pack_queries)
+from data_access.elasticsearch_tools import (
+        ElasticSearchConnection, parse_timestamp_with_index, extract_timestamp_with_index,
+        rest_protocol, parse_bulk_response, tags_to_query, LOG_SOURCE_FIELDS)
+from data_access.sessions import build_session, compress_body, _DatabaseRetry
+from data_access.async_tools import aiohttp, AsyncInfluxDBConnection, AsyncElasticSearchConnection
+from data_access.collector import CollectorConnection, PartialResultsWarning
+from data_access.cache import ScenarioCache, IncompleteScenario
+from data_access.archive import pa, ScenarioArchive, write_archive, read_archive
+from data_access.histograms import StreamingHistogram, QuantileSketch
+from data_access.async_collector import AsyncCollectorConnection
 
 
 class TestDataAccessInfluxDB(unittest.TestCase):
@@ -248,7 +282,1282 @@ class TestDataAccessInfluxDB(unittest.TestCase):
         ]
         self.assertEqual(statistics.json, expected)
 
-    # TODO test_orphans_parse, test_line_protocol / test_f
+    def test_chunked_parse(self):
+        columns = ['time', '@agent_name', '@job_instance_id', '@owner_scenario_instance_id', '@scenario_instance_id', 'field']
+        values = [
+                [1495094155683, 'Controller', '12', '1000', '100', 1],
+                [1495094163291, 'Controller', '12', '1000', '100', 2],
+                [1495094165203, 'Controller', '12', '1000', '100', 3]]
+        data = {'results': [{'series': [{'name': 'Debug', 'columns': columns, 'values': values}]}]}
+        chunks = [
+                {'results': [{'series': [{'name': 'Debug', 'columns': columns, 'values': values[:2]}], 'partial': True}]},
+                {'results': [{'series': [{'name': 'Debug', 'columns': columns, 'values': values[2:]}]}]},
+        ]
+
+        self.assertEqual(list(parse_influx(iter(chunks))), list(parse_influx(data)))
+        chunked_scenario, _ = parse_statistics(iter(chunks))
+        scenario, _ = parse_statistics(data)
+        self.assertEqual(list(chunked_scenario.jobs), list(scenario.jobs))
+
+    def test_coalesce_and_pack(self):
+        ranges = coalesce_timestamps({1, 2, 3, 5, 7, 8}, range(10))
+        self.assertEqual(list(ranges), [(1, 3), (5, 5), (7, 8)])
+        self.assertEqual(pack_queries(['aaa', 'bbb', 'ccc'], 8), ['aaa;bbb', 'ccc'])
+        self.assertEqual(pack_queries(['a' * 10, 'b'], 8), ['a' * 10, 'b'])
+
+    def test_remove_statistics_ranges(self):
+        columns = ['time', '@agent_name', '@job_instance_id', '@scenario_instance_id', 'field']
+        matching = {'results': [{'series': [{'name': 'job', 'columns': columns, 'values': [
+            [1, 'agent', '1', '10', 0], [2, 'agent', '1', '10', 0],
+            [4, 'agent', '1', '10', 0], [2, 'other', '2', '10', 0]]}]}]}
+        everything = {'results': [{'series': [{'name': 'job', 'columns': columns, 'values': [
+            [1, 'agent', '1', '10', 0], [2, 'agent', '1', '10', 0], [3, 'agent', '1', '10', 1],
+            [4, 'agent', '1', '10', 0], [2, 'other', '2', '10', 0]]}]}]}
+
+        class FakeInfluxDB(InfluxDBConnection):
+            def sql_query(self, query):
+                queries.append(query)
+                return everything if '"field" = 0' not in query else matching
+
+        queries = []
+        influxdb = FakeInfluxDB('localhost')
+        condition = ConditionField('field', Operator.Equal, 0)
+        self.assertEqual(influxdb.remove_statistics(condition=condition, dry_run=True), 1)
+        self.assertEqual(len(queries), 2)
+        self.assertTrue(queries[1].startswith('SELECT * FROM "job" WHERE'))
+        self.assertIn('("time" >= 1ms) AND ("time" <= 4ms)', queries[1])
+
+        class FakeElasticSearch:
+            def remove_logs(self, *args):
+                queries.append('remove logs')
+
+        collector = CollectorConnection('localhost')
+        collector.influxdb = influxdb
+        collector.elasticsearch = FakeElasticSearch()
+        del queries[:]
+        self.assertEqual(collector.remove_statistics(condition=condition, dry_run=True), 1)
+        self.assertEqual(len(queries), 2)
+        del queries[:]
+        self.assertEqual(influxdb.remove_statistics(condition=condition), 1)
+        delete = queries[-1].split(';')
+        self.assertEqual(len(delete), 3)
+        self.assertIn('("time" >= 1ms) AND ("time" <= 2ms)', delete[0])
+        self.assertIn('"time" = 4ms', delete[1])
+        self.assertIn('"@agent_name" = \'other\'', delete[2])
+        self.assertEqual(collector.remove_statistics(condition=condition), 1)
+        self.assertEqual(queries[-1], 'remove logs')
+
+    def test_windowed_statistics(self):
+        columns = ['time', '@agent_name', '@job_instance_id', '@scenario_instance_id', '@owner_scenario_instance_id', '@suffix', 'value']
+        points = {
+            'job': [[t, 'agent', '1', '10', '10', None, t * 2] for t in (3, 5, 8, 13, 21, 34, 55)],
+            'other': [[t, 'agent', '2', '10', '10', None, t] for t in (1, 2, 89)],
+        }
+
+        class FakeInfluxDB(InfluxDBConnection):
+            def sql_query(self, query):
+                queries.append(query)
+                lower = re.search(r'"time" >= (\d+)ms', query)
+                upper = re.search(r'"time" < (\d+)ms', query)
+                series = []
+                for name in sorted(points):
+                    values = [
+                            point for point in points[name]
+                            if (lower is None or point[0] >= int(lower.group(1)))
+                            and (upper is None or point[0] < int(upper.group(1)))
+                    ]
+                    if 'DESC' in query:
+                        values = values[::-1]
+                    if 'LIMIT 1' in query:
+                        values = values[:1]
+                    if values:
+                        series.append({'name': name, 'columns': columns, 'values': values})
+                return {'results': [{'statement_id': 0, 'series': series}]} if series else {'results': [{'statement_id': 0}]}
+
+        queries = []
+        influxdb = FakeInfluxDB('localhost')
+        self.assertEqual(influxdb.bounds(), (1, 89))
+        expected = list(influxdb.raw_statistics())
+        for windows in (2, 3, 7, 200):
+            del queries[:]
+            self.assertEqual(list(influxdb.raw_statistics(windows=windows, concurrency=2)), expected)
+            self.assertEqual(len(queries), 2 + min(windows, 89))
+        expected = [list(scenario.jobs) for scenario in influxdb.statistics()]
+        windowed = [list(scenario.jobs) for scenario in influxdb.statistics(windows=4)]
+        self.assertEqual(windowed, expected)
+        with self.assertRaises(ValueError):
+            list(influxdb.raw_statistics(windows=2, chunk_size=10))
+
+    def test_line_protocol(self):
+        statistics = {1000 + i: {'a': i, 'b': 'text'} for i in range(10)}
+        tags = 'job,@scenario_instance_id=1,@owner_scenario_instance_id=1,@job_instance_id=2,@agent_name=agent'
+        expected = ['{} a={},b="text" {}'.format(tags, i, 1000 + i) for i in range(10)]
+
+        chunks = list(line_protocol('job', 1, 1, 'agent', 2, None, statistics))
+        self.assertEqual(chunks, ['\n'.join(expected)])
+        chunks = list(line_protocol('job', 1, 1, 'agent', 2, None, statistics, max_bytes=None, max_lines=4))
+        self.assertEqual(chunks, ['\n'.join(expected[i:i + 4]) for i in range(0, 10, 4)])
+        chunks = list(line_protocol('job', 1, 1, 'agent', 2, None, statistics, max_bytes=3 * len(expected[0])))
+        self.assertEqual([chunk.count('\n') + 1 for chunk in chunks], [2, 2, 2, 2, 2])
+        chunks = list(line_protocol('job', 1, 1, 'agent', 2, None, statistics, max_bytes=1))
+        self.assertEqual(chunks, expected)
+        chunks = list(line_protocol('job', 1, 1, 'agent', 2, None, iter(statistics.items())))
+        self.assertEqual(chunks, ['\n'.join(expected)])
+        self.assertEqual(list(line_protocol('job', 1, 1, 'agent', 2, None, Statistic().rows())), [])
+
+        statistics = {1000 + i: {'a': 'é' * 10} for i in range(10)}
+        line_size = len(tags.encode()) + len(' a="{}" 1000'.format('é' * 10).encode())
+        chunks = list(line_protocol('job', 1, 1, 'agent', 2, None, statistics, max_bytes=3 * line_size + 2))
+        self.assertEqual([chunk.count('\n') + 1 for chunk in chunks], [3, 3, 3, 1])
+        self.assertTrue(all(len(chunk.encode()) <= 3 * line_size + 2 for chunk in chunks))
+
+    def test_line_protocol_encoder(self):
+        statistics = [(1, {'a b': 1, 'c': 1.5, 'd': True, 'e': 'x "y"', 'f': None, 'g': ''})]
+        line, = LineProtocolEncoder().lines('job', 'job', statistics)
+        self.assertEqual(line, r'job a\ b=1,c=1.5,d=True,e="x \"y\"" 1')
+        line, = LineProtocolEncoder(integer_suffix=True).lines('job', 'job', statistics)
+        self.assertEqual(line, r'job a\ b=1i,c=1.5,d=True,e="x \"y\"" 1')
+
+    # TODO test_orphans_parse
+
+
+class _FakeElasticSearch(ElasticSearchConnection):
+    def __init__(self, documents=25, failing_slice=None):
+        super().__init__('localhost')
+        self.documents = [{'_id': str(index), 'sort': [index]} for index in range(documents)]
+        self.failing_slice = failing_slice
+        self.contexts = {}
+        self.lock = threading.Lock()
+
+    def _page(self, context):
+        documents, offset, size = context
+        return documents[offset:offset + size]
+
+    def _post(self, url, params=None, json=None):
+        params = params or {}
+        json = json or {}
+        with self.lock:
+            if url == self.opening_pit_URL:
+                self.contexts['pit'] = None
+                return {'id': 'pit'}
+            if url == self.scrolling_URL:
+                documents, offset, size = self.contexts[json['scroll_id']]
+                slice_id = json['scroll_id'].split(':')[0]
+                if self.failing_slice is not None and slice_id == str(self.failing_slice):
+                    raise OSError('connection reset')
+                context = self.contexts[json['scroll_id']] = documents, offset + size, size
+                return {'_scroll_id': json['scroll_id'], 'hits': {'hits': self._page(context)}}
+
+            documents = self.documents
+            slices = json.get('slice')
+            if slices is not None:
+                documents = documents[slices['id']::slices['max']]
+            size = params.get('size', 10)
+            if url == self.pit_querying_URL:
+                after = json.get('search_after', [-1])[0]
+                documents = [document for document in documents if document['sort'][0] > after]
+                return {'pit_id': 'pit', 'hits': {'hits': documents[:size]}}
+            scroll_id = '{}:{}'.format(slices and slices['id'], len(self.contexts))
+            context = self.contexts[scroll_id] = documents, 0, size
+            return {'_scroll_id': scroll_id, 'hits': {'hits': self._page(context)}}
+
+    def _delete(self, url, body):
+        with self.lock:
+            for context in body.get('scroll_id', [body.get('id')]):
+                del self.contexts[context]
+
+
+class TestDataAccessElasticSearch(unittest.TestCase):
+    def test_timestamps_parsing(self):
+        local = datetime.datetime(2024, 2, 29, 13, 5, 9).timestamp() * 1000
+        self.assertEqual(parse_timestamp_with_index('Feb 29 13:05:09', 'logstash-2024.02.29'), local)
+        self.assertEqual(parse_timestamp_with_index('Feb  9 13:05:09', 'logstash-2024.02.09'),
+                         local - 20 * 24 * 3600 * 1000)
+        for invalid in ('Foo 29 13:05:09', 'Feb 29', 'Feb 30 13:05:09', 'Feb 29 13:05:xx'):
+            with self.assertRaises(ValueError):
+                parse_timestamp_with_index(invalid, 'logstash-2024.02.29')
+
+        source = {'@timestamp': '2024-02-29T13:05:09.123Z', 'timestamp': 'Feb 29 13:05:09'}
+        self.assertEqual(extract_timestamp_with_index(source, 'logstash-2024.02.29'), 1709211909123)
+        del source['@timestamp']
+        self.assertEqual(extract_timestamp_with_index(source, 'logstash-2024.02.29'), local)
+
+    def test_tags_to_query(self):
+        self.assertEqual(tags_to_query(None, None, None, None, None), {'query': {'match_all': {}}})
+        self.assertEqual(tags_to_query(None, None, None, None, 1000, ['message']), {
+            'query': {'bool': {'filter': [{'range': {'@timestamp': {'gte': 1000, 'lte': 1000}}}]}},
+            '_source': {'includes': ['message']},
+        })
+
+        exact_fields = {'program': 'program.keyword', 'agent_name': None}
+        query = tags_to_query(12, 'ping', 'agent', 3, (1000, 2000), exact_fields=exact_fields)
+        self.assertEqual(query, {'query': {'bool': {'filter': [
+            {'range': {'@timestamp': {'gte': 1000, 'lte': 2000}}},
+            {'bool': {
+                'should': [
+                    {'term': {'scenario_instance_id': 12}},
+                    {'term': {'owner_scenario_instance_id': 12}},
+                ],
+                'minimum_should_match': 1,
+            }},
+            {'term': {'program.keyword': 'ping'}},
+            {'match': {'agent_name': 'agent'}},
+            {'term': {'job_instance_id': 3}},
+        ]}}})
+
+        class FakeElasticSearch(ElasticSearchConnection):
+            def keyword_field(self, field_name):
+                requested.append(field_name)
+                return field_name + '.keyword' if field_name == 'program' else field_name
+
+        requested = []
+        query = FakeElasticSearch('localhost').tags_query(None, 'ping', None, 3, None)
+        self.assertEqual(requested, ['program', 'job_instance_id'])
+        self.assertEqual(query['query']['bool']['filter'], [
+            {'term': {'program.keyword': 'ping'}},
+            {'term': {'job_instance_id': 3}},
+        ])
+
+    def test_sliced_scroll(self):
+        expected = [str(index) for index in range(25)]
+        for slices in (None, 1, 3, 30):
+            for point_in_time in (False, True):
+                elasticsearch = _FakeElasticSearch()
+                hits = elasticsearch.search_query(slices=slices, page_size=4, point_in_time=point_in_time)
+                self.assertEqual(sorted((hit['_id'] for hit in hits), key=int), expected)
+                self.assertEqual(elasticsearch.contexts, {})
+
+    def test_scroll_cleared(self):
+        elasticsearch = _FakeElasticSearch()
+        hits = elasticsearch.search_query(slices=3, page_size=2)
+        next(hits)
+        hits.close()
+        self.assertEqual(elasticsearch.contexts, {})
+
+        elasticsearch = _FakeElasticSearch(failing_slice=1)
+        with self.assertRaises(OSError):
+            list(elasticsearch.search_query(slices=3, page_size=2))
+        self.assertEqual(elasticsearch.contexts, {})
+
+    def test_sliced_scroll_bounded(self):
+        elasticsearch = _FakeElasticSearch(documents=100)
+        hits = elasticsearch.search_query(slices=2, page_size=1)
+        next(hits)
+        time.sleep(.2)
+        # Slices wait for the consumer once the queue is full
+        self.assertLess(len(elasticsearch.contexts), 3)
+        self.assertTrue(all(offset < 10 for _, offset, _ in elasticsearch.contexts.values()))
+        hits.close()
+        self.assertEqual(elasticsearch.contexts, {})
+
+    def test_point_in_time_unsupported(self):
+        class OldElasticSearch(_FakeElasticSearch):
+            def _post(self, url, params=None, json=None):
+                if url == self.opening_pit_URL:
+                    return {'error': 'no handler found for uri', 'status': 400}
+                return super()._post(url, params, json)
+
+        with self.assertRaises(RuntimeError):
+            list(OldElasticSearch().search_query(point_in_time=True))
+
+    def test_distinct_lookups(self):
+        mapping = {'logstash-2023.01.01': {'mappings': {
+            'agent_name': {'full_name': 'agent_name', 'mapping': {'agent_name': {'type': 'text'}}},
+            'agent_name.keyword': {'full_name': 'agent_name.keyword', 'mapping': {'keyword': {'type': 'keyword'}}},
+        }}}
+
+        class Response:
+            def json(self):
+                return mapping
+
+        class Session:
+            def get(self, url, **kwargs):
+                requested.append(url)
+                return Response()
+
+        class FakeElasticSearch(ElasticSearchConnection):
+            def _post(self, url, params=None, json=None):
+                posted.append(copy.deepcopy(json))
+                if 'aggs' not in json:
+                    hits = [{'fields': {'job_instance_id': [value]}} for value in ('1', '2', '2')]
+                    return {'hits': {'hits': hits if 'scroll_id' not in json else []}}
+                composite = json['aggs']['distinct']['composite']
+                offset = composite.get('after', {}).get('agent_name', 0)
+                page = pages[offset]
+                buckets = [{'key': {'agent_name': value}, 'doc_count': 1} for value in page]
+                return {'aggregations': {'distinct': {'buckets': buckets, 'after_key': {'agent_name': offset + len(page)}}}}
+
+        requested = []
+        posted = []
+        pages = {0: ['a', 'b'], 2: [None, 'c'], 4: []}
+        elasticsearch = FakeElasticSearch('localhost')
+        elasticsearch.session = Session()
+        self.assertEqual(elasticsearch.agent_names(), {'a', 'b', 'c', None})
+        self.assertEqual(len(posted), 3)
+        sources = [{'agent_name': {'terms': {'field': 'agent_name.keyword', 'missing_bucket': True}}}]
+        for body in posted:
+            self.assertEqual(body['size'], 0)
+            self.assertEqual(body['aggs']['distinct']['composite']['sources'], sources)
+        self.assertEqual([body['aggs']['distinct']['composite'].get('after') for body in posted],
+                         [None, {'agent_name': 2}, {'agent_name': 4}])
+
+        self.assertEqual(elasticsearch.agent_names(job='job'), {'a', 'b', 'c', None})
+        # The program field is not mapped as a keyword: filtered on using a match clause
+        self.assertEqual(len(requested), 2)
+        self.assertEqual(posted[-1]['query'], {'bool': {'filter': [{'match': {'program': 'job'}}]}})
+        del posted[:]
+        self.assertEqual(elasticsearch.job_instance_ids(), {1, 2})
+        self.assertEqual(len(requested), 3)
+        self.assertTrue(all('aggs' not in body for body in posted))
+
+        mapping = 'not JSON'
+        Response.json = lambda self: json.loads(mapping)
+        elasticsearch._keyword_fields.clear()
+        self.assertEqual(elasticsearch.job_instance_ids(), {1, 2})
+
+        # No logstash-* index yet: the keyword field is looked up again next time
+        mapping = '{}'
+        elasticsearch._keyword_fields.clear()
+        self.assertIsNone(elasticsearch.keyword_field('agent_name'))
+        self.assertNotIn('agent_name', elasticsearch._keyword_fields)
+
+    def test_bulk_batching(self):
+        job = Scenario(1).get_or_create_job('ping', 2, 'agent')
+        for index in range(5):
+            job.logs_data.add_log(
+                    str(index), 'logs', 'logstash-2024.02.29', 1709211909123 + index, 1,
+                    1, 'user', 'host', 'message {}'.format(index), 42, 14, 6, 'info', '')
+
+        bodies = list(rest_protocol('ping', 1, 1, 'agent', 2, job.logs_data.numbered_data, max_actions=2))
+        self.assertEqual([body.count('\n') for body in bodies], [4, 4, 2])
+        metadata, document = map(json.loads, bodies[0].splitlines()[:2])
+        self.assertEqual(metadata['index']['_id'], '0')
+        self.assertEqual(document['@timestamp'], '2024-02-29T13:05:09.123Z')
+        self.assertEqual(document['message'], 'message 0')
+        action_size = len(bodies[0]) // 2
+        bodies = list(rest_protocol('ping', 1, 1, 'agent', 2, job.logs_data.numbered_data, max_bytes=3 * action_size))
+        self.assertEqual([body.count('\n') for body in bodies], [6, 4])
+
+        class Response:
+            def __init__(self, status_code, result):
+                self.status_code = status_code
+                self.content = json.dumps(result).encode()
+
+            def json(self):
+                return json.loads(self.content)
+
+        class Session:
+            def post(self, url, data, **kwargs):
+                written.append(data.decode())
+                return responses.pop(0)
+
+        items = [{'index': {'status': 201}}, {'index': {'status': 429, 'error': 'queue full'}},
+                 {'index': {'status': 400, 'error': 'mapping'}}, {'index': {'status': 201}},
+                 {'index': {'status': 503, 'error': 'unavailable'}}]
+        body, = rest_protocol('ping', 1, 1, 'agent', 2, job.logs_data.numbered_data)
+        actions = [''.join(body.splitlines(keepends=True)[i:i + 2]) for i in range(0, 10, 2)]
+        self.assertEqual(parse_bulk_response(body, {'errors': False, 'items': []}), ('', []))
+        self.assertEqual(parse_bulk_response(body, {'errors': True, 'items': items}),
+                         (actions[1] + actions[4], [(actions[2], 'mapping')]))
+
+        written = []
+        responses = [
+                Response(503, {}),
+                Response(200, {'errors': True, 'items': items}),
+                Response(200, {'errors': True, 'items': [{'index': {'status': 201}}, {'index': {'status': 429}}]}),
+                Response(200, {'errors': False, 'items': [{'index': {'status': 201}}]}),
+        ]
+        elasticsearch = ElasticSearchConnection('localhost', session=Session())
+        with unittest.mock.patch('time.sleep'):
+            failures = elasticsearch.import_job(1, 1, job)
+        self.assertEqual(failures, [(actions[2], 'mapping')])
+        self.assertEqual(written, [body, body, actions[1] + actions[4], actions[4]])
+        self.assertEqual(responses, [])
+
+
+class TestDataAccessResults(unittest.TestCase):
+    def test_columnar_statistic(self):
+        statistic = Statistic()
+        statistic.add_statistic(1, integer=1, text='a')
+        statistic.add_statistic(2, integer=2, floating=.5)
+        statistic.add_statistic(3, integer=3, floating=1.5, flag=True)
+
+        self.assertEqual(len(statistic), 3)
+        self.assertEqual(statistic.fields, ['integer', 'text', 'floating', 'flag'])
+        self.assertEqual(statistic.timestamps.tolist(), [1, 2, 3])
+        self.assertEqual(statistic.timestamps.dtype, 'int64')
+        self.assertEqual(statistic.numpy('integer').dtype, 'int64')
+        self.assertEqual(statistic.numpy('floating').mask.tolist(), [True, False, False])
+        self.assertEqual(statistic.json, [
+                {'time': 1, 'integer': 1, 'text': 'a'},
+                {'time': 2, 'integer': 2, 'floating': .5},
+                {'time': 3, 'integer': 3, 'floating': 1.5, 'flag': True},
+        ])
+        self.assertEqual(Statistic.load(statistic.json), statistic)
+
+        df = statistic.dataframe
+        self.assertEqual(df.index.tolist(), [1, 2, 3])
+        self.assertEqual(df['integer'].tolist(), [1, 2, 3])
+        self.assertTrue(df['floating'].isna()[1])
+
+    def test_statistic_growth(self):
+        statistic = Statistic()
+        for timestamp in range(3 * Statistic.CHUNK_SIZE):
+            statistic.add_statistic(timestamp, value=timestamp)
+        statistic.add_statistic(1, value=.5)
+
+        self.assertEqual(statistic.numpy('value').dtype, 'float64')
+        self.assertEqual(len(statistic), 3 * Statistic.CHUNK_SIZE)
+        self.assertEqual(len(statistic.dated_data), 3 * Statistic.CHUNK_SIZE)
+        self.assertEqual(statistic.dated_data[1], {'value': .5})
+        self.assertEqual(statistic.dated_data[2], {'value': 2})
+
+    def test_statistic_values(self):
+        statistic = Statistic()
+        statistic.add_statistic(1, x=5, big=2**60)
+        statistic.add_statistic(2, x=5.5, big=.5)
+        statistic.add_statistic(3, x=6)
+        statistic.add_statistic(2, y='overwritten')
+
+        self.assertEqual(len(statistic), 3)
+        self.assertEqual(statistic.timestamps.tolist(), [1, 2, 3])
+        self.assertEqual(statistic.numpy('x').dtype, 'float64')
+        self.assertEqual(statistic.numpy('x').tolist(), [5., None, 6.])
+        self.assertEqual(statistic.numpy('big').dtype, object)
+        self.assertEqual(len(statistic.dataframe), 3)
+        self.assertEqual(statistic.json, [
+                {'time': 1, 'x': 5, 'big': 2**60},
+                {'time': 2, 'y': 'overwritten'},
+                {'time': 3, 'x': 6},
+        ])
+        self.assertEqual(json.dumps(statistic.json), json.dumps(Statistic.load(statistic.json).json))
+        self.assertIs(type(statistic.dated_data[3]['x']), int)
+
+    def test_statistic_extend(self):
+        rows = [(timestamp, {'value': timestamp / 2, 'count': timestamp}) for timestamp in range(10000)]
+        rows[5] = (5, {'count': 5})
+        rows.append((7, {'value': 'overwritten'}))
+        expected = Statistic()
+        for timestamp, values in rows:
+            expected.add_statistic(timestamp, **values)
+
+        statistic = Statistic()
+        statistic.extend(rows)
+        self.assertEqual(len(statistic), 10000)
+        self.assertEqual(statistic, expected)
+        self.assertEqual(list(statistic.rows()), list(expected.dated_data.items()))
+        self.assertEqual(statistic.numpy('count').dtype, 'int64')
+        self.assertEqual(statistic.numpy('value').dtype, object)
+        self.assertEqual(list(Statistic().rows()), [])
+
+
+class TestDataAccessPostProcessing(unittest.TestCase):
+    def test_parse_dataframes(self):
+        data = {'results': [{'series': [{
+            'name': 'iperf3',
+            'columns': [
+                'time',
+                '@agent_name',
+                '@job_instance_id',
+                '@owner_scenario_instance_id',
+                '@scenario_instance_id',
+                '@suffix',
+                'throughput',
+                'jitter'],
+            'values': [
+                [1000, 'client', '12', '100', '100', 'Flow1', 10, None],
+                [1500, 'client', '13', '100', '100', None, 5, 0.5],
+                [2000, 'client', '12', '100', '100', 'Flow1', 20, None],
+                [2500, 'client', '13', '100', '100', None, 6, 0.7]]}]}]}
+
+        first, second = Statistics('localhost')._parse_dataframes(data, 'test')
+        self.assertEqual(first.columns.tolist(), [(12, 100, 'client', 'Flow1', 'throughput')])
+        self.assertEqual(first.index.tolist(), [0, 1000])
+        self.assertEqual(first.iloc[:, 0].tolist(), [10, 20])
+        self.assertEqual(second.columns.tolist(), [
+                (13, 100, 'client', '', 'throughput'),
+                (13, 100, 'client', '', 'jitter'),
+        ])
+        self.assertEqual(second.index.tolist(), [0, 1000])
+        self.assertEqual(second.index.name, 'Time (ms)')
+
+    def test_downsampling(self):
+        tags = '"@job_instance_id","@scenario_instance_id","@owner_scenario_instance_id","@agent_name","@suffix"'
+        self.assertEqual(
+                downsampled_query('iperf3', condition=ConditionTag('@agent_name', Operator.Equal, 'client')),
+                'SELECT MEAN(*) FROM "iperf3" WHERE "@agent_name" = \'client\' '
+                'GROUP BY time(1m),{} fill(none)'.format(tags))
+        self.assertEqual(
+                downsampled_query(None, ['rtt'], None, 500, 'percentile', 95, 'previous'),
+                'SELECT PERCENTILE("rtt", 95) AS "rtt" FROM /.*/ GROUP BY time(500ms),{} fill(previous)'.format(tags))
+        with self.assertRaises(ValueError):
+            downsampled_query(aggregator='median')
+        with self.assertRaises(ValueError):
+            downsampled_query(aggregator='percentile')
+        with self.assertRaises(ValueError):
+            downsampled_query(fill='nearest')
+
+        def serie(job_instance, suffix, values):
+            return {
+                'name': 'iperf3',
+                'tags': {
+                    '@agent_name': 'client', '@job_instance_id': job_instance,
+                    '@owner_scenario_instance_id': '100', '@scenario_instance_id': '100',
+                    '@suffix': suffix},
+                'columns': ['time', 'max_throughput', 'max_jitter'],
+                'values': values}
+
+        data = {'results': [{'series': [
+                serie('12', 'Flow1', [[0, 10, None], [60000, None, None], [120000, 20, None]]),
+                serie('13', '', [[0, 5, 0.5], [60000, 6, 0.7]])]}]}
+        statistics = Statistics('localhost')
+        with unittest.mock.patch.object(statistics, 'sql_query', return_value=data) as sql_query:
+            first, second = statistics.fetch('iperf3', downsampling='1m', aggregator='max')
+        self.assertIn('SELECT MAX(*) FROM "iperf3" GROUP BY time(1m)', sql_query.call_args[0][0])
+        self.assertEqual(first.dataframe.columns.tolist(), [(12, 100, 'client', 'Flow1', 'throughput')])
+        self.assertEqual(first.dataframe.index.tolist(), [0, 60000, 120000])
+        self.assertEqual(second.dataframe.columns.tolist(), [
+                (13, 100, 'client', '', 'throughput'),
+                (13, 100, 'client', '', 'jitter'),
+        ])
+        self.assertEqual(second.dataframe.iloc[:, 1].tolist(), [0.5, 0.7])
+
+    def test_accumulate(self):
+        def chunk(values):
+            return {'results': [{'statement_id': 0, 'series': [{
+                'name': 'owamp',
+                'columns': ['time', '@agent_name', '@job_instance_id', '@scenario_instance_id', '@suffix', 'delay'],
+                'values': [[t, 'client', '12', '100', None, v] for t, v in values]}]}]}
+
+        statistics = Statistics('localhost')
+        chunks = [chunk([(1000, 1.), (2000, 5.)]), chunk([(3000, 9.), (4000, None)])]
+        with unittest.mock.patch.object(statistics, 'chunked_query', return_value=iter(chunks)):
+            histograms = statistics.accumulate(lambda: StreamingHistogram.linear(0, 10, 2), 'owamp')
+        self.assertEqual(list(histograms), [(12, 100, 'client', '', 'delay')])
+        histogram, = histograms.values()
+        self.assertEqual(histogram.counts.tolist(), [1, 2])
+        self.assertEqual(histogram.cdf().tolist(), [1 / 3, 1.])
+
+    def test_compute_function(self):
+        hour = 3600000
+        start = 1699833600000  # 2023-11-13 00:00 UTC
+        times = [0, 7, 8, 19, 20.5, 23, 23.5, 24, 31, 48]
+        df = pd.DataFrame(
+                {'rate': [10., 20, 30, 40, 50, 60, 70, 80, 90, 100]},
+                index=[start + int(time * hour) for time in times])
+        mean = _Plot(df).compute_function('mean', 10, 7, 19, 23, 'D', 'E', 'N')
+        self.assertEqual(mean.to_dict(), {
+                'D (7h − 19h)': 3.5,
+                'E (19h − 23h)': 5.5,
+                'N (23h − 7h)': 7.2,
+                'Undefined': 1.0,
+        })
+
+    def test_temporal_binning_histogram(self):
+        hour = 3600000
+        df = pd.DataFrame(
+                {'rtt': [5, 15, 15, 25, None, 20, 30]},
+                index=[0, hour // 2, hour, hour + 1, 2 * hour, 2 * hour + 1, 25 * hour])
+        stats, = _Plot(df).temporal_binning_histogram(bin_size=10)
+        self.assertEqual(stats.index.tolist(), ['0-1', '1-2', '2-3', 'total'])
+        self.assertEqual(stats.columns.tolist(), [10, 20, 30])
+        self.assertEqual(stats.loc['0-1'].tolist(), [50, 50, 0])
+        self.assertEqual(stats.loc['1-2'].tolist(), [0, 1 / 3 * 100, 2 / 3 * 100])
+        self.assertEqual(stats.loc['2-3'].tolist(), [0, 0, 100])
+        self.assertEqual(stats.loc['total'].tolist(), [1 / 6 * 100, 2 / 6 * 100, 3 / 6 * 100])
+        self.assertEqual(df['rtt'].tolist()[:4], [5, 15, 15, 25])
+
+        stats, = _Plot(df).temporal_binning_histogram(bin_size=10, maximum=20, add_total=False, scale_factor=10)
+        self.assertEqual(stats.columns.tolist(), [10, 20])
+        self.assertEqual(stats.loc['1-2'].tolist(), [100, 0])
+
+    def test_render_figures(self):
+        df = pd.DataFrame({'rtt': [5., 15, 15, 25, 20, 30]}, index=range(0, 6000, 1000))
+        with tempfile.TemporaryDirectory() as directory:
+            series = [os.path.join(directory, 'series.' + extension) for extension in ('png', 'svg')]
+            histogram = os.path.join(directory, 'histogram.png')
+            rendered = render_figures([
+                FigureSpec(_Plot(df), 'time_series', series),
+                FigureSpec(df, 'histogram', histogram, {'bins': 3, 'secondary_title': 'RTT'}),
+                FigureSpec(df, 'unknown', os.path.join(directory, 'unknown.png')),
+            ], processes=2)
+            self.assertEqual(sorted(os.listdir(directory)), ['histogram.png', 'series.png', 'series.svg'])
+
+        self.assertEqual([figure.filename for figure in rendered], [series, histogram, os.path.join(directory, 'unknown.png')])
+        self.assertTrue(all(figure.elapsed > 0 for figure in rendered))
+        self.assertIsNone(rendered[0].error)
+        self.assertIsNone(rendered[1].error)
+        self.assertIsInstance(rendered[2].error, AttributeError)
+
+
+class TestDataAccessHistograms(unittest.TestCase):
+    def test_streaming_histogram(self):
+        values = [0.5, 1, 2, 3, 4, 7, 10, float('nan'), 12]
+        first = StreamingHistogram.linear(1, 10, 3).update(values[:4])
+        second = StreamingHistogram.linear(1, 10, 3).update(values[4:])
+        merged = first + second
+        self.assertEqual(merged.counts.tolist(), [3, 1, 2])
+        self.assertEqual((merged.underflow, merged.overflow, merged.total), (1, 1, 6))
+        self.assertEqual(first.total, 3)
+        self.assertEqual(merged.centers.tolist(), [2.5, 5.5, 8.5])
+        self.assertEqual(merged.pdf().sum(), 1)
+        self.assertEqual(merged.cdf()[-1], 1)
+
+        logarithmic = StreamingHistogram.logarithmic(1, 1000, 3).update([1, 5, 50, 500, 1000])
+        self.assertEqual(logarithmic.counts.tolist(), [2, 1, 2])
+        with self.assertRaises(ValueError):
+            merged.merge(logarithmic)
+        with self.assertRaises(ValueError):
+            StreamingHistogram.logarithmic(0, 10, 3)
+
+    def test_quantile_sketch(self):
+        values = [x / 10 for x in range(-500, 10001)]
+        sketch = QuantileSketch(0.01).update(values[:5000])
+        sketch.merge(QuantileSketch(0.01).update(values[5000:] + [float('nan')]))
+        self.assertEqual(len(sketch), len(values))
+        self.assertEqual(sketch.quantile(0), -50)
+        for quantile in (.01, .25, .5, .9, .99):
+            expected = values[round(quantile * (len(values) - 1))]
+            self.assertAlmostEqual(sketch.quantile(quantile), expected, delta=abs(expected) * 0.01)
+        self.assertAlmostEqual(sketch.cdf(500), 5501 / 10501, delta=0.01)
+        self.assertTrue(math.isnan(QuantileSketch().quantile(.5)))
+        with self.assertRaises(ValueError):
+            sketch.merge(QuantileSketch(0.05))
+
+
+class _DatabaseStandIn(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    received = []
+    search_result = {'hits': {'hits': [{
+        '_id': 'log', '_index': 'logstash-2024.02.29', '_type': 'logs', '_source': {
+            'agent_name': 'agent', 'program': 'ping', 'job_instance_id': 2,
+            'scenario_instance_id': 1, 'owner_scenario_instance_id': 1,
+            '@timestamp': '2024-02-29T13:05:09.123Z', '@version': '1', 'facility': 1,
+            'facility_label': 'user', 'host': 'host', 'logsource': 'agent', 'message': 'message',
+            'pid': 42, 'priority': 14, 'severity': 6, 'severity_label': 'info'},
+    }]}}
+
+    def _reply(self, status, body=b'', gzip=False):
+        self.send_response(status)
+        if gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._reply(200, b'{"results": []}')
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        self.received.append(body)
+        if self.path.startswith('/logstash-*/_search') and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            self.received.append(self.path)
+            self._reply(200, gzip.compress(json.dumps(self.search_result).encode()), gzip=True)
+            return
+        self._reply(503 if self.path.startswith('/unavailable') else 204)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestDataAccessSessions(unittest.TestCase):
+    def setUp(self):
+        _DatabaseStandIn.received = []
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _DatabaseStandIn)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_compress_body(self):
+        body, headers = compress_body('a line', {'Authorization': 'Basic'})
+        self.assertEqual(gzip.decompress(body), b'a line')
+        self.assertEqual(headers, {'Authorization': 'Basic', 'Content-Encoding': 'gzip'})
+
+    def test_connection_reuse(self):
+        influxdb = InfluxDBCommunicator('127.0.0.1', self.server.server_port, compress=True)
+        for _ in range(5):
+            influxdb.sql_query('SHOW MEASUREMENTS')
+        influxdb.data_write('measurement field=1 1')
+
+        self.assertEqual(_DatabaseStandIn.received, [b'measurement field=1 1'])
+        self.assertEqual(influxdb.connection_statistics, {'connections': 1, 'requests': 6, 'reused': 5})
+
+    def test_compressed_logs(self):
+        elasticsearch = ElasticSearchConnection('127.0.0.1', self.server.server_port)
+        scenario, = elasticsearch.logs(scenario=1)
+        job, = scenario.jobs
+        self.assertEqual(job.logs_data.numbered_data['log']._timestamp, 1709211909123)
+
+        body, path = _DatabaseStandIn.received[:2]
+        self.assertIn('filter_path=error%2C_scroll_id%2C', path)
+        self.assertEqual(json.loads(body)['_source'], {'includes': list(LOG_SOURCE_FIELDS)})
+
+    def test_scroll_retry_policy(self):
+        retry = _DatabaseRetry(total=3, allowed_methods=None)
+        url = '/_search/scroll'
+        for error in (NewConnectionError(None, 'refused'), ProtocolError('aborted'), ConnectTimeoutError()):
+            self.assertEqual(retry.increment('POST', url, error=error).total, 2)
+        with self.assertRaises(MaxRetryError):
+            retry.increment('POST', url, error=ReadTimeoutError(None, url, 'timed out'))
+        with self.assertRaises(MaxRetryError):
+            retry.increment('POST', url)
+        self.assertEqual(retry.increment('POST', '/_search', error=ReadTimeoutError(None, url, 'timed out')).total, 2)
+
+    def test_scroll_not_retried(self):
+        session = build_session(backoff_factor=0)
+        url = 'http://127.0.0.1:{}/unavailable'.format(self.server.server_port)
+        response = session.post(url + '/_search/scroll', data=b'scroll')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(_DatabaseStandIn.received, [b'scroll'])
+        response = session.post(url + '/_bulk', data=b'bulk')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(_DatabaseStandIn.received, [b'scroll'] + [b'bulk'] * 4)
+
+
+class _CollectorStandIn(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    influx = {'results': [{'series': [{'name': 'job', 'columns': ['key', 'value'], 'values': [['@agent_name', 'influx']]}]}]}
+    pages = [
+            {'_scroll_id': 'id', 'hits': {'hits': [{'fields': {'agent_name': ['elastic']}}]}},
+            {'_scroll_id': 'id', 'hits': {'hits': [{'fields': {'agent_name': ['other']}}]}},
+            {'_scroll_id': 'id', 'hits': {'hits': []}},
+    ]
+    mapping = None
+    buckets = {None: ['elastic', None], 2: ['other'], 3: []}
+
+    def _reply(self, body):
+        body = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if '/_mapping/' in self.path and self.mapping is not None:
+            self._reply(self.mapping)
+        else:
+            self._reply(self.influx)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or 'null')
+        if body and 'aggs' in body:
+            self.__class__.aggregations.append(body)
+            after = body['aggs']['distinct']['composite'].get('after', {}).get('agent_name')
+            page = self.buckets[after]
+            buckets = [{'key': {'agent_name': value}, 'doc_count': 1} for value in page]
+            after_key = {'agent_name': (after or 0) + len(page)}
+            self._reply({'aggregations': {'distinct': {'buckets': buckets, 'after_key': after_key}}})
+        elif self.path.startswith('/_search/scroll'):
+            self.__class__.scrolls += 1
+            self._reply(self.pages[self.scrolls])
+        else:
+            self.__class__.scrolls = 0
+            self._reply(self.pages[0])
+
+    def do_DELETE(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self._reply({'succeeded': True})
+
+    def log_message(self, format, *args):
+        pass
+
+
+@unittest.skipIf(aiohttp is None, 'aiohttp is not installed')
+class TestDataAccessAsync(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _CollectorStandIn)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    async def test_native_lookups(self):
+        port = self.server.server_port
+        async with AsyncInfluxDBConnection('127.0.0.1', port) as influxdb:
+            names = await asyncio.gather(*(influxdb.agent_names(job='job') for _ in range(20)))
+        self.assertEqual(names, [{'influx'}] * 20)
+
+        async with AsyncElasticSearchConnection('127.0.0.1', port) as elasticsearch:
+            pages = [page async for page in elasticsearch.search_pages(fields='agent_name')]
+            self.assertEqual(len(pages), 2)
+            self.assertEqual(await elasticsearch.agent_names(), {'elastic', 'other'})
+
+        async with AsyncCollectorConnection('127.0.0.1', port, port) as collector:
+            self.assertEqual(await collector.agent_names(), {'influx', 'elastic', 'other'})
+            self.assertIs(collector.async_influxdb.session, collector.async_elasticsearch.session)
+
+    async def test_native_distinct_lookups(self):
+        _CollectorStandIn.aggregations = []
+        _CollectorStandIn.mapping = {'logstash-2023.01.01': {'mappings': {
+            'agent_name.keyword': {'full_name': 'agent_name.keyword', 'mapping': {'keyword': {'type': 'keyword'}}},
+        }}}
+        self.addCleanup(setattr, _CollectorStandIn, 'mapping', None)
+
+        async with AsyncElasticSearchConnection('127.0.0.1', self.server.server_port) as elasticsearch:
+            self.assertEqual(await elasticsearch.agent_names(), {'elastic', 'other', None})
+            # Not mapped as a keyword, scrolled through instead
+            self.assertEqual(await elasticsearch.job_instance_ids(), {None})
+        afters = [body['aggs']['distinct']['composite'].get('after') for body in _CollectorStandIn.aggregations]
+        self.assertEqual(afters, [None, {'agent_name': 2}, {'agent_name': 3}])
+        sources = _CollectorStandIn.aggregations[0]['aggs']['distinct']['composite']['sources']
+        self.assertEqual(sources, [{'agent_name': {'terms': {'field': 'agent_name.keyword', 'missing_bucket': True}}}])
+
+    async def test_native_timeout(self):
+        class SlowElasticSearch:
+            async def agent_names(self, *args):
+                await asyncio.sleep(10)
+
+        port = self.server.server_port
+        async with AsyncCollectorConnection('127.0.0.1', port, port, timeout=0.2) as collector:
+            collector.async_elasticsearch = SlowElasticSearch()
+            with self.assertWarns(PartialResultsWarning):
+                self.assertEqual(await collector.agent_names(), {'influx'})
+
+
+class TestDataAccessCollector(unittest.TestCase):
+    class _SlowDatabase:
+        def __init__(self, delay, names):
+            self.delay = delay
+            self.names = names
+
+        def job_names(self, *args):
+            time.sleep(self.delay)
+            return set(self.names)
+
+        def statistics(self, *args):
+            time.sleep(self.delay)
+            scenario = Scenario(1)
+            scenario.get_or_create_job('ping', 2, 'agent').get_or_create_statistics().add_statistic(1000, rtt=1)
+            yield scenario
+
+        def logs(self, *args):
+            time.sleep(self.delay)
+            scenario = Scenario(1)
+            scenario.get_or_create_job('ping', 2, 'agent').logs_data.add_log(
+                    'log', 'logs', 'index', 1000, 1, 1, '', '', '', 0, 0, 0, '', '')
+            yield scenario
+
+    def test_concurrent_queries(self):
+        collector = CollectorConnection('localhost')
+        collector.influxdb = self._SlowDatabase(0.3, ['ping'])
+        collector.elasticsearch = self._SlowDatabase(0.3, ['iperf3'])
+        start = time.perf_counter()
+        self.assertEqual(collector.job_names(), {'ping', 'iperf3'})
+        scenario, = collector.scenarios()
+        self.assertLess(time.perf_counter() - start, 1.2)
+        job, = scenario.jobs
+        self.assertEqual(len(job.statistics_data[(None,)]), 1)
+        self.assertEqual(list(job.logs_data.numbered_data), ['log'])
+
+    def test_timestamps_bounds(self):
+        class Database(self._SlowDatabase):
+            def bounds(self, *args):
+                queried.append('influxdb')
+                return 1000, 5000
+
+            def timestamp_bounds(self, *args):
+                queried.append('elasticsearch')
+                return None if self.names else (500, 3000)
+
+            def timestamps(self, *args):
+                return {1000, 3000} if self.names else {500, None}
+
+        queried = []
+        collector = CollectorConnection('localhost')
+        collector.influxdb = Database(0, [])
+        collector.elasticsearch = Database(0, [])
+        self.assertEqual(collector.timestamps(), (500, 5000))
+        self.assertEqual(sorted(queried), ['elasticsearch', 'influxdb'])
+        collector.elasticsearch.names = ['no logs']
+        self.assertEqual(collector.timestamps(), (1000, 5000))
+        self.assertEqual(collector.timestamps(only_bounds=False), [500, 1000, 3000])
+
+        class ElasticSearch(ElasticSearchConnection):
+            def _post(self, url, params=None, json=None):
+                posted.append(json)
+                return responses.pop(0)
+
+            def keyword_field(self, field_name):
+                return field_name
+
+            def search_query(self, body=None, **query):
+                searched.append(query)
+                return documents
+
+        posted = []
+        searched = []
+        documents = [{'_index': 'logstash-2024.02.29', 'fields': {'timestamp': ['Feb 29 13:05:09']}}]
+        responses = [
+                {'aggregations': {'first': {'value': 1000.0}, 'last': {'value': 3000.0}}},
+                {'aggregations': {'first': {'value': None}, 'last': {'value': None}}},
+                {'error': 'no mapping for @timestamp'},
+        ]
+        elasticsearch = ElasticSearch('localhost')
+        self.assertEqual(elasticsearch.timestamp_bounds(scenario=1), (1000, 3000))
+        self.assertEqual(posted[0]['size'], 0)
+        self.assertEqual(posted[0]['aggs'], {
+                'first': {'min': {'field': '@timestamp'}},
+                'last': {'max': {'field': '@timestamp'}},
+        })
+        self.assertIn('bool', posted[0]['query'])
+        self.assertIsNone(elasticsearch.timestamp_bounds())
+        local = int(datetime.datetime(2024, 2, 29, 13, 5, 9).timestamp() * 1000)
+        self.assertEqual(elasticsearch.timestamp_bounds(), (local, local))
+
+        # Listing timestamps prefers @timestamp, as bounds do
+        documents[0]['fields']['@timestamp'] = ['2024-02-29T13:05:09.123Z']
+        self.assertEqual(elasticsearch.timestamps(), {1709211909123})
+        self.assertEqual(searched[-1], {'fields': '@timestamp,timestamp'})
+
+    def test_partial_results(self):
+        collector = CollectorConnection('localhost', timeout=0.2)
+        collector.influxdb = self._SlowDatabase(0, ['ping'])
+        collector.elasticsearch = self._SlowDatabase(1, ['iperf3'])
+        with self.assertWarns(PartialResultsWarning):
+            self.assertEqual(collector.job_names(), {'ping'})
+        with self.assertWarns(PartialResultsWarning):
+            scenario, = collector.scenarios()
+        job, = scenario.jobs
+        self.assertEqual(job.logs_data.numbered_data, {})
+
+    def test_partial_results_not_cached(self):
+        class Database(self._SlowDatabase):
+            def statistics(self, *args):
+                queried.append('influxdb')
+                return super().statistics(*args)
+
+            def logs(self, *args):
+                queried.append('elasticsearch')
+                return super().logs(*args)
+
+        queried = []
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ScenarioCache(directory, settle_time=0)
+            collector = CollectorConnection('localhost', cache=cache, timeout=0.2)
+            collector.influxdb = Database(1, [])
+            collector.elasticsearch = Database(0, [])
+            with self.assertWarns(PartialResultsWarning):
+                scenario, = collector.scenarios(scenario_instance_id=1)
+            job, = scenario.jobs
+            self.assertEqual(job.statistics_data, {})
+            self.assertNotIn(1, cache)
+
+            collector.influxdb.delay = 0
+            queried.clear()
+            scenario, = collector.scenarios(scenario_instance_id=1)
+            self.assertEqual(sorted(queried), ['elasticsearch', 'influxdb'])
+            job, = scenario.jobs
+            self.assertEqual(len(job.statistics_data[(None,)]), 1)
+            self.assertIn(1, cache)
+
+
+
+class TestDataAccessCache(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    @staticmethod
+    def _scenario(timestamps, instance_id=1, log=None):
+        scenario = Scenario(instance_id)
+        subscenario = scenario.get_or_create_subscenario(instance_id + 1)
+        subscenario.owner = scenario
+        job = subscenario.get_or_create_job('ping', 3, 'agent')
+        statistics = job.get_or_create_statistics()
+        for timestamp in timestamps:
+            statistics.add_statistic(timestamp, rtt=timestamp / 1000)
+        if log is not None:
+            job.logs_data.add_log(log, 'logs', 'index', timestamps[-1], 1, 1, '', '', '', 0, 0, 0, '', '')
+        return scenario
+
+    def test_finished_scenario(self):
+        cache = ScenarioCache(self.directory)
+        retrieved = []
+
+        def retrieve(timestamps):
+            retrieved.append(timestamps)
+            return self._scenario([1000, 2000], log='log')
+
+        for _ in range(3):
+            scenario = cache.fetch(1, retrieve)
+            job, = scenario.jobs
+            self.assertEqual(job.statistics_data[(None,)].dated_data, {1000: {'rtt': 1}, 2000: {'rtt': 2}})
+            self.assertEqual(list(job.logs_data.numbered_data), ['log'])
+        self.assertEqual(retrieved, [None])
+        self.assertEqual(cache.statistics, {
+                'hits': 2, 'misses': 1, 'refreshes': 0, 'evictions': 0,
+                'entries': 1, 'bytes': os.path.getsize(os.path.join(self.directory, '1.pickle')),
+        })
+
+        cache = ScenarioCache(self.directory)
+        self.assertIn(1, cache)
+        cache.invalidate(1)
+        self.assertNotIn(1, cache)
+        self.assertIsNone(cache.fetch(1, lambda timestamps: None))
+        self.assertEqual(cache.statistics['misses'], 1)
+
+    def test_running_scenario(self):
+        cache = ScenarioCache(self.directory)
+        now = int(time.time() * 1000)
+        retrieved = []
+
+        def retrieve(timestamps):
+            retrieved.append(timestamps)
+            if timestamps is None:
+                return self._scenario([now - 2000, now - 1000])
+            scenario = self._scenario([now - 1000, now])
+            subscenario = scenario.get_or_create_subscenario(4)
+            subscenario.owner = scenario
+            subscenario.get_or_create_job('iperf3', 5, 'agent')
+            return scenario
+
+        cache.fetch(1, retrieve)
+        scenario = cache.fetch(1, retrieve)
+        self.assertEqual(retrieved[1][0], now - 1000)
+        self.assertEqual([s.instance_id for s in scenario.scenarios], [1, 2, 4])
+        statistics = {job.instance_id: job.statistics_data for job in scenario.jobs}
+        self.assertEqual(list(statistics), [3, 5])
+        self.assertEqual(statistics[3][(None,)].timestamps.tolist(), [now - 2000, now - 1000, now])
+        self.assertEqual(cache.statistics['refreshes'], 1)
+
+        cache.mark_finished(1)
+        cache.fetch(1, retrieve)
+        self.assertEqual(len(retrieved), 2)
+
+    def test_incomplete_refresh(self):
+        cache = ScenarioCache(self.directory)
+        now = int(time.time() * 1000)
+        retrieved = []
+
+        def retrieve(timestamps):
+            retrieved.append(timestamps)
+            if timestamps is None:
+                return self._scenario([now - 2000])
+            raise IncompleteScenario(self._scenario([now - 1000, now]))
+
+        cache.fetch(1, retrieve)
+        scenario = cache.fetch(1, retrieve)
+        job, = scenario.jobs
+        self.assertEqual(job.statistics_data[(None,)].timestamps.tolist(), [now - 2000, now - 1000, now])
+        cache.fetch(1, retrieve)
+        # The high-water mark did not move past the missing data
+        self.assertEqual([low for low, _ in retrieved[1:]], [now - 2000, now - 2000])
+        self.assertEqual(cache.statistics['refreshes'], 0)
+
+        partial = self._scenario([now])
+
+        def incomplete(timestamps):
+            raise IncompleteScenario(partial)
+
+        self.assertIs(cache.fetch(2, incomplete), partial)
+        self.assertNotIn(2, cache)
+
+    def test_eviction(self):
+        cache = ScenarioCache(self.directory, max_bytes=1)
+        cache.fetch(1, lambda timestamps: self._scenario([1000]))
+        cache.fetch(2, lambda timestamps: self._scenario([1000]))
+        self.assertNotIn(1, cache)
+        self.assertIn(2, cache)
+        self.assertEqual(cache.statistics['evictions'], 1)
+        self.assertEqual(sorted(os.listdir(self.directory)), ['2.pickle', 'index.json'])
+
+    def test_collector_cache(self):
+        class FakeCollector(CollectorConnection):
+            def _scenarios(self, *args, **kwargs):
+                queried.append(kwargs)
+                yield TestDataAccessCache._scenario([1000])
+
+        queried = []
+        collector = FakeCollector('localhost', cache=ScenarioCache(self.directory))
+        for _ in range(2):
+            scenario, = collector.scenarios(scenario_instance_id=1)
+            self.assertEqual(scenario.instance_id, 1)
+        self.assertEqual(len(queried), 1)
+        list(collector.scenarios('ping', 1))
+        self.assertEqual(len(queried), 2)
+        collector.cache.invalidate(1)
+        list(collector.scenarios(scenario_instance_id=1))
+        self.assertEqual(collector.cache.statistics['misses'], 2)
+
+
+class _FakeBackend:
+    class Response:
+        def __init__(self, status_code):
+            self.status_code = status_code
+            self.content = b''
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.written = []
+        self.lock = threading.Lock()
+
+    def import_chunks(self, scenario_id, owner_id, job):
+        for index in range(3):
+            yield '{} {} {}'.format(scenario_id, job.name, index)
+
+    def data_write(self, body):
+        with self.lock:
+            if self.failures:
+                self.failures -= 1
+                return self.Response(503)
+            self.written.append(body)
+        return self.Response(204)
+
+
+class TestDataAccessImport(unittest.TestCase):
+    def test_import_pipeline(self):
+        scenario = Scenario(1)
+        scenario.get_or_create_job('ping', 1, 'agent')
+        scenario.get_or_create_subscenario(2).get_or_create_job('iperf3', 2, 'agent')
+        influxdb = _FakeBackend(failures=2)
+        elasticsearch = _FakeBackend()
+        progress = []
+
+        pipeline = ImportPipeline(influxdb, elasticsearch, workers=4, backoff_factor=0, progress=progress.append)
+        report = pipeline.run(scenario)
+
+        expected = ['1 ping 0', '1 ping 1', '1 ping 2', '2 iperf3 0', '2 iperf3 1', '2 iperf3 2']
+        self.assertEqual(sorted(influxdb.written), expected)
+        self.assertEqual(sorted(elasticsearch.written), expected)
+        self.assertEqual(report.chunks, {'influxdb': 6, 'elasticsearch': 6})
+        self.assertEqual(report.retries, 2)
+        self.assertEqual(report.failures, [])
+        self.assertEqual(len(progress), 12)
+
+    def test_import_failure(self):
+        scenario = Scenario(1)
+        scenario.get_or_create_job('ping', 1, 'agent')
+        influxdb = _FakeBackend(failures=3)
+
+        pipeline = ImportPipeline(influxdb, _FakeBackend(), workers=1, retries=1, backoff_factor=0)
+        with self.assertRaises(ImportFailure) as context:
+            pipeline.run(scenario)
+        report = context.exception.report
+        self.assertEqual([backend for backend, _, _ in report.failures], ['influxdb'])
+        self.assertEqual(report.chunks, {'influxdb': 2, 'elasticsearch': 3})
+        self.assertEqual(report.retries, 2)
+
+    def test_import_rejected_actions(self):
+        class BulkBackend(_FakeBackend):
+            def rejected_actions(self, body, response):
+                if body.endswith('1'):
+                    # Retry the action once, then fail for good
+                    return ('{} retried'.format(body), []) if body[0] != 'x' else ('', [(body, 'error')])
+                return '', []
+
+            def import_chunks(self, scenario_id, owner_id, job):
+                yield from ('a 0', 'b 1', 'x 1')
+
+        scenario = Scenario(1)
+        scenario.get_or_create_job('ping', 1, 'agent')
+        elasticsearch = BulkBackend()
+        pipeline = ImportPipeline(_FakeBackend(), elasticsearch, workers=1, backoff_factor=0)
+        with self.assertRaises(ImportFailure) as context:
+            pipeline.run(scenario)
+        report = context.exception.report
+        self.assertEqual(elasticsearch.written, ['a 0', 'b 1', 'b 1 retried', 'x 1'])
+        self.assertEqual(report.failures, [('elasticsearch', 'x 1', 'error')])
+        self.assertEqual(report.retries, 1)
+        # Chunks whose actions were all rejected are not counted as written
+        self.assertEqual(report.chunks['elasticsearch'], 2)
+        self.assertEqual(report.bytes['elasticsearch'], len('a 0') + len('b 1 retried'))
+        self.assertEqual(report.rejected, {'elasticsearch': 1})
+
+
+@unittest.skipIf(pa is None, 'pyarrow is not installed')
+class TestDataAccessArchive(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = os.path.join(directory.name, 'archive')
+
+        self.scenario = Scenario(1)
+        subscenario = self.scenario.get_or_create_subscenario(2)
+        subscenario.owner = self.scenario
+        job = self.scenario.get_or_create_job('ping', 10, 'client')
+        statistics = job.get_or_create_statistics()
+        statistics.add_statistic(1000, rtt=5.5, note='first')
+        statistics.add_statistic(2000, rtt=6.5, big=2**70)
+        statistics.add_statistic(3000, flag=True)
+        statistics = job.get_or_create_statistics('Flow/1')
+        statistics.add_statistic(1000, mixed='text')
+        statistics.add_statistic(2000, mixed=3)
+        job.logs_data.add_log('log', 'logs', 'logstash-2024.01.01', 1500, '1', 1, 'user', 'host', 'message', 42, 14, 6, 'info', 'client')
+        job = subscenario.get_or_create_job('iperf3', 11, 'server')
+        job.get_or_create_statistics().add_statistic(5000, throughput=10**6)
+        subscenario.get_or_create_job('sleep', 12, 'server')
+        write_archive(self.scenario, self.directory)
+
+    def test_round_trip(self):
+        scenario = read_archive(self.directory)
+        self.assertEqual(scenario.instance_id, 1)
+        subscenario, = scenario.own_scenarios
+        self.assertIs(subscenario.owner, scenario)
+        self.assertEqual(
+                [(job.name, job.instance_id, job.agent) for job in scenario.jobs],
+                [('ping', 10, 'client'), ('iperf3', 11, 'server'), ('sleep', 12, 'server')])
+        for expected, job in zip(self.scenario.jobs, scenario.jobs):
+            self.assertEqual(job, expected)
+        statistics = next(scenario.jobs).statistics_data[(None,)]
+        self.assertEqual(statistics.numpy('rtt').dtype, 'float64')
+        self.assertIs(type(statistics.dated_data[2000]['big']), int)
+
+    def test_value_types(self):
+        statistic = Statistic()
+        statistic.add_statistic(1000, value=5, count=1)
+        statistic.add_statistic(2000, value=5.5)
+        statistic.add_statistic(3000, value=6, count=2)
+        job = self.scenario.get_or_create_job('fping', 13, 'client')
+        job.statistics_data[(None,)] = statistic
+        directory = self.directory + '-types'
+        write_archive(self.scenario, directory)
+
+        archive = ScenarioArchive(directory)
+        rows = list(archive.statistic('fping', 13, 'client').rows())
+        self.assertEqual(rows, list(statistic.rows()))
+        self.assertEqual(
+                [type(value) for _, values in rows for value in values.values()],
+                [int, int, float, int, int])
+        df = archive.dataframe('fping', columns=['value'])
+        self.assertEqual(df.columns.tolist()[-4:], ['value', '@job_name', '@agent_name', '@suffix'])
+        self.assertEqual(df['value'].tolist(), [5, 5.5, 6])
+
+    def test_lazy_access(self):
+        archive = ScenarioArchive(self.directory)
+        self.assertEqual(len(archive.jobs), 3)
+        df = archive.dataframe('ping', suffix=None, columns=['rtt'])
+        self.assertEqual(df.columns.tolist(), [
+                'time', '@scenario_instance_id', '@owner_scenario_instance_id',
+                '@job_instance_id', 'rtt', '@job_name', '@agent_name', '@suffix'])
+        self.assertEqual(df['time'].tolist(), [1000, 2000, 3000])
+        self.assertEqual(archive.dataframe(suffix='Flow/1')['mixed'].tolist(), ['text', 3])
+        self.assertEqual(archive.dataframe(job_instance_id=11)['throughput'].tolist(), [10**6])
+        self.assertTrue(archive.dataframe('unknown').empty)
+        self.assertEqual(archive.statistic('ping', 10, 'client', 'Flow/1').json, [
+                {'time': 1000, 'mixed': 'text'},
+                {'time': 2000, 'mixed': 3},
+        ])
+        self.assertEqual(list(archive.logs('ping', 10, 'client').numbered_data), ['log'])
+        with self.assertRaises(KeyError):
+            archive.statistic('ping', 10, 'client', 'Flow2')
+
+    def test_import_archive(self):
+        collector = CollectorConnection('localhost')
+        with unittest.mock.patch('data_access.collector.ImportPipeline') as pipeline:
+            collector.import_scenario(self.directory)
+        jobs, = pipeline.return_value.run_jobs.call_args[0]
+        self.assertNotIsInstance(jobs, list)
+        self.assertEqual(
+                [(scenario_id, owner_id, job.name) for scenario_id, owner_id, job in jobs],
+                [(1, 1, 'ping'), (2, 1, 'iperf3'), (2, 1, 'sleep')])
+
 
 
 if __name__ == '__main__':
@@ -48,6 +48,7 @@ setup(
 
     packages=find_packages(),
     install_requires=['requests', 'pandas', 'matplotlib'],
+    extras_require={'async': ['aiohttp'], 'archive': ['pyarrow']},
 
     test_suite='nose.collector',
     tests_require=['nose'],